@@ -0,0 +1,381 @@
+import os
+import sys
+import ssl
+import json
+import time
+import random
+import signal
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+import multiprocessing
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+"""
+    Starts the simulator and measures its REST API under concurrent load:
+        python benchmarks/http_benchmark.py --desks 1000 --connections 64 --duration 30
+        python benchmarks/http_benchmark.py --protocol both --output results/http.json
+        python benchmarks/http_benchmark.py --server-args "--readers 4" --compare results/http.json
+        python benchmarks/http_benchmark.py --url http://localhost:8000 --desks 0
+"""
+
+API_VERSION = "v2"
+# Requests of the DeskUp Laravel app: it lists the desks and reads each one to sync them,
+# polls the state of the desks on its dashboards, and raises or lowers desks
+OPERATIONS = ("list_desks", "get_desk", "get_state", "put_state")
+DEFAULT_MIX = "list_desks=2,get_desk=48,get_state=40,put_state=10"
+PERCENTILES = (50, 95, 99)
+READY_TIMEOUT_S = 300
+
+def parse_mix(text):
+    """Parse operation weights given as "name=weight,name=weight"."""
+    mix = {}
+    for item in filter(None, text.split(",")):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS or not weight.isdigit():
+            raise ValueError(f"Invalid operation weight: {item}")
+        mix[name] = int(weight)
+    if not any(mix.values()):
+        raise ValueError("The mix has no operations")
+    return mix
+
+def connect(target):
+    host, port = target["host"], target["port"]
+    if target["https"]:
+        context = ssl._create_unverified_context()  # The simulator uses a self-signed certificate
+        return http.client.HTTPSConnection(host, port, context=context, timeout=60)
+    return http.client.HTTPConnection(host, port, timeout=60)
+
+def request(connection, method, path, body=None):
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+def wait_until_ready(target, desks, process=None):
+    """Wait until the server lists at least `desks` desks; returns their IDs."""
+    deadline = time.monotonic() + READY_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"The simulator exited with code {process.returncode}")
+        connection = connect(target)
+        try:
+            status, body = request(connection, "GET", target["base"] + "/desks")
+            if status == 200:
+                desk_ids = json.loads(body)
+                if len(desk_ids) >= desks:
+                    return desk_ids
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            connection.close()
+        time.sleep(0.5)
+    raise RuntimeError(f"The simulator did not list {desks} desks within {READY_TIMEOUT_S} s")
+
+def scrape_metrics(target):
+    """Get the tick and lock metrics of the simulator, summed over shards; None if unavailable."""
+    connection = connect(target)
+    try:
+        status, body = request(connection, "GET", target["base"] + "/metrics")
+    except (OSError, http.client.HTTPException):
+        return None
+    finally:
+        connection.close()
+    if status != 200:
+        return None
+    wanted = ("simulator_tick_overruns_total", "simulator_tick_duration_seconds_count",
+              "simulator_tick_duration_seconds_sum", "simulator_lock_wait_seconds_sum",
+              "simulator_lock_wait_seconds_count", "simulator_lock_hold_seconds_count")
+    metrics = dict.fromkeys(wanted, 0.0)
+    for line in body.decode("utf-8").splitlines():
+        name, _, value = line.partition(" ")
+        name = name.partition("{")[0]
+        if name in metrics:
+            metrics[name] += float(value.rsplit(" ", 1)[-1])
+    return metrics
+
+def run_connection(target, desk_ids, mix, warmup_until, deadline, seed, results):
+    """Send requests on one keep-alive connection until the deadline; record those after the warm-up."""
+    rng = random.Random(seed)
+    names, weights = zip(*mix.items())
+    latencies = {name: [] for name in names}
+    statuses = Counter()
+    errors = 0
+    connection = connect(target)
+    base = target["base"]
+    while (now := time.monotonic()) < deadline:
+        operation = rng.choices(names, weights)[0]
+        body = None
+        if operation == "list_desks":
+            method, path = "GET", f"{base}/desks"
+        else:
+            desk_id = rng.choice(desk_ids)
+            if operation == "get_desk":
+                method, path = "GET", f"{base}/desks/{desk_id}"
+            elif operation == "get_state":
+                method, path = "GET", f"{base}/desks/{desk_id}/state"
+            else:
+                method, path = "PUT", f"{base}/desks/{desk_id}/state"
+                body = json.dumps({"position_mm": rng.randint(680, 1320)})
+        started = time.perf_counter()
+        try:
+            status, _ = request(connection, method, path, body)
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = connect(target)
+            if now >= warmup_until:
+                errors += 1
+            continue
+        if now >= warmup_until:
+            latencies[operation].append(time.perf_counter() - started)
+            statuses[status] += 1
+    connection.close()
+    results.append((latencies, statuses, errors))
+
+def run_process(job):
+    """Run `connections` connection threads in one process; returns their merged results."""
+    target, desk_ids, mix, warmup_until, deadline, connections, seed = job
+    results = []
+    threads = [
+        threading.Thread(target=run_connection,
+                         args=(target, desk_ids, mix, warmup_until, deadline, seed * 1000 + i, results))
+        for i in range(connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = {name: [] for name in mix}
+    statuses = Counter()
+    errors = 0
+    for connection_latencies, connection_statuses, connection_errors in results:
+        for name, values in connection_latencies.items():
+            latencies[name].extend(values)
+        statuses.update(connection_statuses)
+        errors += connection_errors
+    return latencies, statuses, errors
+
+def percentiles(values):
+    """Nearest-rank percentiles of latencies, in milliseconds."""
+    if not values:
+        return {f"p{p}_ms": None for p in PERCENTILES}
+    values = sorted(values)
+    return {f"p{p}_ms": round(values[min(len(values) - 1, max(0, -(-len(values) * p // 100) - 1))] * 1000, 3)
+            for p in PERCENTILES}
+
+def run_load(target, desk_ids, mix, connections, processes, duration_s, warmup_s):
+    """Drive the server from `processes` processes with `connections` connections in total."""
+    processes = max(1, min(processes, connections))
+    start = time.monotonic() + 0.5  # Time to start the processes, which share the monotonic clock
+    warmup_until = start + warmup_s
+    deadline = warmup_until + duration_s
+    jobs = [
+        (target, desk_ids, mix, warmup_until, deadline, connections // processes + (i < connections % processes), i)
+        for i in range(processes)
+    ]
+    with multiprocessing.Pool(processes) as pool:
+        process_results = pool.map(run_process, jobs)
+
+    latencies = {name: [] for name in mix}
+    statuses = Counter()
+    errors = 0
+    for process_latencies, process_statuses, process_errors in process_results:
+        for name, values in process_latencies.items():
+            latencies[name].extend(values)
+        statuses.update(process_statuses)
+        errors += process_errors
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "requests": len(all_latencies),
+        "throughput_rps": round(len(all_latencies) / duration_s, 1),
+        **percentiles(all_latencies),
+        "errors": errors,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "operations": {
+            name: {"requests": len(values), "throughput_rps": round(len(values) / duration_s, 1), **percentiles(values)}
+            for name, values in latencies.items()
+        },
+    }
+
+def start_simulator(args, https, directory, port):
+    """Start the simulator on `port` with a fresh state file; returns the process and its log file."""
+    command = [
+        sys.executable, os.path.join("simulator", "main.py"),
+        "--port", str(port), "--desks", str(args.desks), "--speed", str(args.speed),
+        "--state-file", os.path.join(directory, "desks_state.json"), "--log-level", "WARNING",
+    ]
+    if https:
+        command += ["--https", "--certfile", args.certfile, "--keyfile", args.keyfile]
+    command += args.server_args.split()
+    log = open(os.path.join(directory, "simulator.log"), "w")
+    return subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT), log
+
+def stop_simulator(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(120)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def benchmark(args, protocol, mix):
+    """Run one benchmark over HTTP or HTTPS; returns its results."""
+    https = protocol == "https"
+    port = args.port + (1 if https else 0)
+    host = "localhost"
+    if args.url:
+        url = urlsplit(args.url)
+        https, host, port = url.scheme == "https", url.hostname, url.port or (443 if url.scheme == "https" else 80)
+    target = {"host": host, "port": port, "https": https, "base": f"/api/{API_VERSION}/{args.api_key}"}
+
+    with tempfile.TemporaryDirectory() as directory:
+        process = log = None
+        if not args.url:
+            process, log = start_simulator(args, https, directory, port)
+        try:
+            desk_ids = wait_until_ready(target, args.desks, process)
+            if not desk_ids:
+                raise RuntimeError("The server has no desks")
+            before = scrape_metrics(target)
+            started = time.perf_counter()
+            results = run_load(target, desk_ids, mix, args.connections, args.processes, args.duration, args.warmup)
+            elapsed_s = time.perf_counter() - started
+            after = scrape_metrics(target)
+        except Exception:
+            if log is not None:
+                log.flush()
+                with open(log.name) as f:
+                    sys.stderr.write(f.read()[-4000:])
+            raise
+        finally:
+            if process is not None:
+                stop_simulator(process)
+                log.close()
+
+    results["desks"] = len(desk_ids)
+    if before and after:
+        ticks = after["simulator_tick_duration_seconds_count"] - before["simulator_tick_duration_seconds_count"]
+        tick_s = after["simulator_tick_duration_seconds_sum"] - before["simulator_tick_duration_seconds_sum"]
+        # Only contended acquisitions are observed as waits; every acquisition is observed as a hold
+        lock_waits = after["simulator_lock_wait_seconds_count"] - before["simulator_lock_wait_seconds_count"]
+        lock_acquisitions = after["simulator_lock_hold_seconds_count"] - before["simulator_lock_hold_seconds_count"]
+        lock_wait_s = after["simulator_lock_wait_seconds_sum"] - before["simulator_lock_wait_seconds_sum"]
+        results["simulator"] = {
+            "ticks": int(ticks),  # Of every shard
+            "ticks_per_s": round(ticks / elapsed_s, 2),
+            "tick_overruns": int(after["simulator_tick_overruns_total"] - before["simulator_tick_overruns_total"]),
+            "mean_tick_ms": round(tick_s / ticks * 1000, 3) if ticks else None,
+            "mean_lock_wait_ms": round(lock_wait_s / lock_acquisitions * 1000, 4) if lock_acquisitions else None,
+            "contended_lock_share": round(lock_waits / lock_acquisitions, 4) if lock_acquisitions else None,
+        }
+    else:
+        results["simulator"] = None  # The server has no /metrics endpoint
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(protocol, results):
+    print(f"{protocol.upper()}: {results['requests']} requests, {results['throughput_rps']} requests/s, "
+          f"p50 {results['p50_ms']} ms, p95 {results['p95_ms']} ms, p99 {results['p99_ms']} ms, "
+          f"{results['errors']} errors, statuses {results['statuses']}")
+    for name, operation in results["operations"].items():
+        print(f"  {name:<12} {operation['throughput_rps']:>9} requests/s   p50 {operation['p50_ms']} ms   "
+              f"p95 {operation['p95_ms']} ms   p99 {operation['p99_ms']} ms")
+    simulator = results["simulator"]
+    if simulator:
+        print(f"  simulator: {simulator['ticks']} ticks, {simulator['tick_overruns']} overruns, "
+              f"mean tick {simulator['mean_tick_ms']} ms, mean lock wait {simulator['mean_lock_wait_ms']} ms, "
+              f"contended lock share {simulator['contended_lock_share']}")
+        if simulator["tick_overruns"]:
+            print("  WARNING: ticks overran their interval during the run")
+
+def print_comparison(baseline, report):
+    """Print the change of throughput and latency from a saved report to this one."""
+    print(f"Compared to {baseline.get('commit') or 'baseline'} ({baseline.get('time')}):")
+    for protocol, results in report["results"].items():
+        old = baseline.get("results", {}).get(protocol)
+        if not old:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if old.get(key) and results.get(key) is not None:
+                changes.append(f"{key} {old[key]} -> {results[key]} ({(results[key] / old[key] - 1) * 100:+.1f}%)")
+        print(f"  {protocol.upper()}: " + ", ".join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput and latency of the simulator REST API.")
+    parser.add_argument("--desks", type=int, default=1000, help="Number of desks to simulate (default: 1000)")
+    parser.add_argument("--speed", type=int, default=60, help="Simulation speed (default: 60)")
+    parser.add_argument("--connections", type=int, default=32, help="Concurrent keep-alive connections (default: 32)")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Client processes that share the connections (default: half the CPUs)")
+    parser.add_argument("--duration", type=float, default=20, help="Measured seconds per protocol (default: 20)")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds of load before measuring (default: 3)")
+    parser.add_argument("--mix", type=str, default=DEFAULT_MIX,
+                        help=f"Operation weights, from {', '.join(OPERATIONS)} (default: {DEFAULT_MIX})")
+    parser.add_argument("--protocol", choices=("http", "https", "both"), default="http",
+                        help="Protocol to benchmark; both runs HTTP, then HTTPS (default: http)")
+    parser.add_argument("--port", type=int, default=8400,
+                        help="Port of the started simulator; HTTPS uses the next one (default: 8400)")
+    parser.add_argument("--server-args", type=str, default="",
+                        help='More simulator options, e.g. "--server-mode async" or "--readers 4"')
+    parser.add_argument("--certfile", type=str, default="config/cert.pem", help="Certificate for HTTPS")
+    parser.add_argument("--keyfile", type=str, default="config/key.pem", help="Key for HTTPS")
+    parser.add_argument("--url", type=str, help="Benchmark a running server at this URL instead of starting one")
+    parser.add_argument("--api-key", type=str, help="API key (default: the first one in config/api_keys.json)")
+    parser.add_argument("--output", type=str, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=str, help="Compare the results with a JSON file written by --output")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.api_key is None:
+        with open(os.path.join(ROOT, "config", "api_keys.json")) as f:
+            args.api_key = json.load(f)[0]
+    protocols = ("http", "https") if args.protocol == "both" else (args.protocol,)
+    if args.url:
+        protocols = (urlsplit(args.url).scheme,)
+
+    report = {
+        "commit": git_commit(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "options": {
+            "desks": args.desks, "speed": args.speed, "connections": args.connections, "processes": args.processes,
+            "duration_s": args.duration, "warmup_s": args.warmup, "mix": mix, "server_args": args.server_args,
+            "url": args.url,
+        },
+        "results": {},
+    }
+    for protocol in protocols:
+        report["results"][protocol] = benchmark(args, protocol, mix)
+        print_results(protocol, report["results"][protocol])
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
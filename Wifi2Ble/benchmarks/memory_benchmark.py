@@ -0,0 +1,83 @@
+import os
+import sys
+import gc
+import argparse
+import tempfile
+import tracemalloc
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulator"))
+
+from desk_manager import DeskManager
+from users import UserType
+
+"""
+    Measures the memory the simulator uses per desk, for each engine:
+        python benchmarks/memory_benchmark.py --desks 100000
+        python benchmarks/memory_benchmark.py --desks 1000000 --engine vectorized
+        python benchmarks/memory_benchmark.py --history-samples 2880
+"""
+
+USER_TYPES = (UserType.SEATED, UserType.STANDING, UserType.ACTIVE)
+HISTORY_DESKS = 1000  # Desks whose position history is filled, which is slow
+
+def desk_id(i):
+    return ":".join(f"{(i >> shift) & 0xFF:02x}" for shift in range(40, -8, -8))
+
+def traced_bytes():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+def measure(engine, desks, history_samples=DeskManager.HISTORY_SAMPLES):
+    """Build a fleet and return the bytes per desk of each stage.
+
+    With `history_samples`, the position history of up to HISTORY_DESKS desks is filled
+    to capacity, as for desks that move all the time, and reported per filled desk.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        tracemalloc.start()
+        start = traced_bytes()
+        desk_manager = DeskManager(engine=engine, state_file=os.path.join(directory, "desks_state.json"),
+                                   history_samples=history_samples)
+        empty = traced_bytes()
+        for i in range(desks):
+            desk_manager.add_desk(desk_id(i), f"DESK {1000 + i % 9000}", "Desk-O-Matic Co.", USER_TYPES[i % 3])
+        fleet = traced_bytes()
+        desk_manager.publish_snapshot()
+        published = traced_bytes()
+        for desk_snapshot in desk_manager.snapshot.desks.values():
+            desk_snapshot.encode()  # Cached JSON, as after a GET of every desk
+        read = traced_bytes()
+        history_desks = list(desk_manager.snapshot.desk_ids)[:HISTORY_DESKS] if history_samples > 0 else []
+        for clock_s in range(history_samples):
+            desk_manager.history.record([(desk_id, clock_s, 680 + clock_s % 2) for desk_id in history_desks])
+        history = traced_bytes()
+        tracemalloc.stop()
+
+    stages = {
+        "desks and users": (fleet - empty) / desks,
+        "published snapshot": (published - fleet) / desks,
+        "cached JSON responses": (read - published) / desks,
+    }
+    if history_desks:
+        stages[f"full history ({history_samples})"] = (history - read) / len(history_desks)
+    stages["total"] = sum(stages.values()) + (empty - start) / desks
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the memory used per desk by the simulator engines.")
+    parser.add_argument("--desks", type=int, default=100000, help="Number of desks to create (default: 100000)")
+    parser.add_argument("--engine", choices=DeskManager.ENGINES, action="append",
+                        help="Engine to measure; repeat for several (default: all)")
+    parser.add_argument("--history-samples", type=int, default=DeskManager.HISTORY_SAMPLES,
+                        help=f"Position history samples per desk, as --history-samples of the simulator (default: {DeskManager.HISTORY_SAMPLES})")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    for engine in args.engine or DeskManager.ENGINES:
+        print(f"{engine} engine, {args.desks} desks:")
+        for stage, bytes_per_desk in measure(engine, args.desks, args.history_samples).items():
+            print(f"  {stage:<28} {bytes_per_desk:>8.0f} bytes/desk")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import gc
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+import logging
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulator"))
+
+from desk import Desk
+from desk_manager import DeskManager
+from simple_rest_server import SimpleRESTServer
+from users import UserType
+
+"""
+    Times the hot paths of the simulator and their peak memory, without starting a server:
+        python benchmarks/micro_benchmark.py
+        python benchmarks/micro_benchmark.py --sizes 1000,100000 --only update_pass,save_state_json
+        python benchmarks/micro_benchmark.py --output results/micro.json
+        python benchmarks/micro_benchmark.py --baseline results/micro.json --threshold 0.2
+    With --baseline, exits with status 1 if a benchmark got slower or used more memory
+    than the threshold allows.
+"""
+
+USER_TYPES = (UserType.SEATED, UserType.STANDING, UserType.ACTIVE)
+DEFAULT_SIZES = "10,100,1000,10000,100000"
+PATH_PARSES = 10000  # _is_valid_path calls per measurement
+MIN_TIME_DELTA_S = 0.0001  # Smaller differences are noise, whatever the ratio
+MIN_MEMORY_DELTA = 65536
+
+def desk_id(i):
+    return ":".join(f"{(i >> shift) & 0xFF:02x}" for shift in range(40, -8, -8))
+
+def move_all(desks):
+    """Send every desk to the opposite end of its range, so the next ticks move all of them."""
+    for desk in desks:
+        desk.set_target_position(desk.min_position if desk.get_target_position() > desk.min_position else desk.max_position)
+
+class Fleet:
+    """The desks and the DeskManager that the benchmarks of one fleet size share."""
+    def __init__(self, size, engine, directory):
+        self.size = size
+        self.directory = directory
+        self.desks = [Desk(desk_id(i), f"DESK {1000 + i % 9000}", "Desk-O-Matic Co.") for i in range(size)]
+        self.manager = DeskManager(engine=engine, state_file=self.state_file("json"), restore=False)
+        for i in range(size):
+            self.manager.add_desk(desk_id(i), f"DESK {1000 + i % 9000}", "Desk-O-Matic Co.", USER_TYPES[i % 3])
+        self.manager.publish_snapshot()
+        self.engine = engine
+
+    def state_file(self, extension):
+        return os.path.join(self.directory, f"desks_state.{extension}")
+
+    def reset_users(self):
+        """Give every desk a new user, and move the clock a day on so that all of them are due."""
+        manager = self.manager
+        with manager.lock:
+            manager.user_schedule.clear()
+            manager.user_schedule_seqs.clear()
+            for i, (desk_id, desk) in enumerate(manager.desks.items()):
+                manager._add_user(desk_id, desk, USER_TYPES[i % 3])
+            manager.current_time_s += manager.SECONDS_PER_DAY
+
+def save_as(manager, extension):
+    """Save the state of a DeskManager in the format of `extension`."""
+    state_file = manager.state_file
+    manager.state_file = os.path.splitext(state_file)[0] + "." + extension
+    try:
+        manager.save_state()
+    finally:
+        manager.state_file = state_file
+
+def moving_desks(fleet):
+    move_all(fleet.desks)
+    return fleet.desks
+
+def update_desks(desks):
+    for desk in desks:
+        desk.update()
+
+def moving_manager(fleet):
+    move_all(fleet.manager.desks.values())
+    return fleet.manager
+
+def encode_desks(desks):
+    for desk in desks:
+        json.dumps(desk.get_data())
+
+def path_parser(fleet):
+    """A request handler that is never connected, to call _is_valid_path on."""
+    api_key = "benchmark-key"
+    SimpleRESTServer.API_KEYS = [api_key]
+    handler = SimpleRESTServer.__new__(SimpleRESTServer)
+    handler.path = f"/api/{SimpleRESTServer.VERSION}/{api_key}/desks/{desk_id(1)}/state?expand=state"
+    return handler
+
+def parse_paths(handler):
+    for _ in range(PATH_PARSES):
+        handler._is_valid_path()
+
+def state_file_of(extension):
+    return lambda fleet: (fleet.engine, fleet.state_file(extension))
+
+def load_manager(state):
+    engine, state_file = state
+    DeskManager(engine=engine, state_file=state_file)
+
+def due_users(fleet):
+    fleet.reset_users()
+    return fleet.manager
+
+# Name -> (per desk, setup(fleet) -> argument of run, run(argument)). Every run does the same
+# work after its setup. A save_state benchmark writes the file its load_state benchmark reads.
+BENCHMARKS = {
+    "desk_update": (True, moving_desks, update_desks),  # Desk.update of every desk
+    "update_pass": (True, moving_manager, DeskManager.update_desks_once),  # An _update_all_desks iteration, without its sleep
+    "get_data_json": (True, lambda fleet: fleet.desks, encode_desks),
+    "is_valid_path": (False, path_parser, parse_paths),  # Does not depend on the fleet size
+    "save_state_json": (True, lambda fleet: fleet.manager, DeskManager.save_state),
+    "load_state_json": (True, state_file_of("json"), load_manager),
+    "save_state_bin": (True, lambda fleet: fleet.manager, lambda manager: save_as(manager, "bin")),
+    "load_state_bin": (True, state_file_of("bin"), load_manager),
+    "user_pass": (True, due_users, DeskManager.simulate_users_once),
+}
+
+def measure(setup, run, fleet, repeat):
+    """Time `repeat` runs, each after its own setup, then trace the memory of one more run.
+
+    Like timeit, the garbage collector is off during the timed runs, so that a collection
+    of what earlier runs left does not land in one of them.
+    """
+    times = []
+    for _ in range(repeat):
+        argument = setup(fleet)
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            run(argument)
+            times.append(time.perf_counter() - started)
+        finally:
+            gc.enable()
+
+    argument = setup(fleet)
+    tracemalloc.start()
+    run(argument)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"median_s": statistics.median(times), "min_s": min(times), "peak_bytes": peak_bytes}
+
+def run_benchmarks(names, sizes, engine, repeat, seed):
+    """Run the benchmarks for each fleet size; returns {name: {size: result}}."""
+    results = {name: {} for name in names}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            random.seed(seed)
+            fleet = Fleet(size, engine, directory)
+            for name in names:
+                per_desk, setup, run = BENCHMARKS[name]
+                if not per_desk and results[name]:
+                    continue  # Measured once
+                random.seed(seed)
+                result = measure(setup, run, fleet, repeat)
+                if per_desk:
+                    result["per_desk_us"] = result["median_s"] / size * 1e6
+                else:
+                    result["per_call_us"] = result["median_s"] / PATH_PARSES * 1e6
+                results[name][str(size) if per_desk else "-"] = result
+                print_result(name, size if per_desk else "-", result)
+    return results
+
+def print_result(name, size, result):
+    unit = f"{result['per_desk_us']:>9.3f} us/desk" if "per_desk_us" in result else \
+        f"{result['per_call_us']:>9.3f} us/call"
+    print(f"  {name:<16} {size:>7}   {result['median_s'] * 1000:>10.3f} ms   {unit}   "
+          f"peak {result['peak_bytes'] / 1024:>10.1f} KiB")
+
+def find_regressions(baseline, results, threshold, memory_threshold):
+    """List the benchmarks that are slower or use more memory than the baseline allows."""
+    regressions = []
+    for name, sizes in results.items():
+        for size, result in sizes.items():
+            old = baseline.get("results", {}).get(name, {}).get(size)
+            if old is None:
+                continue
+            # min_s is the least noisy estimate of the cost
+            if result["min_s"] > old["min_s"] * (1 + threshold) and result["min_s"] - old["min_s"] > MIN_TIME_DELTA_S:
+                regressions.append(f"{name} ({size} desks): {old['min_s'] * 1000:.3f} ms -> "
+                                   f"{result['min_s'] * 1000:.3f} ms ({(result['min_s'] / old['min_s'] - 1) * 100:+.0f}%)")
+            if result["peak_bytes"] > old["peak_bytes"] * (1 + memory_threshold) and \
+                    result["peak_bytes"] - old["peak_bytes"] > MIN_MEMORY_DELTA:
+                regressions.append(f"{name} ({size} desks): peak memory {old['peak_bytes']} -> "
+                                   f"{result['peak_bytes']} bytes")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the hot paths of the simulator, without a server.")
+    parser.add_argument("--sizes", type=str, default=DEFAULT_SIZES,
+                        help=f"Fleet sizes, separated by commas (default: {DEFAULT_SIZES})")
+    parser.add_argument("--only", type=str, help=f"Benchmarks to run, separated by commas, from: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--engine", choices=DeskManager.ENGINES, default="object",
+                        help="Engine of the DeskManager benchmarks (default: object)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark and size; the median is reported (default: 5)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the random number generator (default: 1)")
+    parser.add_argument("--output", type=str, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, help="Fail if the results regressed from this JSON file written by --output")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed slowdown from the baseline, as a fraction (default: 0.25)")
+    parser.add_argument("--memory-threshold", type=float, default=0.25,
+                        help="Allowed peak memory growth from the baseline, as a fraction (default: 0.25)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)  # Collisions would be logged as errors
+
+    try:
+        sizes = [int(size) for size in args.sizes.split(",") if size]
+    except ValueError:
+        parser.error(f"Invalid sizes: {args.sizes}")
+    selected = set(args.only.split(",") if args.only else BENCHMARKS)
+    unknown = selected - set(BENCHMARKS)
+    if unknown or not sizes or min(sizes) < 1 or args.repeat < 1:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}" if unknown else "Sizes and --repeat must be positive")
+    for extension in ("json", "bin"):
+        if f"load_state_{extension}" in selected:
+            selected.add(f"save_state_{extension}")  # Writes the file it loads
+    names = [name for name in BENCHMARKS if name in selected]
+
+    print(f"{args.engine} engine, median of {args.repeat} runs:")
+    results = run_benchmarks(names, sizes, args.engine, args.repeat, args.seed)
+    report = {
+        "commit": git_commit(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "options": {"sizes": sizes, "engine": args.engine, "repeat": args.repeat, "seed": args.seed},
+        "results": results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(baseline, results, args.threshold, args.memory_threshold)
+        if regressions:
+            print(f"Regressions from {baseline.get('commit') or args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions from {baseline.get('commit') or args.baseline}.")
+
+if __name__ == "__main__":
+    main()
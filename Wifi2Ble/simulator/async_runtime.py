@@ -0,0 +1,249 @@
+import io
+import json
+import asyncio
+import logging
+from http import HTTPStatus
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1024 * 1024  # Longest request body read into memory; larger ones get 413
+
+
+class RequestError(Exception):
+    """A request rejected before its body is read; the reply closes the connection."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+    def response(self):
+        body = json.dumps({"error": str(self)}).encode("utf-8")
+        head = (f"HTTP/1.1 {self.status} {HTTPStatus(self.status).phrase}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        return head.encode("ascii") + body
+
+
+class PeriodicTask:
+    """Runs a callback every `interval_s` seconds against a monotonic deadline.
+
+    Deadlines form a fixed grid (start + n * interval_s), so the time a run takes
+    never delays the following ones. When a run ends past one or more deadlines it
+    overran; with the "catch-up" policy the missed runs follow immediately, at most
+    MAX_CATCH_UP_RUNS of them, and with "skip" only the latest one does. The other
+    missed runs are dropped and counted as skipped.
+    """
+    POLICIES = ("catch-up", "skip")
+    MAX_CATCH_UP_RUNS = 10
+    REPORT_INTERVAL_S = 10  # At most one overrun warning per task in this many seconds
+
+    def __init__(self, name, interval_s, callback, policy="catch-up"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown overrun policy: {policy}")
+        self.name = name
+        self.interval_s = interval_s
+        self.callback = callback
+        self.policy = policy
+        self.runs = 0
+        self.overruns = 0  # Runs that ended after the next deadline
+        self.skipped = 0
+        self.max_lag_s = 0.0  # Longest delay of a run behind its deadline
+        self.last_report = None
+
+    async def run(self, after_run=None):
+        """Run the callback on schedule until cancelled, calling `after_run` after each run."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            # Sleep even when late, so connections are served between catch-up runs
+            await asyncio.sleep(max(deadline - loop.time(), 0))
+            self.max_lag_s = max(self.max_lag_s, loop.time() - deadline)
+            try:
+                self.callback()
+            except Exception:
+                logger.exception("%s failed.", self.name)
+            self.runs += 1
+            if after_run:
+                after_run()
+
+            deadline += self.interval_s
+            now = loop.time()
+            if now >= deadline:
+                self.overruns += 1
+                missed = int((now - deadline) // self.interval_s) + 1
+                allowed = self.MAX_CATCH_UP_RUNS if self.policy == "catch-up" else 1
+                if missed > allowed:
+                    self.skipped += missed - allowed
+                    deadline += (missed - allowed) * self.interval_s
+                self._report_overrun(now)
+
+    def _report_overrun(self, now):
+        if self.last_report is None or now - self.last_report >= self.REPORT_INTERVAL_S:
+            self.last_report = now
+            logger.warning("%s overran its %s s interval (%s overruns, %s runs skipped so far).",
+                           self.name, self.interval_s, self.overruns, self.skipped)
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "max_lag_s": round(self.max_lag_s, 3),
+        }
+
+class AsyncRuntime:
+    """Runs the simulation and the HTTP server on one asyncio event loop.
+
+    Replaces the update, user simulation and power-off threads and the HTTP worker pool:
+    the three simulation loops are PeriodicTasks, and each connection is a coroutine that
+    reads whole requests and serves them with the handler (an AsyncRESTServer). Only the
+    state journal keeps its writer thread. A handler runs to completion on the loop, so
+    a slow request delays the next tick; overruns are counted and logged.
+    """
+    REQUEST_QUEUE_SIZE = 128
+    MAX_HEADER_BYTES = 65536
+    KEEP_ALIVE_TIMEOUT_S = 15  # Idle connections are closed after this many seconds
+
+    def __init__(self, desk_manager, server_address, handler, ssl_context=None, overrun_policy="catch-up"):
+        """Takes the arguments of an HTTPServer after the desk manager.
+
+        `handler(request, client_address, server)` returns the handler that served `request`.
+        """
+        self.desk_manager = desk_manager
+        self.server_address = server_address
+        self.handler = handler
+        self.ssl_context = ssl_context
+        self.tasks = [
+            PeriodicTask("Desk update", desk_manager.TICK_INTERVAL_S, self._tick, overrun_policy),
+            # Users and power changes follow the simulated clock, so repeating a missed pass adds nothing
+            PeriodicTask("User simulation", desk_manager.USER_SIMULATION_INTERVAL_S,
+                         desk_manager.simulate_users_once, "skip"),
+            PeriodicTask("Power simulation", desk_manager.POWER_SIMULATION_INTERVAL_S, self._simulate_power, "skip"),
+        ]
+        self.published = None
+        self.connections = {}  # Task serving each open connection -> its stream writer
+        self.closing = False
+
+    def _tick(self):
+        self.desk_manager.update_desks_once()
+        self.desk_manager.increment_time()
+
+    def _simulate_power(self):
+        self.desk_manager.restore_power_once()
+        self.desk_manager.power_off_once()
+
+    def _notify_streams(self):
+        """Wake the event streams after a pass that may have published a snapshot."""
+        published, self.published = self.published, asyncio.Event()
+        published.set()
+
+    def stats(self):
+        """Get the run, overrun and skip counts of each periodic task."""
+        return {task.name: task.stats() for task in self.tasks}
+
+    def serve_forever(self):
+        """Serve until interrupted; raises KeyboardInterrupt on Ctrl+C."""
+        try:
+            asyncio.run(self.serve())
+        finally:
+            for name, stats in self.stats().items():
+                logger.info("%s: %s runs, %s overruns, %s skipped, max lag %s s.",
+                            name, stats["runs"], stats["overruns"], stats["skipped"], stats["max_lag_s"])
+
+    def server_close(self):
+        """The listening socket is closed when the event loop stops."""
+
+    async def serve(self):
+        self.published = asyncio.Event()
+        server = await asyncio.start_server(
+            self._serve_connection, *self.server_address, ssl=self.ssl_context,
+            backlog=self.REQUEST_QUEUE_SIZE, limit=self.MAX_HEADER_BYTES,
+        )
+        try:
+            async with server:
+                await asyncio.gather(*(task.run(self._notify_streams) for task in self.tasks))
+        finally:
+            # End the open connections and event streams while the loop still runs
+            self.closing = True
+            self._notify_streams()
+            for writer in self.connections.values():
+                writer.close()
+            await asyncio.gather(*self.connections, return_exceptions=True)
+
+    async def _serve_connection(self, reader, writer):
+        """Serve the requests of one connection until it is closed, times out or becomes an event stream."""
+        client_address = writer.get_extra_info("peername")
+        connection = asyncio.current_task()
+        self.connections[connection] = writer
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.KEEP_ALIVE_TIMEOUT_S)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    return
+                except RequestError as e:
+                    logger.warning("Request from %s rejected: %s", client_address, e)
+                    writer.write(e.response())
+                    await writer.drain()
+                    return
+                handler = self.handler(request, client_address, self)
+                writer.write(handler.wfile.getvalue())
+                await writer.drain()
+                if handler.event_subscription is not None:
+                    await self._stream_events(handler, writer)
+                    return
+                if handler.close_connection:
+                    return
+        except OSError as e:
+            logger.info("Connection from %s closed: %s", client_address, e)
+        except Exception:
+            logger.exception("Error while serving %s.", client_address)
+        finally:
+            self.connections.pop(connection, None)
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        """Read the request line, the headers and the body announced by Content-Length.
+
+        Raises RequestError for a Content-Length that is not a non-negative integer, or above MAX_BODY_BYTES.
+        """
+        head = await reader.readuntil(b"\r\n\r\n")
+        content_length = 0
+        for line in head.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                value = value.strip()
+                if not value.isdigit():
+                    raise RequestError(400, "Invalid data")
+                content_length = int(value)
+                if content_length > MAX_BODY_BYTES:
+                    raise RequestError(413, "Request body too large")
+        return head + await reader.readexactly(content_length)
+
+    async def _stream_events(self, handler, writer):
+        """Send the batches of an event stream as snapshots are published, with heartbeats in between."""
+        loop = asyncio.get_running_loop()
+        subscription = handler.event_subscription
+        last_write = loop.time()
+        try:
+            while not subscription.overflowed and not self.closing:
+                batch = subscription.get(0)
+                if batch is not None:
+                    handler.wfile = io.BytesIO()
+                    handler._write_events(*batch)
+                    writer.write(handler.wfile.getvalue())
+                elif loop.time() - last_write >= handler.HEARTBEAT_INTERVAL_S:
+                    writer.write(b": keep-alive\n\n")
+                else:
+                    try:
+                        await asyncio.wait_for(self.published.wait(),
+                                               handler.HEARTBEAT_INTERVAL_S - (loop.time() - last_write))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await writer.drain()
+                last_write = loop.time()
+        except OSError as e:
+            logger.info("Event stream client disconnected: %s", e)
+        finally:
+            self.desk_manager.events.unsubscribe(subscription)
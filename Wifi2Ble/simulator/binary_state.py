@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BinaryStateFormat:
+    """Layout of the binary state file.
+
+    A header, then one fixed-width record per desk, the errors of all desks, and a
+    table of interned strings (desk IDs, names, manufacturers, statuses and user
+    types). Records refer to strings and errors by index, so a reader can decode any
+    desk straight from the memory-mapped file without parsing the others.
+    """
+    MAGIC = b"DSKB"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHxxqqqIIII")  # magic, version, current_time_s, simulation_speed,
+                                            # journal_version, desks, errors, strings, string bytes
+    RECORD = struct.Struct("<IIIIIIBdiqqqII")
+    RECORD_FIELDS = ("desk_id", "name", "manufacturer", "status", "user", "config_extras", "flags", "position_mm",
+                     "speed_mms", "activationsCounter", "sitStandCounter", "clock_s", "first_error", "error_count")
+    SUMMARY = struct.Struct("<I12xI4xB44x")  # desk_id, user and flags of a record
+    ERROR = struct.Struct("<qi")  # time_s, errorCode
+    STRING_OFFSET = struct.Struct("<I")
+    STRING_SPAN = struct.Struct("<II")  # Two consecutive string offsets: start and end
+    NO_STRING = 0xFFFFFFFF
+
+    # Flag bits
+    FLAGS = ("isPositionLost", "isOverloadProtectionUp", "isOverloadProtectionDown", "isAntiCollision")
+    POWERED_OFF = 1 << len(FLAGS)
+
+    STATE_FIELDS = {"position_mm", "speed_mms", "status", *FLAGS}
+    USAGE_FIELDS = {"activationsCounter", "sitStandCounter"}
+    CONFIG_FIELDS = ("name", "manufacturer")
+
+def write_binary_state(f, state):
+    """Write a state (in the state file format) to a binary file object."""
+    fmt = BinaryStateFormat
+    strings = {}
+
+    def intern(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    meta = {key: state[key] for key in ("current_time_s", "simulation_speed", "journal_version") if key in state}
+    records = bytearray()
+    errors = bytearray()
+    error_count = 0
+    desk_count = 0
+    for desk_id, entry in state.items():
+        if desk_id in meta:
+            continue
+        desk_data = entry["desk_data"]
+        config, desk_state, usage = desk_data["config"], desk_data["state"], desk_data["usage"]
+        if not desk_state.keys() <= fmt.STATE_FIELDS or not usage.keys() <= fmt.USAGE_FIELDS:
+            raise ValueError(f"Desk {desk_id} has fields the binary format cannot store")
+
+        config_extras = {key: value for key, value in config.items() if key not in fmt.CONFIG_FIELDS}
+        flags = sum(1 << bit for bit, flag in enumerate(fmt.FLAGS) if desk_state.get(flag))
+        if entry.get("powered_off"):
+            flags |= fmt.POWERED_OFF
+        records += fmt.RECORD.pack(
+            intern(desk_id),
+            intern(config["name"]),
+            intern(config["manufacturer"]),
+            intern(desk_state["status"]),
+            intern(entry["user"]),
+            intern(json.dumps(config_extras)) if config_extras else fmt.NO_STRING,
+            flags,
+            desk_state["position_mm"],
+            desk_state["speed_mms"],
+            usage["activationsCounter"],
+            usage["sitStandCounter"],
+            desk_data["clock_s"],
+            error_count,
+            len(desk_data["lastErrors"]),
+        )
+        for error in desk_data["lastErrors"]:
+            errors += fmt.ERROR.pack(error["time_s"], error["errorCode"])
+        error_count += len(desk_data["lastErrors"])
+        desk_count += 1
+
+    encoded = [value.encode("utf-8") for value in strings]
+    offsets = bytearray()
+    offset = 0
+    for value in encoded:
+        offsets += fmt.STRING_OFFSET.pack(offset)
+        offset += len(value)
+    offsets += fmt.STRING_OFFSET.pack(offset)
+
+    f.write(fmt.HEADER.pack(
+        fmt.MAGIC, fmt.VERSION,
+        meta.get("current_time_s", 43200), meta.get("simulation_speed", 60), meta.get("journal_version", 0),
+        desk_count, error_count, len(encoded), offset,
+    ))
+    f.write(records)
+    f.write(errors)
+    f.write(offsets)
+    f.write(b"".join(encoded))
+
+class BinaryStateReader:
+    """Memory-mapped reader of a binary state file.
+
+    Desks are decoded one at a time while iterating, and each distinct string is
+    decoded once, so loading a large fleet never holds a parsed copy of the whole file.
+    """
+    def __init__(self, path):
+        fmt = BinaryStateFormat
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        if len(self.buffer) < fmt.HEADER.size:
+            raise ValueError(f"{path} is not a binary state file")
+        (magic, version, current_time_s, simulation_speed, journal_version,
+         self.desk_count, error_count, string_count, string_bytes) = fmt.HEADER.unpack_from(self.buffer)
+        if magic != fmt.MAGIC or version != fmt.VERSION:
+            raise ValueError(f"{path} is not a binary state file of version {fmt.VERSION}")
+        self.meta = {
+            "current_time_s": current_time_s,
+            "simulation_speed": simulation_speed,
+            "journal_version": journal_version,
+        }
+        self.records_offset = fmt.HEADER.size
+        self.errors_offset = self.records_offset + self.desk_count * fmt.RECORD.size
+        offsets_offset = self.errors_offset + error_count * fmt.ERROR.size
+        self.strings_offset = offsets_offset + (string_count + 1) * fmt.STRING_OFFSET.size
+        if self.strings_offset + string_bytes != len(self.buffer):
+            raise ValueError(f"{path} is truncated or corrupt")
+        self.offsets_offset = offsets_offset
+        self.strings = [None] * string_count
+
+    def __len__(self):
+        return self.desk_count
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def string(self, index):
+        """Decode an interned string once and reuse it afterwards."""
+        value = self.strings[index]
+        if value is None:
+            start, end = BinaryStateFormat.STRING_SPAN.unpack_from(
+                self.buffer, self.offsets_offset + index * BinaryStateFormat.STRING_OFFSET.size)
+            value = self.strings[index] = str(self.buffer[self.strings_offset + start:self.strings_offset + end], "utf-8")
+        return value
+
+    def string_table(self):
+        """Decode every interned string at once, for readers that need most of them."""
+        count = len(self.strings)
+        offsets = struct.unpack_from(f"<{count + 1}I", self.buffer, self.offsets_offset)
+        blob = bytes(self.buffer[self.strings_offset:self.strings_offset + offsets[-1]])
+        self.strings = [str(blob[start:end], "utf-8") for start, end in zip(offsets, offsets[1:])]
+        return self.strings
+
+    def __iter__(self):
+        """Yield (desk_id, entry) for every desk, with entries in the state file format."""
+        records = memoryview(self.buffer)[self.records_offset:self.errors_offset]
+        for record in BinaryStateFormat.RECORD.iter_unpack(records):
+            yield self._decode(record)
+
+    def entry(self, index):
+        """Decode the (desk_id, entry) of the desk stored at `index`."""
+        fmt = BinaryStateFormat
+        return self._decode(fmt.RECORD.unpack_from(self.buffer, self.records_offset + index * fmt.RECORD.size))
+
+    def summaries(self):
+        """Yield (index, desk_id, user, powered_off) of every desk, without decoding the rest of it."""
+        fmt = BinaryStateFormat
+        string = self.string
+        for index, (desk_id, user, flags) in enumerate(fmt.SUMMARY.iter_unpack(self.records())):
+            yield index, string(desk_id), string(user), bool(flags & fmt.POWERED_OFF)
+
+    def desk_data(self, index):
+        """Decode the data of the desk stored at `index`, without its clock."""
+        desk_data = dict(self.entry(index)[1]["desk_data"])
+        del desk_data["clock_s"]
+        return desk_data
+
+    def records(self):
+        """Get the record area, for readers that decode the fixed-width records in bulk."""
+        return memoryview(self.buffer)[self.records_offset:self.errors_offset]
+
+    def errors(self):
+        """Get the error area, for readers that decode the fixed-width records in bulk."""
+        return memoryview(self.buffer)[self.errors_offset:self.offsets_offset]
+
+    def detach(self):
+        """Copy the file into memory and close the mapping, so the file can be replaced."""
+        if isinstance(self.buffer, mmap.mmap):
+            buffer = self.buffer
+            self.buffer = bytes(buffer)
+            buffer.close()
+
+    def _decode(self, record):
+        """Get (desk_id, entry) from the fields of a record."""
+        fmt = BinaryStateFormat
+        string = self.string
+        (desk_id, name, manufacturer, status, user, config_extras, flags, position, speed,
+         activations, sit_stand, clock_s, first_error, error_count) = record
+        config = {"name": string(name), "manufacturer": string(manufacturer)}
+        if config_extras != fmt.NO_STRING:
+            config.update(json.loads(string(config_extras)))
+        state = {
+            "position_mm": int(position) if position.is_integer() else position,
+            "speed_mms": speed,
+            "status": string(status),
+        }
+        for bit, flag in enumerate(fmt.FLAGS):
+            state[flag] = bool(flags & (1 << bit))
+        errors = []
+        for i in range(first_error, first_error + error_count):
+            time_s, error_code = fmt.ERROR.unpack_from(self.buffer, self.errors_offset + i * fmt.ERROR.size)
+            errors.append({"time_s": time_s, "errorCode": error_code})
+        entry = {
+            "desk_data": {
+                "config": config,
+                "state": state,
+                "usage": {"activationsCounter": activations, "sitStandCounter": sit_stand},
+                "lastErrors": errors,
+                "clock_s": clock_s,
+            },
+            "user": string(user),
+        }
+        if flags & fmt.POWERED_OFF:
+            entry["powered_off"] = True
+        return string(desk_id), entry
+
+    def to_state(self):
+        """Read the whole file into a state in the state file format."""
+        state = dict(iter(self))
+        state.update(self.meta)
+        return state
+
+def is_binary_state_file(path):
+    return path.endswith(".bin")
+
+def convert(source, destination):
+    """Convert a state file between the JSON and binary formats, chosen by the file extensions."""
+    if is_binary_state_file(source):
+        state = BinaryStateReader(source).to_state()
+    else:
+        with open(source, "r") as f:
+            state = json.load(f)
+
+    if is_binary_state_file(destination):
+        with open(destination, "wb") as f:
+            write_binary_state(f, state)
+    else:
+        with open(destination, "w") as f:
+            json.dump(state, f)
+    logger.info("Converted %s to %s.", source, destination)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a desk state file between JSON and binary (.bin) formats.")
+    parser.add_argument("source", help="State file to read, e.g. data/desks_state.json")
+    parser.add_argument("destination", help="State file to write, e.g. data/desks_state.bin")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        convert(args.source, args.destination)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("Conversion failed: %s", e)
+        sys.exit(1)
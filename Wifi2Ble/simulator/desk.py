@@ -1,14 +1,72 @@
 import threading
 import random
 import logging
+from collections.abc import Sequence
 
 logger = logging.getLogger(__name__)
+motion_logger = logging.getLogger(f"{__name__}.motion")  # Every moving desk on every tick
+collision_logger = logging.getLogger(f"{__name__}.collisions")
+
+class LockPool:
+    """Fixed set of reentrant locks shared by many objects, picked by key.
+
+    Desks take their lock from a pool instead of allocating one each, which bounds
+    the number of locks for large fleets. A desk lock is never held while waiting for
+    another desk's lock, so two desks sharing a lock cannot deadlock.
+    """
+    def __init__(self, size=256):
+        self.locks = [threading.RLock() for _ in range(size)]
+
+    def get(self, key):
+        return self.locks[hash(key) % len(self.locks)]
+
+class ErrorRing(Sequence):
+    """Ring buffer of a desk's last errors, read most recent first as {"time_s", "errorCode"} dicts.
+
+    Errors are stored as (time_s, errorCode) tuples; once the ring is full, a new
+    error overwrites the oldest one.
+    """
+    __slots__ = ("capacity", "entries", "oldest")
+
+    def __init__(self, capacity, errors=()):
+        self.capacity = capacity
+        self.entries = [(error["time_s"], error["errorCode"]) for error in list(errors)[:capacity]]
+        self.entries.reverse()  # Oldest first
+        self.oldest = 0
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self.entries):
+            raise IndexError(position)
+        time_s, error_code = self.entries[(self.oldest - 1 - position) % len(self.entries)]
+        return {"time_s": time_s, "errorCode": error_code}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def appendleft(self, error):
+        """Record a new most recent error, dropping the oldest one if the ring is full."""
+        entry = (error["time_s"], error["errorCode"])
+        if len(self.entries) < self.capacity:
+            self.entries.insert(self.oldest, entry)
+            self.oldest = (self.oldest + 1) % len(self.entries)
+        else:
+            self.entries[self.oldest] = entry
+            self.oldest = (self.oldest + 1) % self.capacity
+
+    def __repr__(self):
+        return repr(list(self))
 
 class Desk:
     DEFAULT_SPEED_MMS = 32
     COLLISION_CHANCE = 0.03
     MAX_ERROR_COUNT = 10
     ERROR_CODE_E93 = 93
+    CATEGORIES = ("config", "state", "usage", "lastErrors")
+    LOCKS = LockPool()
+
+    # No per-instance __dict__: this is most of a desk's memory in large fleets
+    __slots__ = ("desk_id", "config", "state", "usage", "_last_errors", "lock", "target_position_mm", "min_position",
+                 "max_position", "sit_stand_position", "clock_s", "collision_occurred", "version", "on_change")
 
     def __init__(self, desk_id, name, manufacturer, initial_position=680, min_position=680, max_position=1320):
         self.desk_id = desk_id
@@ -32,17 +90,28 @@ class Desk:
         self.lastErrors = [
             {"time_s": 120, "errorCode": 93},
         ]
-        self.lock = threading.RLock()
+        self.lock = self.LOCKS.get(desk_id)
         self.target_position_mm = initial_position
         self.min_position = min_position
         self.max_position = max_position
         self.sit_stand_position = (max_position - min_position) / 2 + min_position
         self.clock_s = 180
         self.collision_occurred = False
+        self.version = 0
+        self.on_change = None  # Called with the desk after each change to its data
+
+        logger.debug("Desk initialized: ID=%s, Name=%s, Manufacturer=%s, Position=%s, Min=%s, Max=%s",
+                    desk_id, name, manufacturer, initial_position, min_position, max_position)
+
 
-        logger.info(f"Desk initialized: ID={desk_id}, Name={name}, Manufacturer={manufacturer}, "
-            f"Position={initial_position}, Min={min_position}, Max={max_position}")
+    @property
+    def lastErrors(self):
+        """Most recent errors first, in a ring buffer holding at most MAX_ERROR_COUNT."""
+        return self._last_errors
 
+    @lastErrors.setter
+    def lastErrors(self, errors):
+        self._last_errors = ErrorRing(self.MAX_ERROR_COUNT, errors)
 
     def get_target_position(self):
         """Get the target position to move towards"""
@@ -53,23 +122,34 @@ class Desk:
         """Set the target position to move towards, respecting min and max limits."""
         with self.lock:
             self.target_position_mm = max(self.min_position, min(position_mm, self.max_position))
-            logger.info(f"Desk target position set: ID={self.desk_id}, Requested={position_mm}, Accepted={self.target_position_mm}")
+            logger.info("Desk target position set: ID=%s, Requested=%s, Accepted=%s",
+                        self.desk_id, position_mm, self.target_position_mm)
             if position_mm != self.state["position_mm"]:
                 self.usage["activationsCounter"] += 1
-                logger.info(f"Desk activated: ID={self.desk_id}, ActivationCounter={self.usage['activationsCounter']}")
+                logger.info("Desk activated: ID=%s, ActivationCounter=%s", self.desk_id, self.usage["activationsCounter"])
+            self._changed()
+
+    def _changed(self):
+        """Record a change to the desk's data and notify the listener."""
+        self.version += 1
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def has_pending_motion(self):
+        """True if the desk's data will change over time without further updates. Ticked desks change only in update()."""
+        return False
 
     def _generate_error(self):
         """Generate an error during movement."""
         with self.lock:
-            self.lastErrors.insert(0, {"time_s": self.clock_s, "errorCode": self.ERROR_CODE_E93})
-            if len(self.lastErrors) > self.MAX_ERROR_COUNT:
-                self.lastErrors.pop()
+            self.lastErrors.appendleft({"time_s": self.clock_s, "errorCode": self.ERROR_CODE_E93})
 
             self.state["isAntiCollision"] = True
             self.state["status"] = "Collision"
             self.collision_occurred = True
 
-            logger.error(f"Desk collision detected: ID={self.desk_id}, Time={self.clock_s}, Position={self.state['position_mm']}")
+            collision_logger.error("Desk collision detected: ID=%s, Time=%s, Position=%s",
+                                   self.desk_id, self.clock_s, self.state["position_mm"])
 
     def update(self):
         """Update clock and position gradually toward target_position_mm within limits, increment sitStandCounter on crossing."""
@@ -84,32 +164,35 @@ class Desk:
                 return
 
             previous_position = self.state["position_mm"]
+            previous_speed = self.state["speed_mms"]
             if self.state["position_mm"] < self.target_position_mm:
                 self.state["position_mm"] += min(self.DEFAULT_SPEED_MMS, self.target_position_mm - self.state["position_mm"])
                 self.state["position_mm"] = min(self.state["position_mm"], self.max_position)
                 self.state["speed_mms"] = self.DEFAULT_SPEED_MMS
                 successful_movement = True
-                logger.info(f"Desk moving up: ID={self.desk_id}, Position={self.state['position_mm']}")
+                motion_logger.info("Desk moving up: ID=%s, Position=%s", self.desk_id, self.state["position_mm"])
             elif self.state["position_mm"] > self.target_position_mm:
                 self.state["position_mm"] -= min(self.DEFAULT_SPEED_MMS, self.state["position_mm"] - self.target_position_mm)
                 self.state["position_mm"] = max(self.state["position_mm"], self.min_position)
                 self.state["speed_mms"] = -self.DEFAULT_SPEED_MMS
                 successful_movement = True
-                logger.info(f"Desk moving down: ID={self.desk_id}, Position={self.state['position_mm']}")
+                motion_logger.info("Desk moving down: ID=%s, Position=%s", self.desk_id, self.state["position_mm"])
             else:
                 self.state["speed_mms"] = 0
 
             if (previous_position < self.sit_stand_position <= self.state["position_mm"]) or \
                (previous_position > self.sit_stand_position >= self.state["position_mm"]):
                 self.usage["sitStandCounter"] += 1
-                logger.info(f"Desk crossed sit/stand position: ID={self.desk_id}, SitStandCounter={self.usage['sitStandCounter']}")
+                motion_logger.info("Desk crossed sit/stand position: ID=%s, SitStandCounter=%s",
+                                   self.desk_id, self.usage["sitStandCounter"])
 
 
             if successful_movement:
                 if self.state["isAntiCollision"]:
                     self.state["isAntiCollision"] = False
                     self.state["status"] = "Normal"
-                    logger.info(f"Desk reset from collision: ID={self.desk_id}, Time={self.clock_s}, Position={self.state['position_mm']}")
+                    collision_logger.info("Desk reset from collision: ID=%s, Time=%s, Position=%s",
+                                          self.desk_id, self.clock_s, self.state["position_mm"])
                 elif random.random() < self.COLLISION_CHANCE:
                     self._generate_error()
                     if self.state["speed_mms"] > 0:
@@ -120,6 +203,17 @@ class Desk:
                     self.target_position_mm = self.state["position_mm"]
                     self.state["speed_mms"] = 0
 
+            if successful_movement or self.state["speed_mms"] != previous_speed:
+                self._changed()
+
+    def suspend(self):
+        """Called when the desk is powered off. Ticked desks simply stop receiving update() calls."""
+        pass
+
+    def resume(self):
+        """Called when the desk is powered back on."""
+        pass
+
     def get_data(self):
         """Get a snapshot of the desk's data."""
         with self.lock:
@@ -127,9 +221,20 @@ class Desk:
                 "config": self.config,
                 "state": self.state,
                 "usage": self.usage,
-                "lastErrors": self.lastErrors,
+                "lastErrors": list(self.lastErrors),
             }
 
+    def copy_data(self, categories=CATEGORIES):
+        """Get a detached copy of the selected categories, safe to serialize outside the lock."""
+        with self.lock:
+            data = {}
+            for category in categories:
+                if category == "lastErrors":
+                    data[category] = [dict(error) for error in self.lastErrors]
+                else:
+                    data[category] = dict(getattr(self, category))
+            return data
+
     def update_category(self, category, data):
         """Update a specific category of the desk."""
         with self.lock:
@@ -0,0 +1,83 @@
+import json
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class DeskEvent:
+    """One change of one desk, as published with a fleet snapshot."""
+    __slots__ = ("event", "desk_id", "data")
+
+    ONLINE = "online"    # Desk added or powered on; data is its full state
+    STATE = "state"      # Data holds only the state fields that changed
+    OFFLINE = "offline"  # Desk powered off or removed; data holds the reason
+
+    def __init__(self, event, desk_id, data):
+        self.event = event
+        self.desk_id = desk_id
+        self.data = data
+
+    def to_json(self):
+        return json.dumps({"desk_id": self.desk_id, **self.data})
+
+class Subscription:
+    """Queue of event batches for one stream, optionally limited to some desk IDs."""
+    MAX_PENDING_BATCHES = 256
+
+    def __init__(self, desk_ids=None):
+        self.desk_ids = frozenset(desk_ids) if desk_ids else None
+        self.batches = queue.Queue(maxsize=self.MAX_PENDING_BATCHES)
+        self.overflowed = False
+
+    def wants(self, desk_id):
+        return self.desk_ids is None or desk_id in self.desk_ids
+
+    def offer(self, version, events):
+        """Queue the matching events of a batch. Returns False if the reader fell too far behind."""
+        events = [event for event in events if self.wants(event.desk_id)]
+        if not events:
+            return True
+        try:
+            self.batches.put_nowait((version, events))
+            return True
+        except queue.Full:
+            self.overflowed = True
+            return False
+
+    def get(self, timeout):
+        """Wait for the next (snapshot version, events) batch, or None after `timeout` seconds."""
+        try:
+            return self.batches.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class DeskEventHub:
+    """Fans out the desk changes of each published snapshot to the open event streams."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = []
+
+    def has_subscribers(self):
+        return bool(self.subscriptions)
+
+    def subscribe(self, desk_ids=None):
+        subscription = Subscription(desk_ids)
+        with self.lock:
+            self.subscriptions = self.subscriptions + [subscription]
+        logger.info("Event stream opened (%s open).", len(self.subscriptions))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions = [s for s in self.subscriptions if s is not subscription]
+        logger.info("Event stream closed (%s open).", len(self.subscriptions))
+
+    def publish(self, version, events):
+        """Offer a batch to every subscription, dropping the ones that overflowed."""
+        if not events:
+            return
+        for subscription in self.subscriptions:
+            if not subscription.offer(version, events):
+                logger.warning("Event stream dropped: the client is not keeping up.")
+                self.unsubscribe(subscription)
@@ -0,0 +1,101 @@
+import bisect
+import math
+import itertools
+import threading
+from collections import defaultdict
+
+class DeskIndex:
+    """Secondary indexes over the published desks, for filtered desk lists.
+
+    Each desk is indexed by status, manufacturer, user type and power state, and by
+    position in buckets of POSITION_BUCKET_MM kept in sorted order, so a lookup costs
+    about the number of desks matching its most selective filter instead of a scan of
+    the fleet. Powered-off desks stay indexed with their last published data.
+    DeskManager updates the index with every snapshot, under `lock`.
+    """
+    FIELDS = ("status", "manufacturer", "user_type", "power")
+    POSITION_BUCKET_MM = 10
+
+    def __init__(self, desk_ids):
+        """`desk_ids` gives the order of the results; desks indexed later go after them."""
+        self.values = {}  # Desk ID -> (status, manufacturer, user_type, power, position_mm)
+        self.by_value = {field: defaultdict(set) for field in self.FIELDS}
+        self.position_buckets = {}  # Bucket -> IDs of the desks in it
+        self.bucket_keys = []  # Sorted
+        self.ordinals = {desk_id: ordinal for ordinal, desk_id in enumerate(desk_ids)}
+        self.lock = threading.Lock()
+
+    def update(self, desk_id, values):
+        """Index a desk with new (status, manufacturer, user_type, power, position_mm), or remove it if None."""
+        old_values = self.values.pop(desk_id, None)
+        if old_values is not None:
+            for field, value in zip(self.FIELDS, old_values):
+                desk_ids = self.by_value[field][value]
+                desk_ids.discard(desk_id)
+                if not desk_ids:
+                    del self.by_value[field][value]
+            bucket = self._bucket(old_values[-1])
+            self.position_buckets[bucket].discard(desk_id)
+            if not self.position_buckets[bucket]:
+                del self.position_buckets[bucket]
+                del self.bucket_keys[bisect.bisect_left(self.bucket_keys, bucket)]
+        if values is None:
+            self.ordinals.pop(desk_id, None)
+            return
+
+        self.values[desk_id] = values
+        for field, value in zip(self.FIELDS, values):
+            self.by_value[field][value].add(desk_id)
+        bucket = self._bucket(values[-1])
+        if bucket not in self.position_buckets:
+            self.position_buckets[bucket] = set()
+            bisect.insort(self.bucket_keys, bucket)
+        self.position_buckets[bucket].add(desk_id)
+        if desk_id not in self.ordinals:
+            self.ordinals[desk_id] = len(self.ordinals)
+
+    def _bucket(self, position_mm):
+        return int(position_mm // self.POSITION_BUCKET_MM)
+
+    def _in_position_range(self, low, high):
+        """Get the sets of desk IDs of the position buckets that overlap [low, high]."""
+        if not low <= high or low == math.inf or high == -math.inf:
+            return []  # Also when a bound is NaN
+        start = 0 if low == -math.inf else bisect.bisect_left(self.bucket_keys, self._bucket(low))
+        end = len(self.bucket_keys) if high == math.inf else bisect.bisect_right(self.bucket_keys, self._bucket(high))
+        return [self.position_buckets[bucket] for bucket in self.bucket_keys[start:end]]
+
+    def find(self, position_mm_gte=None, position_mm_lte=None, **filters):
+        """Get the IDs of the desks matching every filter, in index order.
+
+        `filters` maps fields to collections of accepted values. Each filter is sized from
+        the sets of its index without listing them, and only the desks of the smallest one
+        are checked against the other filters, so a broad filter like power="on" costs
+        nothing when a narrower one is given. A desk is in one set per field and in one
+        position bucket, so the candidates have no duplicates.
+        """
+        checks = [(self.FIELDS.index(field), set(accepted)) for field, accepted in filters.items()]
+        candidate_sets = None  # Sets of desk IDs of the most selective filter
+        smallest = len(self.values)
+        for field, accepted in filters.items():
+            index = self.by_value[field]
+            sets = [index[value] for value in set(accepted) if value in index]
+            size = sum(map(len, sets))
+            if size < smallest:
+                candidate_sets, smallest = sets, size
+        low = -math.inf if position_mm_gte is None else position_mm_gte
+        high = math.inf if position_mm_lte is None else position_mm_lte
+        if position_mm_gte is not None or position_mm_lte is not None:
+            sets = self._in_position_range(low, high)
+            size = sum(map(len, sets))
+            if size < smallest:
+                candidate_sets, smallest = sets, size
+        desk_ids = self.values if candidate_sets is None else itertools.chain.from_iterable(candidate_sets)
+
+        matches = []
+        for desk_id in desk_ids:
+            values = self.values[desk_id]
+            if low <= values[-1] <= high and all(values[field] in accepted for field, accepted in checks):
+                matches.append(desk_id)
+        matches.sort(key=self.ordinals.__getitem__)
+        return matches
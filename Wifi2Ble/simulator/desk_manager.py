@@ -1,103 +1,521 @@
 import threading
 import time
+import heapq
+import collections
+import gc
 import json
 import os
 import random
 import logging
+from functools import partial
 from desk import Desk
+from fleet_snapshot import DeskSnapshot, FleetSnapshot
+from desk_events import DeskEvent, DeskEventHub
+from desk_index import DeskIndex
+from position_history import HistoryDisabledError, PositionHistory
+from fleet_stats import FleetStats
+from metrics import Counter, Gauge, Histogram, Registry, TimedLock, LOCK_BUCKETS_S
+from state_journal import StateJournal, read_state, write_state
+from fleet_engine import VectorizedFleet
+from lazy_motion import LazyDesk, TickClock
 from users import SeatedUser, StandingUser, ActiveUser, UserType
 
 logger = logging.getLogger(__name__)
 
 class DeskManager:
-    STATE_FILE = "data/desks_state.json"
+    STATE_FILE = "data/desks_state.json"  # A .bin extension selects the binary format
     SECONDS_PER_DAY = 86400
     DAY_START_HOUR = 6
     NIGHT_START_HOUR = 18
     POWER_OFF_CHANCE = 0.03
+    TICK_INTERVAL_S = 1  # Real seconds between desk updates; each advances the clock by simulation_speed
+    USER_SIMULATION_INTERVAL_S = 5  # Real seconds between user simulation passes
+    POWER_SIMULATION_INTERVAL_S = 5  # Real seconds between power-off and power-on checks
+    CHANGE_LOG_SIZE = 100000  # Desk changes kept for get_changes; older cursors get a full resync
+    HISTORY_SAMPLES = 0  # Changes of position kept per desk for get_position_history; 16 bytes each, off by default
 
-    def __init__(self, simulation_speed=60):
+    ENGINES = ("object", "vectorized", "lazy")
+    USER_TYPES = {user_type.value: user_type for user_type in UserType}  # As stored in the state file
+
+    def __init__(self, simulation_speed=60, engine="object", state_file=None, seed=None, restore=True,
+                 history_samples=HISTORY_SAMPLES):
+        """`seed` seeds the vectorized engine's random generator; `restore` loads the saved state.
+
+        `history_samples` is the number of changes of position kept per desk; 0 disables the history.
+        """
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.engine = engine
+        self.state_file = state_file or self.STATE_FILE
+        self.journal_file = os.path.splitext(self.state_file)[0] + ".journal"
+        self.fleet = VectorizedFleet(seed) if engine == "vectorized" else None
+        self.tick_clock = TickClock() if engine == "lazy" else None
         self.desks = {}
         self.users = {}
+        # Timer heap of (due simulated time, sequence, desk ID). A user's entry is live only
+        # while its sequence matches user_schedule_seqs; users without a live entry are idle
+        # until woken by a move of their desk.
+        self.user_schedule = []
+        self.user_schedule_seqs = {}
+        self.user_schedule_counter = 0
+        self.daytime = None
         self.powered_off_desks = {}
+        # Reads are served from the last published snapshot; desks that changed since
+        # are collected in dirty_desks by their on_change hook.
+        self.snapshot = FleetSnapshot()
+        self.dirty_desks = set()
+        self.dirty_lock = threading.Lock()
+        self.membership_changed = False
+        # ETags and change cursors combine this per-run tag with a snapshot version, so
+        # they are never reused after a restart or when a desk ID is re-added.
+        self.run_tag = os.urandom(4).hex()
+        self.events = DeskEventHub()
+        # (snapshot version, IDs of the desks that changed in it), oldest first
+        self.change_log = collections.deque()
+        self.change_log_length = 0
+        self.change_log_floor = 0  # Changes up to this snapshot version were dropped
+        self.change_log_lock = threading.Lock()
+        self.journal = None
+        self.shared_state = None  # SharedStateWriter that reader processes serve GETs from
+        self.desk_index = None  # Built by the first filtered query, then updated with each snapshot
+        self.history = PositionHistory(history_samples) if history_samples > 0 else None
+        self.fleet_stats = None  # Built by the first stats query, then updated with each snapshot
         self.update_thread = None
         self.simulation_thread = None
         self.power_off_thread = None
         self.stop_event = threading.Event()
-        self.lock = threading.Lock()
+        self.metrics = Registry()
+        self.tick_duration = self.metrics.add(Histogram(
+            "simulator_tick_duration_seconds", "Time to advance the desks by one tick and publish them."))
+        self.tick_overruns = self.metrics.add(Counter(
+            "simulator_tick_overruns_total", "Ticks that took longer than the tick interval."))
+        self.tick_overruns.inc(0)
+        self.user_simulation_duration = self.metrics.add(Histogram(
+            "simulator_user_simulation_duration_seconds", "Time of a user simulation pass."))
+        self.desk_count = self.metrics.add(Gauge("simulator_desks", "Desks by power state.", ("power",)))
+        self.lock = TimedLock(
+            self.metrics.add(Histogram("simulator_lock_wait_seconds",
+                                       "Time contended acquisitions waited for the desk manager lock.",
+                                       buckets=LOCK_BUCKETS_S)),
+            self.metrics.add(Histogram("simulator_lock_hold_seconds", "Time the desk manager lock was held.",
+                                       buckets=LOCK_BUCKETS_S)))
         self.current_time_s = 43200
         self.simulation_speed = simulation_speed
-        self.load_state()
+        if restore:
+            self.load_state()
 
-    def get_desk_ids(self):
-        """Return the list of desk IDs, excluding powered-off desks."""
-        with self.lock:
-            return [desk_id for desk_id in self.desks if desk_id not in self.powered_off_desks]
+    def get_desk_ids(self, **filters):
+        """Return the list of desk IDs, excluding powered-off desks, from the published snapshot.
+
+        Filters select desks by status, manufacturer, user_type (collections of accepted
+        values), power ("on", "off" or "all") and position_mm_gte/position_mm_lte; see find_desks.
+        """
+        if not filters:
+            return list(self.snapshot.desk_ids)
+        return self.find_desks(**filters)[1]
+
+    def find_desks(self, power="on", **filters):
+        """Get the published snapshot and the IDs of the desks in it matching the filters, from the index."""
+        desk_index = self._get_desk_index()
+        if power != "all":
+            filters["power"] = (power,)
+        with desk_index.lock:
+            return self.snapshot, desk_index.find(**filters)
+
+    def _get_desk_index(self):
+        """Get the desk index, building it from the published snapshot on first use."""
+        if self.desk_index is None:
+            with self.lock:
+                if self.desk_index is None:
+                    snapshot = self.snapshot
+                    desk_index = DeskIndex(self.desks)
+                    for desk_id in self.desks:
+                        if desk_id in snapshot.desks:
+                            desk_index.update(desk_id, self._index_values(desk_id, snapshot.desks[desk_id].data, "on"))
+                        elif desk_id in self.powered_off_desks:
+                            desk_index.update(desk_id, self._index_values(desk_id, self.desks[desk_id].copy_data(), "off"))
+                    self.desk_index = desk_index
+                    logger.info("Desk index built (%s desks).", len(desk_index.values))
+        return self.desk_index
+
+    def _index_values(self, desk_id, data, power):
+        """Get the indexed values of a desk. Caller must hold the lock."""
+        state = data["state"]
+        return (state["status"], data["config"]["manufacturer"], self._user_type_name(self.users[desk_id]), power,
+                state["position_mm"])
 
     def get_desk(self, desk_id):
         """Get a desk by its ID."""
         with self.lock:
-            if desk_id in self.powered_off_desks:
-                logger.warning(f"Desk ID={desk_id} is currently powered off.")
-                return None
-            return self.desks.get(desk_id)
+            return self._get_active_desk(desk_id)
+
+    def _get_active_desk(self, desk_id):
+        """Get a desk by its ID unless it is powered off. Caller must hold the lock."""
+        if desk_id in self.powered_off_desks:
+            logger.debug("Desk ID=%s is currently powered off.", desk_id)
+            return None
+        return self.desks.get(desk_id)
+
+    def get_desk_snapshot(self, desk_id):
+        """Get the published DeskSnapshot of a powered-on desk, or None."""
+        return self.snapshot.get(desk_id)
 
     def get_desk_data(self, desk_id):
-        """Get a desk's data snapshot by its ID."""
-        logger.debug(f"Retrieving data for desk ID={desk_id}.")
-        desk = self.get_desk(desk_id)
-        return desk.get_data() if desk else None
+        """Get a desk's data by its ID from the published snapshot. The result must not be modified."""
+        logger.debug("Retrieving data for desk ID=%s.", desk_id)
+        desk_snapshot = self.snapshot.get(desk_id)
+        return desk_snapshot.data if desk_snapshot else None
+
+    def get_position_history(self, desk_id, start=None, end=None, resolution=None):
+        """Get the position history of a desk between two times of its clock, or None if the desk does not exist.
+
+        Without `resolution`, returns every change of position; with it, the min, max and
+        average position over each `resolution` seconds. `start` defaults to the oldest
+        sample kept, `end` to the desk's current clock. Raises ValueError for a bad range or
+        resolution, and HistoryDisabledError once they are valid if no history is kept.
+        """
+        desk = self.desks.get(desk_id)
+        if desk is None:
+            return None
+        if end is None:
+            end = desk.clock_s
+        if start is None:
+            first_clock = self.history.first_clock(desk_id) if self.history is not None else None
+            start = min(first_clock, end) if first_clock is not None else end
+        if start > end:
+            raise ValueError(f"Invalid history range: {start} to {end}")
+        if resolution is not None:
+            PositionHistory.check_resolution(start, end, resolution)
+        if self.history is None:
+            raise HistoryDisabledError("Position history is disabled")
+        history = {"desk_id": desk_id, "from": start, "to": end}
+        if resolution is None:
+            history["samples"] = self.history.samples(desk_id, start, end)
+        else:
+            history["resolution"] = resolution
+            history["buckets"] = self.history.downsample(desk_id, start, end, resolution)
+        return history
+
+    def get_stats(self, desk_id=None):
+        """Get the fleet usage aggregates, or the posture times of one desk (None if it does not exist)."""
+        fleet_stats = self._get_fleet_stats()
+        with fleet_stats.lock:
+            if desk_id is not None:
+                return fleet_stats.get_desk(desk_id, self.current_time_s)
+            return fleet_stats.get(self.current_time_s)
+
+    def _get_fleet_stats(self):
+        """Get the fleet aggregates, counting the published desks on first use."""
+        if self.fleet_stats is None:
+            with self.lock:
+                if self.fleet_stats is None:
+                    snapshot = self.snapshot
+                    fleet_stats = FleetStats(self.current_time_s)
+                    for desk_id, desk in self.desks.items():
+                        if desk_id in snapshot.desks:
+                            fleet_stats.update(desk_id, snapshot.desks[desk_id].data, desk.sit_stand_position,
+                                               self.current_time_s)
+                        elif desk_id in self.powered_off_desks:
+                            fleet_stats.power_off(desk_id, desk.copy_data(), self.current_time_s)
+                    self.fleet_stats = fleet_stats
+                    logger.info("Fleet stats started (%s desks).", len(fleet_stats.desks))
+        return self.fleet_stats
+
+    def get_all_desk_data(self, categories=Desk.CATEGORIES, **filters):
+        """Get the selected categories of every active desk from one published snapshot.
+
+        With filters (as for get_desk_ids), only the matching desks; powered-off desks have no data to send.
+        """
+        if filters:
+            snapshot, desk_ids = self.find_desks(**filters)
+        else:
+            snapshot = self.snapshot
+            desk_ids = snapshot.desk_ids
+        all_data = {}
+        for desk_id in desk_ids:
+            desk_snapshot = snapshot.desks.get(desk_id)
+            if desk_snapshot is not None:
+                data = desk_snapshot.data
+                all_data[desk_id] = {category: data[category] for category in categories}
+        return all_data
 
     def get_desk_category(self, desk_id, category):
         """Get a specific category from a desk."""
-        desk = self.get_desk(desk_id)
-        if desk:
-            data = desk.get_data()
+        data = self.get_desk_data(desk_id)
+        if data:
             return data.get(category)
         return None
 
     def update_desk_category(self, desk_id, category, data):
-        """Update a specific category of a desk."""
-        desk = self.get_desk(desk_id)
-        return desk.update_category(category, data) if desk else False
+        """Update a specific category of a desk.
+
+        Returns the accepted target position of the desk, or None if the desk or category was not found.
+        """
+        with self.lock:
+            desk = self._get_active_desk(desk_id)
+            if desk and desk.update_category(category, data):
+                self._wake_user(desk_id)
+                return desk.get_target_position()
+            return None
+
+    def update_desks_category(self, category, updates):
+        """Update the same category of many desks in one pass, taking the manager lock once.
+
+        `updates` is a list of (desk_id, data) pairs. Returns the accepted target position
+        of each desk, in order, or None where the desk or category was not found.
+        """
+        results = []
+        with self.lock:
+            for desk_id, data in updates:
+                desk = self._get_active_desk(desk_id)
+                if desk and desk.update_category(category, data):
+                    self._wake_user(desk_id)
+                    results.append(desk.get_target_position())
+                else:
+                    results.append(None)
+        return results
 
     def add_desk(self, desk_id, name, manufacturer, user_type: UserType):
         """Add a new desk with a unique ID."""
         with self.lock:
             if desk_id not in self.desks:
-                desk = Desk(desk_id, name, manufacturer)
+                desk = self._create_desk(desk_id, name, manufacturer)
                 self.desks[desk_id] = desk
-                self.users[desk_id] = self._create_user(desk, user_type)
-                logger.info(f"Desk ID={desk_id} added with user type {user_type}.")
+                self._add_user(desk_id, desk, user_type)
+                self._mark_membership_changed(desk)
+                logger.debug("Desk ID=%s added with user type %s.", desk_id, user_type)
                 return True
-            logger.warning(f"Desk ID={desk_id} already exists. Skipping addition.")
+            logger.warning("Desk ID=%s already exists. Skipping addition.", desk_id)
             return False
 
     def remove_desk(self, desk_id):
         """Remove a desk by its ID."""
         with self.lock:
             if desk_id in self.desks:
-                del self.desks[desk_id]
+                desk = self.desks.pop(desk_id)
+                if self.fleet is not None:
+                    self.fleet.remove_desk(desk)
                 del self.users[desk_id]
+                self.user_schedule_seqs.pop(desk_id, None)
                 self.powered_off_desks.pop(desk_id, None)
-                logger.info(f"Desk ID={desk_id} and user removed.")
+                if self.history is not None:
+                    self.history.remove(desk_id)
+                if self.fleet_stats is not None:
+                    with self.fleet_stats.lock:
+                        self.fleet_stats.remove(desk_id, self.current_time_s)
+                self._mark_membership_changed(desk)
+                logger.info("Desk ID=%s and user removed.", desk_id)
                 return True
-            logger.warning(f"Attempted to remove non-existent desk ID={desk_id}.")
+            logger.warning("Attempted to remove non-existent desk ID=%s.", desk_id)
             return False
 
     def is_daytime(self):
         """Check if the current time is during the day."""
         simulated_time_h = (self.current_time_s % self.SECONDS_PER_DAY) / 3600
-        daytime = self.DAY_START_HOUR <= simulated_time_h < self.NIGHT_START_HOUR
-        logger.info(f"Daytime check: {'Day' if daytime else 'Night'} (Simulated hour: {simulated_time_h:.2f}).")
-        return daytime
+        return self.DAY_START_HOUR <= simulated_time_h < self.NIGHT_START_HOUR
 
     def increment_time(self):
         """Increment the simulation time by one second."""
         with self.lock:
             self.current_time_s += self.simulation_speed
-            logger.debug(f"Simulation time incremented to {self.current_time_s} seconds.")
+            logger.debug("Simulation time incremented to %s seconds.", self.current_time_s)
+
+
+    def _create_desk(self, desk_id, name, manufacturer, initial_position=680):
+        """Create a desk backed by the configured engine."""
+        if self.fleet is not None:
+            desk = self.fleet.add_desk(desk_id, name, manufacturer, initial_position)
+        elif self.tick_clock is not None:
+            desk = LazyDesk(desk_id, name, manufacturer, self.tick_clock, initial_position)
+        else:
+            desk = Desk(desk_id, name, manufacturer, initial_position)
+        desk.on_change = self._mark_dirty
+        return desk
+
+    def _mark_dirty(self, desk):
+        """Queue a changed desk for the next published snapshot."""
+        with self.dirty_lock:
+            self.dirty_desks.add(desk.desk_id)
+
+    def _mark_membership_changed(self, desk):
+        """Queue a desk that was added, removed, powered off or powered on. Caller must hold the lock."""
+        self.membership_changed = True
+        self._mark_dirty(desk)
+
+    def publish_snapshot(self):
+        """Publish a new snapshot containing the desks changed since the previous one.
+
+        Only dirty desks are copied; the other entries are shared with the previous
+        snapshot. Readers keep using the old snapshot until the reference is swapped.
+        """
+        with self.lock:
+            with self.dirty_lock:
+                dirty_desks, self.dirty_desks = self.dirty_desks, set()
+            if not dirty_desks and not self.membership_changed:
+                return self.snapshot
+
+            previous = self.snapshot
+            version = previous.version + 1
+            desks = dict(previous.desks)
+            events = []
+            changed_ids = []
+            journal_entries = {}
+            index_updates = []
+            history_samples = []
+            stats_updates = []  # (desk_id, data, sit/stand position or None if powered off)
+            for desk_id in dirty_desks:
+                desk = None if desk_id in self.powered_off_desks else self.desks.get(desk_id)
+                old_entry = desks.get(desk_id)
+                if desk is None:
+                    if old_entry is not None:
+                        del desks[desk_id]
+                        changed_ids.append(desk_id)
+                        reason = "powered_off" if desk_id in self.desks else "removed"
+                        if self.journal is not None:
+                            journal_entries[desk_id] = self._state_entry(desk_id) if desk_id in self.desks else None
+                        if self.desk_index is not None:
+                            index_updates.append((desk_id, self._index_values(desk_id, old_entry.data, "off")
+                                                  if desk_id in self.desks else None))
+                        if self.fleet_stats is not None and desk_id in self.desks:
+                            stats_updates.append((desk_id, old_entry.data, None))
+                        events.append(DeskEvent(DeskEvent.OFFLINE, desk_id, {"reason": reason}))
+                    elif desk_id in self.desks:
+                        # Never published: powered off before its first snapshot
+                        if self.desk_index is not None:
+                            index_updates.append((desk_id, self._index_values(desk_id, self.desks[desk_id].copy_data(), "off")))
+                        if self.fleet_stats is not None:
+                            stats_updates.append((desk_id, self.desks[desk_id].copy_data(), None))
+                    elif self.desk_index is not None:
+                        index_updates.append((desk_id, None))  # Removed while powered off
+                    continue
 
+                data = desk.copy_data()  # Settles lazily evaluated desks, so read the version after
+                if desk.has_pending_motion():
+                    # Lazily evaluated desks only change when read, so read them again next pass
+                    self._mark_dirty(desk)
+                if old_entry is not None and old_entry.data == data:
+                    continue
+                desks[desk_id] = DeskSnapshot(desk_id, desk.version, data, f'"{self.run_tag}-{version}"')
+                changed_ids.append(desk_id)
+                if self.journal is not None:
+                    journal_entries[desk_id] = self._state_entry(desk_id, data)
+                if self.desk_index is not None:
+                    index_updates.append((desk_id, self._index_values(desk_id, data, "on")))
+                if self.history is not None:
+                    history_samples.append((desk_id, desk.clock_s, data["state"]["position_mm"]))
+                if self.fleet_stats is not None:
+                    stats_updates.append((desk_id, data, desk.sit_stand_position))
+                if old_entry is None:
+                    events.append(DeskEvent(DeskEvent.ONLINE, desk_id, {"state": data["state"]}))
+                else:
+                    old_state = old_entry.data["state"]
+                    delta = {key: value for key, value in data["state"].items() if old_state.get(key) != value}
+                    if delta:
+                        events.append(DeskEvent(DeskEvent.STATE, desk_id, {"state": delta}))
+
+            desk_ids = previous.desk_ids
+            if self.membership_changed:
+                desk_ids = tuple(desk_id for desk_id in self.desks if desk_id in desks)
+                self.membership_changed = False
+            if changed_ids:
+                self._log_changes(version, changed_ids)
+            if journal_entries:
+                self.journal.record(version, self.current_time_s, journal_entries)
+            if history_samples:
+                self.history.record(history_samples)
+            if stats_updates:
+                with self.fleet_stats.lock:
+                    for desk_id, data, sit_stand_position in stats_updates:
+                        if sit_stand_position is None:
+                            self.fleet_stats.power_off(desk_id, data, self.current_time_s)
+                        else:
+                            self.fleet_stats.update(desk_id, data, sit_stand_position, self.current_time_s)
+            snapshot = FleetSnapshot(version, desks, desk_ids)
+            if self.desk_index is None:
+                self.snapshot = snapshot
+            else:
+                # Queries see the index and the snapshot change together
+                with self.desk_index.lock:
+                    for desk_id, values in index_updates:
+                        self.desk_index.update(desk_id, values)
+                    self.snapshot = snapshot
+            if self.shared_state is not None and changed_ids:
+                self.shared_state.publish(self.snapshot, changed_ids)
+            if self.events.has_subscribers():
+                self.events.publish(version, events)
+            return self.snapshot
+
+    def _state_entry(self, desk_id, data=None):
+        """Get the state file entry of a desk, from `data` if given. Caller must hold the lock."""
+        desk = self.desks[desk_id]
+        if data is None:
+            data = desk.copy_data()
+        entry = {
+            "desk_data": {**data, "clock_s": desk.clock_s},
+            "user": self._user_type_name(self.users[desk_id]),
+        }
+        if desk_id in self.powered_off_desks:
+            entry["powered_off"] = True
+        return entry
+
+    @staticmethod
+    def _user_type_name(user):
+        """Get the UserType value of a user, as stored in the state file."""
+        if isinstance(user, UserType):
+            return user.value  # Not created yet
+        return user.__class__.__name__.replace("User", "").lower()
+
+    def _log_changes(self, version, desk_ids):
+        """Append the desks changed in a snapshot version to the change log, dropping the oldest."""
+        with self.change_log_lock:
+            self.change_log.append((version, desk_ids))
+            self.change_log_length += len(desk_ids)
+            while self.change_log_length > self.CHANGE_LOG_SIZE and len(self.change_log) > 1:
+                dropped_version, dropped_ids = self.change_log.popleft()
+                self.change_log_length -= len(dropped_ids)
+                self.change_log_floor = dropped_version
+
+    def get_changes(self, cursor=None):
+        """Get the desks that changed since a cursor returned by a previous call.
+
+        Returns (cursor, full, desks, removed): the new cursor, whether this is a full
+        resync, the data of each changed desk, and the IDs of desks that were removed or
+        powered off. Without a cursor, or with one that is too old or from another run,
+        every desk is returned with full set to True.
+        """
+        snapshot = self.snapshot
+        since = self._parse_cursor(cursor)
+        changed = set()
+        with self.change_log_lock:
+            full = since is None or since < self.change_log_floor or since > snapshot.version
+            if not full:
+                for version, desk_ids in reversed(self.change_log):
+                    if version <= since:
+                        break
+                    if version <= snapshot.version:
+                        changed.update(desk_ids)
+
+        new_cursor = f"{self.run_tag}-{snapshot.version}"
+        if full:
+            desks = {desk_id: snapshot.desks[desk_id].data for desk_id in snapshot.desk_ids}
+            return new_cursor, True, desks, []
+
+        desks = {}
+        removed = []
+        for desk_id in changed:
+            desk_snapshot = snapshot.desks.get(desk_id)
+            if desk_snapshot:
+                desks[desk_id] = desk_snapshot.data
+            else:
+                removed.append(desk_id)
+        return new_cursor, False, desks, removed
+
+    def _parse_cursor(self, cursor):
+        """Get the snapshot version of a cursor from this run, or None."""
+        run_tag, _, version = (cursor or "").partition("-")
+        if run_tag != self.run_tag or not version.isdigit():
+            return None
+        return int(version)
 
     def _create_user(self, desk, user_type: UserType):
         """Create a behavior instance based on the behavior type."""
@@ -110,63 +528,187 @@ class DeskManager:
         else:
             raise ValueError(f"Unknown behavior type: {user_type}")
 
-    def _update_all_desks(self):
-        """Continuously update each desk's position."""
-        while not self.stop_event.is_set():
-            with self.lock:
+    def _add_user(self, desk_id, desk, user_type: UserType):
+        """Create the user of a desk and schedule its first action."""
+        user = self._create_user(desk, user_type)
+        self.users[desk_id] = user
+        self._schedule_user(desk_id, user.first_action_s(self.current_time_s))
+
+    def _add_loaded_user(self, desk_id, user_type: UserType):
+        """Add the user of a loaded desk. It is created on its first pass, so loading a large fleet stays cheap."""
+        self.users[desk_id] = user_type
+        self._schedule_user(desk_id, self.current_time_s)
+
+    def _schedule_user(self, desk_id, due_s):
+        """Schedule a user's next action at simulated time `due_s`, or idle it if `due_s` is None."""
+        if due_s is None:
+            self.user_schedule_seqs.pop(desk_id, None)
+            return
+        self.user_schedule_counter += 1
+        self.user_schedule_seqs[desk_id] = self.user_schedule_counter
+        heapq.heappush(self.user_schedule, (due_s, self.user_schedule_counter, desk_id))
+
+    def _wake_user(self, desk_id):
+        """Make an idle user check its desk on the next pass. Caller must hold the lock."""
+        if desk_id in self.users and desk_id not in self.user_schedule_seqs:
+            self._schedule_user(desk_id, self.current_time_s)
+
+    def wake_user(self, desk_id):
+        """Make an idle user check its desk on the next pass, e.g. after the desk was moved remotely."""
+        with self.lock:
+            self._wake_user(desk_id)
+
+    def update_desks_once(self):
+        """Advance every powered-on desk by one second."""
+        started = time.perf_counter()
+        with self.lock:
+            if self.tick_clock is not None:
+                # Lazy desks derive their motion from the tick count when read
+                self.tick_clock.advance()
+            elif self.fleet is not None:
+                changed_rows = self.fleet.step(self.desks[desk_id].index for desk_id in self.powered_off_desks)
+                with self.dirty_lock:
+                    self.dirty_desks.update(self.fleet.row_ids[index] for index in changed_rows.tolist())
+            else:
                 for desk_id, desk in self.desks.items():
                     if desk_id not in self.powered_off_desks:
                         desk.update()
-            time.sleep(1)
+        self.publish_snapshot()
+        duration_s = time.perf_counter() - started
+        self.tick_duration.observe(duration_s)
+        if duration_s > self.TICK_INTERVAL_S:
+            self.tick_overruns.inc()
+
+    def _update_all_desks(self):
+        """Continuously update each desk's position."""
+        while not self.stop_event.is_set():
+            self.update_desks_once()
+            time.sleep(self.TICK_INTERVAL_S)
             self.increment_time()
 
+    def simulate_users_once(self):
+        """Run the actions of every user that is due. Returns the number of users that acted."""
+        started = time.perf_counter()
+        try:
+            return self._run_due_users()
+        finally:
+            self.publish_snapshot()
+            self.user_simulation_duration.observe(time.perf_counter() - started)
+
+    def _run_due_users(self):
+        """Pop and run the due entries of the user timer heap."""
+        with self.lock:
+            now_s = self.current_time_s
+            daytime = self.is_daytime()
+            if daytime != self.daytime:
+                self.daytime = daytime
+                logger.info("%s started (Simulated hour: %.2f).",
+                            "Day" if daytime else "Night", (now_s % self.SECONDS_PER_DAY) / 3600)
+            if not daytime:
+                return 0
+
+            acted = 0
+            while self.user_schedule and self.user_schedule[0][0] <= now_s:
+                _, seq, desk_id = heapq.heappop(self.user_schedule)
+                if self.user_schedule_seqs.get(desk_id) != seq:
+                    continue  # Superseded or removed
+
+                if desk_id in self.powered_off_desks:
+                    # Try again once the desk is powered back on, but never within this pass
+                    self._schedule_user(desk_id, max(self.powered_off_desks[desk_id], now_s + self.simulation_speed))
+                    continue
+
+                user = self.users[desk_id]
+                if isinstance(user, UserType):
+                    # User of a loaded desk: create it and schedule its first action
+                    user = self.users[desk_id] = self._create_user(self.desks[desk_id], user)
+                    self._schedule_user(desk_id, user.first_action_s(now_s))
+                    continue
+
+                logger.debug("User simulation for desk %s.", desk_id)
+                self._schedule_user(desk_id, user.act(now_s, self.simulation_speed))
+                acted += 1
+            return acted
+
     def _simulate_user_interactions(self):
-        """Simulate local user interactions for all desks."""
+        """Simulate local user interactions for the users that are due."""
         while not self.stop_event.is_set():
-            if self.is_daytime():
-                with self.lock:
-                    for desk_id, user in self.users.items():
-                        if desk_id not in self.powered_off_desks:
-                            logger.debug(f"User simulation for desk {desk_id}.")
-                            user.simulate(5*self.simulation_speed)
-            time.sleep(5)
+            self.simulate_users_once()
+            time.sleep(self.USER_SIMULATION_INTERVAL_S)
+
+    def power_off_once(self):
+        """Randomly power off one desk, with a small chance."""
+        with self.lock:
+            if self.desks and random.random() < self.POWER_OFF_CHANCE:
+                desk_id = random.choice(list(self.desks.keys()))
+                if desk_id not in self.powered_off_desks:
+                    power_off_duration_s = random.randint(5*60, 2*60*60)
+                    self.powered_off_desks[desk_id] = self.current_time_s + power_off_duration_s
+                    self.desks[desk_id].suspend()
+                    self._mark_membership_changed(self.desks[desk_id])
+                    logger.warning("Desk ID=%s powered off for %s minutes.", desk_id, power_off_duration_s // 60)
+        self.publish_snapshot()
+
+    def restore_power_once(self):
+        """Power on the desks whose power-off period has ended."""
+        with self.lock:
+            desks_to_restore = [
+                desk_id for desk_id, power_on_time_s in self.powered_off_desks.items()
+                if self.current_time_s >= power_on_time_s
+            ]
+            for desk_id in desks_to_restore:
+                logger.info("Desk ID=%s restored from power-off state.", desk_id)
+                del self.powered_off_desks[desk_id]
+                self.desks[desk_id].resume()
+                self._mark_membership_changed(self.desks[desk_id])
+        self.publish_snapshot()
 
     def _simulate_power_off(self):
         """Randomly power off desks for a period of time."""
         while not self.stop_event.is_set():
-            with self.lock:
-                if self.desks and random.random() < self.POWER_OFF_CHANCE:
-                    desk_id = random.choice(list(self.desks.keys()))
-                    if desk_id not in self.powered_off_desks:
-                        power_off_duration_s = random.randint(5*60, 2*60*60)
-                        self.powered_off_desks[desk_id] = self.current_time_s + power_off_duration_s
-                        logger.warning(f"Desk ID={desk_id} powered off for {power_off_duration_s // 60} minutes.")
-            time.sleep(5)
+            self.power_off_once()
+            time.sleep(self.POWER_SIMULATION_INTERVAL_S)
+            self.restore_power_once()
 
-            with self.lock:
-                desks_to_restore = [
-                    desk_id for desk_id, power_on_time_s in self.powered_off_desks.items()
-                    if self.current_time_s >= power_on_time_s
-                ]
-                for desk_id in desks_to_restore:
-                    logger.info(f"Desk ID={desk_id} restored from power-off state.")
-                    del self.powered_off_desks[desk_id]
+    def get_metrics(self):
+        """Get the simulation metrics in the Prometheus text format."""
+        powered_off = len(self.powered_off_desks)
+        self.desk_count.set(len(self.desks) - powered_off, ("on",))
+        self.desk_count.set(powered_off, ("off",))
+        return self.metrics.render()
+
+    def share_state(self, shared_state):
+        """Publish the desks to a SharedStateWriter, now and after every snapshot."""
+        with self.lock:
+            # Slots follow the order of the desks, so readers list them as get_desk_ids does
+            shared_state.assign(self.desks)
+            shared_state.publish(self.snapshot, list(self.snapshot.desks))
+            self.shared_state = shared_state
+
+    def start_journal(self):
+        """Start the state journal and publish the desks added so far."""
+        if self.journal is None:
+            self.journal = StateJournal(self.state_file, self.journal_file, self.snapshot.version, self.current_time_s,
+                                        lambda: self.current_time_s)
+            self.journal.start()
+        self.publish_snapshot()
 
     def start_updates(self):
-        """Start the update and simulation threads."""
+        """Start the update and simulation threads, and the state journal."""
+        self.start_journal()
         if self.update_thread is None or not self.update_thread.is_alive():
             self.stop_event.clear()
-            self.update_thread = threading.Thread(target=self._update_all_desks)
+            self.update_thread = threading.Thread(target=self._update_all_desks, name="desk-updates")
             self.update_thread.start()
             logger.info("Update thread started.")
 
         if self.simulation_thread is None or not self.simulation_thread.is_alive():
-            self.simulation_thread = threading.Thread(target=self._simulate_user_interactions)
+            self.simulation_thread = threading.Thread(target=self._simulate_user_interactions, name="user-simulation")
             self.simulation_thread.start()
             logger.info("User simulation thread started.")
 
         if self.power_off_thread is None or not self.power_off_thread.is_alive():
-            self.power_off_thread = threading.Thread(target=self._simulate_power_off)
+            self.power_off_thread = threading.Thread(target=self._simulate_power_off, name="power-simulation")
             self.power_off_thread.start()
             logger.info("Power-off simulation thread started.")
 
@@ -183,52 +725,134 @@ class DeskManager:
             if self.power_off_thread:
                 self.power_off_thread.join()
                 logger.info("Power-off simulation thread stopped.")
-        self.save_state()
+        if self.journal is not None:
+            self.publish_snapshot()
+            self.journal.close()
+            self.journal = None
+            logger.info("Desk Manager state saved to %s.", self.state_file)
+        else:
+            self.save_state()
+
+    def _build_state(self):
+        """Build the full state in the state file format.
+
+        The manager lock is held only to list the desks; each desk is then copied under
+        its own lock, so the simulation keeps running while a large fleet is saved.
+        """
+        with self.lock:
+            desks = list(self.desks.items())
+            users = dict(self.users)
+            powered_off_desks = set(self.powered_off_desks)
+            journal_version = self.snapshot.version
+        state = {}
+        for desk_id, desk in desks:
+            state[desk_id] = {
+                "desk_data": {**desk.copy_data(), "clock_s": desk.clock_s},
+                "user": self._user_type_name(users[desk_id]),
+            }
+            if desk_id in powered_off_desks:
+                state[desk_id]["powered_off"] = True
+        state["current_time_s"] = self.current_time_s
+        state["simulation_speed"] = self.simulation_speed
+        state["journal_version"] = journal_version
+        return state
 
     def save_state(self):
         """Save the current state of desks and users."""
-        state = {}
-        with self.lock:
-            for desk_id, desk in self.desks.items():
-                state[desk_id] = {
-                    "desk_data": desk.get_data(),
-                    "user": self.users[desk_id].__class__.__name__.replace("User", "").lower(),
-                }
-                state[desk_id]["desk_data"]["clock_s"] = desk.clock_s
-                state["current_time_s"] = self.current_time_s
-                state["simulation_speed"] = self.simulation_speed
-        with open(self.STATE_FILE, "w") as f:
-            json.dump(state, f)
-        logger.info(f"Desk Manager state saved to {self.STATE_FILE}.")
+        state = self._build_state()
+        write_state(self.state_file, state)
+        if self.journal is None and os.path.exists(self.journal_file):
+            os.remove(self.journal_file)  # Everything it held is in the state file now
+        logger.info("Desk Manager state saved to %s.", self.state_file)
 
     def load_state(self):
-        """Load the state of desks and users from a JSON file, if it exists."""
-        if os.path.exists(self.STATE_FILE):
-            with open(self.STATE_FILE, "r") as f:
-                try:
-                    data = json.load(f)
-                    self.current_time_s = data.get("current_time_s", 43200)
-                    self.simulation_speed = data.get("simulation_speed", 60)
-                    for desk_id, saved_data in data.items():
-                        if desk_id in [ "current_time_s", "simulation_speed" ]:
-                            continue
-                        desk_data = saved_data["desk_data"]
-                        user_type = UserType(saved_data["user"])
-                        desk = Desk(
-                            desk_id,
-                            desk_data["config"]["name"],
-                            desk_data["config"]["manufacturer"],
-                            desk_data["state"]["position_mm"],
-                        )
-                        desk.config.update(desk_data["config"])
-                        desk.state.update(desk_data["state"])
-                        desk.usage.update(desk_data["usage"])
-                        desk.lastErrors = desk_data["lastErrors"]
-                        desk.clock_s = desk_data["clock_s"]
-                        self.desks[desk_id] = desk
-                        self.users[desk_id] = self._create_user(desk, user_type)
-                    logger.info(f"Desk Manager state loaded from {self.STATE_FILE}")
-                except (json.JSONDecodeError, KeyError, ValueError) as e:
-                    logger.error(f"Failed to load state from {self.STATE_FILE}: {e}. Starting with default state.")
-        else:
-            logger.warning(f"No state file found at {self.STATE_FILE}. Starting with default state.")
+        """Load the state of desks and users from the state file and the journal, if they exist.
+
+        The first snapshot is seeded with the loaded data, so loaded desks are not dirty
+        and starting a large fleet copies nothing. With the vectorized engine, a binary
+        state file is loaded in bulk and each desk's snapshot is decoded on first read.
+        """
+        try:
+            saved = read_state(self.state_file, self.journal_file)
+            if saved is None:
+                logger.warning("No state file found at %s. Starting with default state.", self.state_file)
+                return
+            self.current_time_s = saved.meta["current_time_s"]
+            self.simulation_speed = saved.meta["simulation_speed"]
+            # Keep snapshot versions increasing across restarts, so old journal records stay older
+            version = saved.meta["journal_version"]
+            etag = f'"{self.run_tag}-{version}"'
+            snapshot_desks = {}
+            gc_enabled = gc.isenabled()
+            gc.disable()  # Loading only creates long-lived objects; collecting in between costs time
+            try:
+                if self.fleet is not None and saved.reader is not None:
+                    self._load_records(saved, snapshot_desks, etag)
+                    entries = saved.journal_entries()
+                else:
+                    entries = saved.entries()
+                for desk_id, saved_data in entries:
+                    desk = self._load_desk(desk_id, saved_data)
+                    if saved_data.get("powered_off"):
+                        snapshot_desks.pop(desk_id, None)
+                    else:
+                        data = {category: saved_data["desk_data"][category] for category in Desk.CATEGORIES}
+                        snapshot_desks[desk_id] = DeskSnapshot(desk_id, desk.version, data, etag)
+            finally:
+                saved.close()
+                if gc_enabled:
+                    gc.enable()
+            self.snapshot = FleetSnapshot(version, snapshot_desks)
+            self.desk_index = None
+            self.fleet_stats = None
+            logger.info("Desk Manager state loaded from %s (%s desks).", self.state_file, len(self.desks))
+        except (json.JSONDecodeError, KeyError, ValueError) as e:
+            logger.error("Failed to load state from %s: %s. Starting with default state.", self.state_file, e)
+
+    def _load_desk(self, desk_id, saved_data):
+        """Create a desk and its user from a state file entry, or restore an existing desk from it."""
+        desk_data = saved_data["desk_data"]
+        desk = self.desks.get(desk_id)
+        if desk is None:
+            desk = self._create_desk(
+                desk_id,
+                desk_data["config"]["name"],
+                desk_data["config"]["manufacturer"],
+                desk_data["state"]["position_mm"],
+            )
+            self.desks[desk_id] = desk
+        desk.config.update(desk_data["config"])
+        desk.state.update(desk_data["state"])
+        desk.usage.update(desk_data["usage"])
+        desk.lastErrors = [dict(error) for error in desk_data["lastErrors"]]
+        desk.clock_s = desk_data["clock_s"]
+        if desk_id not in self.users:
+            self._add_loaded_user(desk_id, self.USER_TYPES[saved_data["user"]])
+        self.membership_changed = True
+        if saved_data.get("powered_off"):
+            # Desks restart powered on; publish them as such
+            self._mark_dirty(desk)
+        return desk
+
+    def _load_records(self, saved, snapshot_desks, etag):
+        """Bulk-load the desks of a binary state file into the vectorized fleet.
+
+        The journal's changes are applied afterwards by the caller. The file is copied
+        into memory, so the snapshot can decode desks from it after the file is replaced.
+        """
+        reader = saved.reader
+        removed_ids = saved.removed_ids()
+        desks = self.fleet.load_records(reader, saved.ticks_since_saved(), removed_ids)
+        reader.detach()
+        for index, desk_id, user, powered_off in reader.summaries():
+            if desk_id in removed_ids:
+                continue
+            desk = desks[desk_id]
+            desk.on_change = self._mark_dirty
+            self.desks[desk_id] = desk
+            self._add_loaded_user(desk_id, self.USER_TYPES[user])
+            if powered_off:
+                self._mark_dirty(desk)
+            else:
+                snapshot_desks[desk_id] = DeskSnapshot(desk_id, 0, etag=etag, loader=partial(reader.desk_data, index))
+        self.membership_changed = True
@@ -0,0 +1,498 @@
+import json
+import threading
+import logging
+from collections.abc import MutableMapping, Sequence
+from desk import Desk
+from binary_state import BinaryStateFormat
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is only required by the vectorized engine
+    np = None
+
+logger = logging.getLogger(__name__)
+
+def _to_number(value):
+    """Convert an array scalar to a JSON-friendly int or float."""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+class _ColumnMapping(MutableMapping):
+    """Dict-like view of one fleet row; reads and writes go straight to the column arrays."""
+    __slots__ = ("fleet", "index", "fields")
+
+    def __init__(self, fleet, index, fields):
+        self.fleet = fleet
+        self.index = index
+        self.fields = fields
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        return self.fleet.read_field(self.index, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError(key)
+        self.fleet.write_field(self.index, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError("Desk fields cannot be deleted")
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class _ConfigMapping(MutableMapping):
+    """Dict-like view of one row's config: interned name and manufacturer codes, plus any extra keys."""
+    __slots__ = ("fleet", "index")
+
+    def __init__(self, fleet, index):
+        self.fleet = fleet
+        self.index = index
+
+    def __getitem__(self, key):
+        column = VectorizedFleet.CONFIG_FIELDS.get(key)
+        if column is not None:
+            return self.fleet.strings[getattr(self.fleet, column)[self.index]]
+        return self.fleet.config_extras.get(self.index, {})[key]
+
+    def __setitem__(self, key, value):
+        column = VectorizedFleet.CONFIG_FIELDS.get(key)
+        if column is not None:
+            getattr(self.fleet, column)[self.index] = self.fleet.intern(value)
+        else:
+            self.fleet.config_extras.setdefault(self.index, {})[key] = value
+
+    def __delitem__(self, key):
+        raise TypeError("Desk fields cannot be deleted")
+
+    def __iter__(self):
+        yield from VectorizedFleet.CONFIG_FIELDS
+        yield from self.fleet.config_extras.get(self.index, ())
+
+    def __len__(self):
+        return len(VectorizedFleet.CONFIG_FIELDS) + len(self.fleet.config_extras.get(self.index, ()))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class _ErrorRing(Sequence):
+    """List-like view of one row's error ring buffer, most recent error first."""
+    __slots__ = ("fleet", "index")
+
+    def __init__(self, fleet, index):
+        self.fleet = fleet
+        self.index = index
+
+    def _slot(self, position):
+        return (self.fleet.error_head[self.index] + position) % Desk.MAX_ERROR_COUNT
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        slot = self._slot(position)
+        return {
+            "time_s": int(self.fleet.error_time_s[self.index, slot]),
+            "errorCode": int(self.fleet.error_code[self.index, slot]),
+        }
+
+    def __len__(self):
+        return int(self.fleet.error_count[self.index])
+
+    def appendleft(self, error):
+        """Record a new most recent error, dropping the oldest one if the ring is full."""
+        self.fleet.push_errors(np.array([self.index]), error["time_s"], error["errorCode"])
+
+    def __repr__(self):
+        return repr(list(self))
+
+class ArrayDesk(Desk):
+    """Desk whose state lives in one row of a VectorizedFleet.
+
+    Only storage is replaced: every Desk method works unchanged through the properties
+    below, so a single ArrayDesk behaves exactly like a Desk, while the fleet advances
+    all rows at once in VectorizedFleet.step.
+    """
+    __slots__ = ("fleet", "index")
+
+    def __init__(self, fleet, index, desk_id):
+        self.fleet = fleet
+        self.index = index
+        self.desk_id = desk_id
+        self.lock = fleet.lock
+        self.on_change = None
+
+    def _column_property(column, convert):
+        def getter(self):
+            return convert(getattr(self.fleet, column)[self.index])
+
+        def setter(self, value):
+            getattr(self.fleet, column)[self.index] = value
+
+        return property(getter, setter)
+
+    target_position_mm = _column_property("target", _to_number)
+    min_position = _column_property("min_position", _to_number)
+    max_position = _column_property("max_position", _to_number)
+    sit_stand_position = _column_property("sit_stand_position", float)
+    clock_s = _column_property("clock_s", int)
+    collision_occurred = _column_property("collision_occurred", bool)
+    version = _column_property("version", int)
+    del _column_property
+
+    @property
+    def config(self):
+        return _ConfigMapping(self.fleet, self.index)
+
+    @property
+    def state(self):
+        return _ColumnMapping(self.fleet, self.index, VectorizedFleet.STATE_FIELDS)
+
+    @property
+    def usage(self):
+        return _ColumnMapping(self.fleet, self.index, VectorizedFleet.USAGE_FIELDS)
+
+    @property
+    def lastErrors(self):
+        return _ErrorRing(self.fleet, self.index)
+
+    @lastErrors.setter
+    def lastErrors(self, errors):
+        self.fleet.write_errors(self.index, errors)
+
+    def get_data(self):
+        """Get a snapshot of the desk's data as plain dicts."""
+        return self.copy_data()
+
+class VectorizedFleet:
+    """Column store for a whole fleet of desks, advanced in one NumPy step per tick.
+
+    Positions, targets, limits, speeds, counters and collision flags are parallel
+    arrays indexed by row. VectorizedFleet.step reproduces Desk.update for every
+    powered desk at once: clamping to the limits, sit/stand crossing counts and the
+    E93 collision bounce. Config strings are interned, and each row keeps its last
+    errors in a fixed-size ring buffer, so a desk costs a few hundred bytes.
+    """
+    INITIAL_CAPACITY = 1024
+
+    COLUMNS = {
+        "present": "bool",
+        "position": "float64",
+        "target": "float64",
+        "min_position": "float64",
+        "max_position": "float64",
+        "sit_stand_position": "float64",
+        "speed": "int32",
+        "status": "uint8",
+        "position_lost": "bool",
+        "overload_up": "bool",
+        "overload_down": "bool",
+        "anti_collision": "bool",
+        "activations": "int64",
+        "sit_stand_counter": "int64",
+        "clock_s": "int64",
+        "collision_occurred": "bool",
+        "version": "int64",
+        "config_name": "uint32",
+        "config_manufacturer": "uint32",
+        # Error ring buffer: the most recent error is at error_head
+        "error_time_s": ("int64", Desk.MAX_ERROR_COUNT),
+        "error_code": ("int32", Desk.MAX_ERROR_COUNT),
+        "error_head": "uint8",
+        "error_count": "uint8",
+    }
+
+    # Desk dict key -> (column, conversion to Python value)
+    STATE_FIELDS = {
+        "position_mm": ("position", _to_number),
+        "speed_mms": ("speed", int),
+        "status": ("status", None),
+        "isPositionLost": ("position_lost", bool),
+        "isOverloadProtectionUp": ("overload_up", bool),
+        "isOverloadProtectionDown": ("overload_down", bool),
+        "isAntiCollision": ("anti_collision", bool),
+    }
+    USAGE_FIELDS = {
+        "activationsCounter": ("activations", int),
+        "sitStandCounter": ("sit_stand_counter", int),
+    }
+    # Config key -> column of interned string codes; other config keys are kept in config_extras
+    CONFIG_FIELDS = {
+        "name": "config_name",
+        "manufacturer": "config_manufacturer",
+    }
+
+    def __init__(self, seed=None):
+        if np is None:
+            raise RuntimeError("The vectorized engine requires NumPy (pip install numpy).")
+        self.lock = threading.RLock()
+        self.rng = np.random.default_rng(seed)
+        self.capacity = 0
+        self.size = 0
+        self.free_rows = []
+        self.config_extras = {}  # Row -> config keys other than CONFIG_FIELDS
+        self.row_ids = []
+        self.status_names = []
+        self.status_codes = {}
+        self.strings = []
+        self.string_codes = {}
+        for column, dtype in self.COLUMNS.items():
+            setattr(self, column, self._allocate(dtype, 0))
+        self._status_code("Normal")
+        self._status_code("Collision")
+        self._grow(self.INITIAL_CAPACITY)
+
+    @staticmethod
+    def _allocate(dtype, rows):
+        """Allocate a zeroed column; a (dtype, width) column holds `width` values per row."""
+        if isinstance(dtype, tuple):
+            dtype, width = dtype
+            return np.zeros((rows, width), dtype=dtype)
+        return np.zeros(rows, dtype=dtype)
+
+    def _grow(self, capacity):
+        """Reallocate every column with room for `capacity` rows."""
+        for column, dtype in self.COLUMNS.items():
+            grown = self._allocate(dtype, capacity)
+            grown[:self.capacity] = getattr(self, column)
+            setattr(self, column, grown)
+        self.row_ids.extend([None] * (capacity - self.capacity))
+        self.capacity = capacity
+
+    def _status_code(self, status):
+        """Intern a status string and return its code."""
+        code = self.status_codes.get(status)
+        if code is None:
+            code = len(self.status_names)
+            self.status_names.append(status)
+            self.status_codes[status] = code
+        return code
+
+    def intern(self, value):
+        """Intern a config string and return its code."""
+        code = self.string_codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(value)
+            self.string_codes[value] = code
+        return code
+
+    def push_errors(self, rows, time_s, error_code):
+        """Record a new most recent error on each of `rows`, dropping the oldest of a full ring."""
+        head = (self.error_head[rows].astype(np.intp) - 1) % Desk.MAX_ERROR_COUNT
+        self.error_head[rows] = head
+        self.error_time_s[rows, head] = time_s
+        self.error_code[rows, head] = error_code
+        self.error_count[rows] = np.minimum(self.error_count[rows] + 1, Desk.MAX_ERROR_COUNT)
+
+    def write_errors(self, index, errors):
+        """Replace the errors of one row, most recent first; only the first MAX_ERROR_COUNT are kept."""
+        errors = list(errors)[:Desk.MAX_ERROR_COUNT]
+        self.error_head[index] = 0
+        self.error_count[index] = len(errors)
+        for slot, error in enumerate(errors):
+            self.error_time_s[index, slot] = error["time_s"]
+            self.error_code[index, slot] = error["errorCode"]
+
+    def read_field(self, index, key):
+        """Read a Desk state/usage field of one row as a Python value."""
+        column, convert = self.STATE_FIELDS.get(key) or self.USAGE_FIELDS[key]
+        value = getattr(self, column)[index]
+        if column == "status":
+            return self.status_names[value]
+        return convert(value)
+
+    def write_field(self, index, key, value):
+        """Write a Desk state/usage field of one row."""
+        column, _ = self.STATE_FIELDS.get(key) or self.USAGE_FIELDS[key]
+        if column == "status":
+            value = self._status_code(value)
+        getattr(self, column)[index] = value
+
+    def add_desk(self, desk_id, name, manufacturer, initial_position=680, min_position=680, max_position=1320):
+        """Allocate a row with the same defaults as Desk.__init__ and return its ArrayDesk view."""
+        with self.lock:
+            if self.free_rows:
+                index = self.free_rows.pop()
+            else:
+                if self.size == self.capacity:
+                    self._grow(self.capacity * 2)
+                index = self.size
+                self.size += 1
+
+            for column in self.COLUMNS:
+                getattr(self, column)[index] = 0
+            self.present[index] = True
+            self.position[index] = initial_position
+            self.target[index] = initial_position
+            self.min_position[index] = min_position
+            self.max_position[index] = max_position
+            self.sit_stand_position[index] = (max_position - min_position) / 2 + min_position
+            self.status[index] = self.status_codes["Normal"]
+            self.activations[index] = 25
+            self.sit_stand_counter[index] = 1
+            self.clock_s[index] = 180
+            self.config_name[index] = self.intern(name)
+            self.config_manufacturer[index] = self.intern(manufacturer)
+            self.config_extras.pop(index, None)
+            self.write_errors(index, [{"time_s": 120, "errorCode": Desk.ERROR_CODE_E93}])
+            self.row_ids[index] = desk_id
+
+            logger.debug("Desk row allocated: ID=%s, Row=%s", desk_id, index)
+            return ArrayDesk(self, index, desk_id)
+
+    def load_records(self, reader, clock_ticks=0, skip_ids=(), min_position=680, max_position=1320):
+        """Load the desks of a BinaryStateReader into new rows in bulk and return their ArrayDesk views by desk ID.
+
+        Records are read straight from the file into the columns; desks in `skip_ids`
+        are left out, and the clocks of the desks that are not powered off advance by
+        `clock_ticks`. Much faster than one add_desk per desk for a large fleet.
+        """
+        fmt = BinaryStateFormat
+        dtype = np.dtype([(field, "<" + code) for field, code in zip(fmt.RECORD_FIELDS, fmt.RECORD.format[1:])])
+        records = np.frombuffer(reader.records(), dtype=dtype)
+        strings = reader.string_table()
+        desk_ids = [strings[index] for index in records["desk_id"].tolist()]
+        if skip_ids:
+            keep = np.fromiter((desk_id not in skip_ids for desk_id in desk_ids), dtype=bool, count=len(desk_ids))
+            records = records[keep]
+            desk_ids = [desk_id for desk_id, kept in zip(desk_ids, keep.tolist()) if kept]
+        count = len(records)
+
+        with self.lock:
+            if self.size + count > self.capacity:
+                self._grow(max(self.capacity * 2, self.size + count))
+            rows = slice(self.size, self.size + count)
+            for column in self.COLUMNS:
+                getattr(self, column)[rows] = 0
+            flags = records["flags"]
+            self.present[rows] = True
+            self.position[rows] = records["position_mm"]
+            self.target[rows] = records["position_mm"]
+            self.min_position[rows] = min_position
+            self.max_position[rows] = max_position
+            self.sit_stand_position[rows] = (max_position - min_position) / 2 + min_position
+            self.speed[rows] = records["speed_mms"]
+            self.status[rows] = self._intern_codes(records["status"], strings, self._status_code)
+            for key, column in self.CONFIG_FIELDS.items():
+                getattr(self, column)[rows] = self._intern_codes(records[key], strings, self.intern)
+            for bit, flag in enumerate(fmt.FLAGS):
+                getattr(self, self.STATE_FIELDS[flag][0])[rows] = (flags & (1 << bit)) != 0
+            self.activations[rows] = records["activationsCounter"]
+            self.sit_stand_counter[rows] = records["sitStandCounter"]
+            self.clock_s[rows] = records["clock_s"] + np.where(flags & fmt.POWERED_OFF, 0, clock_ticks)
+            self.row_ids[rows] = desk_ids
+            for offset in np.flatnonzero(records["config_extras"] != fmt.NO_STRING).tolist():
+                self.config_extras[rows.start + offset] = json.loads(strings[records["config_extras"][offset]])
+
+            # Copy the first MAX_ERROR_COUNT errors of each desk into the first slots of its ring
+            errors = np.frombuffer(reader.errors(), dtype=[("time_s", "<i8"), ("errorCode", "<i4")])
+            counts = np.minimum(records["error_count"], Desk.MAX_ERROR_COUNT).astype(np.intp)
+            error_rows = np.repeat(np.arange(rows.start, rows.stop), counts)
+            slots = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            sources = np.repeat(records["first_error"].astype(np.intp), counts) + slots
+            self.error_time_s[error_rows, slots] = errors["time_s"][sources]
+            self.error_code[error_rows, slots] = errors["errorCode"][sources]
+            self.error_count[rows] = counts
+            self.size += count
+
+            logger.info("Loaded %s desk rows.", count)
+            return {desk_id: ArrayDesk(self, index, desk_id) for index, desk_id in zip(range(rows.start, rows.stop), desk_ids)}
+
+    @staticmethod
+    def _intern_codes(indexes, strings, intern):
+        """Map an array of file string indexes to the codes `intern` gives their strings."""
+        values, inverse = np.unique(indexes, return_inverse=True)
+        return np.array([intern(strings[value]) for value in values.tolist()])[inverse]
+
+    def remove_desk(self, desk):
+        """Release the row of a removed desk for reuse."""
+        with self.lock:
+            self.present[desk.index] = False
+            self.config_extras.pop(desk.index, None)
+            self.error_count[desk.index] = 0
+            self.row_ids[desk.index] = None
+            self.free_rows.append(desk.index)
+
+    def step(self, inactive_rows=()):
+        """Advance every present desk not listed in `inactive_rows` by one second, like Desk.update.
+
+        Returns the rows whose data changed; their version is bumped.
+        """
+        with self.lock:
+            active = self.present[:self.size].copy()
+            inactive_rows = np.fromiter(inactive_rows, dtype=np.intp)
+            active[inactive_rows[inactive_rows < self.size]] = False
+            rows = np.flatnonzero(active)
+            self.clock_s[rows] += 1
+
+            # A desk that collided on the previous tick skips one tick
+            skipped = self.collision_occurred[rows]
+            self.collision_occurred[rows[skipped]] = False
+            rows = rows[~skipped]
+
+            position = self.position[rows]
+            target = self.target[rows]
+            min_position = self.min_position[rows]
+            max_position = self.max_position[rows]
+            sit_stand_position = self.sit_stand_position[rows]
+
+            up = position < target
+            down = position > target
+            new_position = np.where(
+                up,
+                np.minimum(position + np.minimum(Desk.DEFAULT_SPEED_MMS, target - position), max_position),
+                np.where(
+                    down,
+                    np.maximum(position - np.minimum(Desk.DEFAULT_SPEED_MMS, position - target), min_position),
+                    position,
+                ),
+            )
+            previous_speed = self.speed[rows]
+            speed = np.where(up, Desk.DEFAULT_SPEED_MMS, np.where(down, -Desk.DEFAULT_SPEED_MMS, 0)).astype(self.speed.dtype)
+
+            crossed = ((position < sit_stand_position) & (sit_stand_position <= new_position)) | \
+                      ((position > sit_stand_position) & (sit_stand_position >= new_position))
+            self.sit_stand_counter[rows[crossed]] += 1
+
+            moved = up | down
+            was_anti_collision = self.anti_collision[rows]
+
+            # The first successful movement after a collision clears it instead of rolling for a new one
+            reset_rows = rows[moved & was_anti_collision]
+            self.anti_collision[reset_rows] = False
+            self.status[reset_rows] = self.status_codes["Normal"]
+
+            candidates = moved & ~was_anti_collision
+            collided = np.zeros_like(candidates)
+            collided[candidates] = self.rng.random(np.count_nonzero(candidates)) < Desk.COLLISION_CHANCE
+
+            bounce_down = collided & (speed > 0)
+            bounce_up = collided & (speed < 0)
+            new_position[bounce_down] = np.maximum(new_position[bounce_down] - 10, min_position[bounce_down])
+            new_position[bounce_up] = np.minimum(new_position[bounce_up] + 10, max_position[bounce_up])
+            target[collided] = new_position[collided]
+            speed[collided] = 0
+
+            self.position[rows] = new_position
+            self.target[rows] = target
+            self.speed[rows] = speed
+
+            collided_rows = rows[collided]
+            self.anti_collision[collided_rows] = True
+            self.status[collided_rows] = self.status_codes["Collision"]
+            self.collision_occurred[collided_rows] = True
+            self.push_errors(collided_rows, self.clock_s[collided_rows], Desk.ERROR_CODE_E93)
+
+            changed_rows = rows[moved | (speed != previous_speed)]
+            self.version[changed_rows] += 1
+
+            if len(collided_rows) and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Fleet step: %s desks moving, %s collisions.", np.count_nonzero(moved), len(collided_rows))
+            return changed_rows
@@ -0,0 +1,52 @@
+import json
+
+class DeskSnapshot:
+    """Immutable copy of one desk's data at a given desk version.
+
+    The JSON encoding of the whole desk and of each category is computed on first use
+    and cached, so polling a desk that has not changed costs no serialization. The data
+    itself may be given as a `loader` that decodes it on first use, e.g. from a state file.
+    """
+    __slots__ = ("desk_id", "version", "_data", "loader", "etag", "encoded")
+
+    def __init__(self, desk_id, version, data=None, etag=None, loader=None):
+        self.desk_id = desk_id
+        self.version = version
+        self._data = data
+        self.loader = loader
+        self.etag = etag
+        self.encoded = {}
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.loader()
+        return self._data
+
+    def encode(self, category=None):
+        """Get the UTF-8 JSON encoding of the desk, or of one of its categories."""
+        body = self.encoded.get(category)
+        if body is None:
+            data = self.data if category is None else self.data[category]
+            body = json.dumps(data).encode("utf-8")
+            self.encoded[category] = body
+        return body
+
+class FleetSnapshot:
+    """Immutable, versioned view of every powered-on desk.
+
+    DeskManager publishes a new snapshot after each simulation pass by copying the
+    previous desk map and replacing only the desks that changed. Readers take a
+    reference to the current snapshot without locking, and the data they serialize is
+    never mutated afterwards, so every response is internally consistent.
+    """
+    __slots__ = ("version", "desks", "desk_ids")
+
+    def __init__(self, version=0, desks=None, desk_ids=()):
+        self.version = version
+        self.desks = desks if desks is not None else {}
+        self.desk_ids = desk_ids
+
+    def get(self, desk_id):
+        """Get the DeskSnapshot of a powered-on desk, or None."""
+        return self.desks.get(desk_id)
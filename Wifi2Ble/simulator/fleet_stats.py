@@ -0,0 +1,241 @@
+import threading
+from collections import Counter, deque
+
+class DeskStats:
+    """What FleetStats last counted for one desk."""
+    __slots__ = ("activations", "sit_stand", "last_error_s", "status", "standing", "since_s", "seated_s", "standing_s")
+
+    def __init__(self):
+        self.activations = 0
+        self.sit_stand = 0
+        self.last_error_s = None  # Time of the newest error counted
+        self.status = None  # None while powered off
+        self.standing = None  # Index of the current posture in POSTURES, None while powered off
+        self.since_s = 0  # Start of the current posture
+        self.seated_s = 0  # Time in ended postures
+        self.standing_s = 0
+
+
+class FleetStats:
+    """Usage aggregates of the fleet, kept up to date with each published change of a desk.
+
+    DeskManager passes every desk it publishes to update() or power_off(), so a change
+    costs O(1) and get() never looks at the desks. Usage totals are the sums of the desks'
+    counters, as if summed over the fleet. Collisions are the errors that appeared since
+    `started_s`, and posture times are counted in simulated seconds from then on, while
+    desks are powered on: a desk at or above its sit/stand position is standing.
+    DeskManager updates and reads the aggregates under `lock`.
+    """
+    POSTURES = ("seated", "standing")
+    SECONDS_PER_HOUR = 3600
+    HOURS_KEPT = 24
+
+    def __init__(self, now_s):
+        self.started_s = now_s
+        self.desks = {}  # Desk ID -> DeskStats
+        self.activations = 0
+        self.sit_stand = 0
+        self.collisions = 0
+        self.collisions_by_hour = deque()  # [hour start, collisions], oldest first
+        self.by_status = Counter()  # Powered-on desks per status
+        self.powered_off = 0
+        # Per posture: time of the ended postures, and the number and summed start times
+        # of the current ones, whose time so far is count * now - sum
+        self.ended_s = [0, 0]
+        self.current = [0, 0]
+        self.current_since_s = [0, 0]
+        self.lock = threading.Lock()
+
+    def update(self, desk_id, data, sit_stand_position, now_s):
+        """Count the published data of a powered-on desk."""
+        stats = self.desks.get(desk_id)
+        if stats is None:
+            stats = self._add(desk_id, data)
+        else:
+            if stats.status is None:
+                self.powered_off -= 1
+            self._count(stats, data, now_s)
+
+        status = data["state"]["status"]
+        if stats.status != status:
+            if stats.status is not None:
+                self.by_status[stats.status] -= 1
+            self.by_status[status] += 1
+            stats.status = status
+        standing = int(data["state"]["position_mm"] >= sit_stand_position)
+        if stats.standing != standing:
+            self._end_posture(stats, now_s)
+            stats.standing = standing
+            stats.since_s = now_s
+            self.current[standing] += 1
+            self.current_since_s[standing] += now_s
+
+    def power_off(self, desk_id, data, now_s):
+        """Count a desk that was powered off, with its last data."""
+        stats = self.desks.get(desk_id)
+        if stats is None:
+            stats = self._add(desk_id, data)
+        elif stats.status is None:
+            return
+        else:
+            self._count(stats, data, now_s)
+            self.by_status[stats.status] -= 1
+            self._end_posture(stats, now_s)
+            stats.status = None
+        self.powered_off += 1
+
+    def remove(self, desk_id, now_s):
+        """Take a removed desk out of the totals. Its collisions stay counted."""
+        stats = self.desks.pop(desk_id, None)
+        if stats is None:
+            return
+        self.activations -= stats.activations
+        self.sit_stand -= stats.sit_stand
+        if stats.status is None:
+            self.powered_off -= 1
+        else:
+            self.by_status[stats.status] -= 1
+        self._end_posture(stats, now_s)
+        self.ended_s[0] -= stats.seated_s
+        self.ended_s[1] -= stats.standing_s
+
+    def _add(self, desk_id, data):
+        """Start counting a desk from its current counters; its existing errors are not new collisions."""
+        stats = self.desks[desk_id] = DeskStats()
+        usage = data["usage"]
+        stats.activations = usage["activationsCounter"]
+        stats.sit_stand = usage["sitStandCounter"]
+        self.activations += stats.activations
+        self.sit_stand += stats.sit_stand
+        if data["lastErrors"]:
+            stats.last_error_s = data["lastErrors"][0]["time_s"]
+        return stats
+
+    def _count(self, stats, data, now_s):
+        """Add the changes of a desk's counters and its new errors to the totals."""
+        usage = data["usage"]
+        self.activations += usage["activationsCounter"] - stats.activations
+        self.sit_stand += usage["sitStandCounter"] - stats.sit_stand
+        stats.activations = usage["activationsCounter"]
+        stats.sit_stand = usage["sitStandCounter"]
+
+        errors = data["lastErrors"]  # Most recent first
+        new_errors = 0
+        for error in errors:
+            if stats.last_error_s is not None and error["time_s"] <= stats.last_error_s:
+                break
+            new_errors += 1
+        if new_errors:
+            stats.last_error_s = errors[0]["time_s"]
+            self.collisions += new_errors
+            self._count_collisions(new_errors, now_s)
+
+    def _count_collisions(self, collisions, now_s):
+        hour_s = now_s - now_s % self.SECONDS_PER_HOUR
+        if self.collisions_by_hour and self.collisions_by_hour[-1][0] == hour_s:
+            self.collisions_by_hour[-1][1] += collisions
+        else:
+            self.collisions_by_hour.append([hour_s, collisions])
+            if len(self.collisions_by_hour) > self.HOURS_KEPT:
+                self.collisions_by_hour.popleft()
+
+    def _end_posture(self, stats, now_s):
+        """End the current posture of a desk, if any, and add its time to the desk and the totals."""
+        if stats.standing is None:
+            return
+        elapsed_s = now_s - stats.since_s
+        if stats.standing:
+            stats.standing_s += elapsed_s
+        else:
+            stats.seated_s += elapsed_s
+        self.ended_s[stats.standing] += elapsed_s
+        self.current[stats.standing] -= 1
+        self.current_since_s[stats.standing] -= stats.since_s
+        stats.standing = None
+
+    def _posture_s(self, posture, now_s):
+        return self.ended_s[posture] + self.current[posture] * now_s - self.current_since_s[posture]
+
+    def get(self, now_s):
+        """Get the fleet aggregates at simulated time now_s."""
+        first_hour_s = now_s - now_s % self.SECONDS_PER_HOUR - (self.HOURS_KEPT - 1) * self.SECONDS_PER_HOUR
+        return {
+            "started_s": self.started_s,
+            "time_s": now_s,
+            "desks": len(self.desks),
+            "powered_off": self.powered_off,
+            "desks_by_status": {status: count for status, count in sorted(self.by_status.items()) if count},
+            "usage": {
+                "activations": self.activations,
+                "sit_stand_transitions": self.sit_stand,
+            },
+            "collisions": {
+                "total": self.collisions,
+                "per_hour": [
+                    {"hour_s": hour_s, "collisions": collisions}
+                    for hour_s, collisions in self.collisions_by_hour
+                    if hour_s >= first_hour_s
+                ],
+            },
+            "posture": {
+                "seated_s": self._posture_s(0, now_s),
+                "standing_s": self._posture_s(1, now_s),
+                "seated_desks": self.current[0],
+                "standing_desks": self.current[1],
+            },
+        }
+
+    def get_desk(self, desk_id, now_s):
+        """Get the posture times of one desk, or None if it is not counted."""
+        stats = self.desks.get(desk_id)
+        if stats is None:
+            return None
+        posture_s = [stats.seated_s, stats.standing_s]
+        if stats.standing is not None:
+            posture_s[stats.standing] += now_s - stats.since_s
+        return {
+            "desk_id": desk_id,
+            "started_s": self.started_s,
+            "time_s": now_s,
+            "posture": None if stats.standing is None else self.POSTURES[stats.standing],
+            "seated_s": posture_s[0],
+            "standing_s": posture_s[1],
+        }
+
+
+def merge_stats(shard_stats):
+    """Combine the get() results of several FleetStats, e.g. one per shard, into one."""
+    desks_by_status = Counter()
+    collisions_by_hour = Counter()
+    for stats in shard_stats:
+        desks_by_status.update(stats["desks_by_status"])
+        for hour in stats["collisions"]["per_hour"]:
+            collisions_by_hour[hour["hour_s"]] += hour["collisions"]
+
+    def total(*keys):
+        result = 0
+        for stats in shard_stats:
+            for key in keys:
+                stats = stats[key]
+            result += stats
+        return result
+
+    first_hour_s = max(stats["time_s"] for stats in shard_stats) // FleetStats.SECONDS_PER_HOUR * \
+        FleetStats.SECONDS_PER_HOUR - (FleetStats.HOURS_KEPT - 1) * FleetStats.SECONDS_PER_HOUR
+    return {
+        "started_s": min(stats["started_s"] for stats in shard_stats),
+        "time_s": max(stats["time_s"] for stats in shard_stats),
+        "desks": total("desks"),
+        "powered_off": total("powered_off"),
+        "desks_by_status": dict(sorted(desks_by_status.items())),
+        "usage": {key: total("usage", key) for key in shard_stats[0]["usage"]},
+        "collisions": {
+            "total": total("collisions", "total"),
+            "per_hour": [
+                {"hour_s": hour_s, "collisions": collisions}
+                for hour_s, collisions in sorted(collisions_by_hour.items())
+                if hour_s >= first_hour_s
+            ],
+        },
+        "posture": {key: total("posture", key) for key in shard_stats[0]["posture"]},
+    }
@@ -0,0 +1,132 @@
+import time
+import logging
+from collections import Counter
+from desk_events import DeskEvent
+from state_journal import StateJournal
+
+logger = logging.getLogger(__name__)
+
+class HeadlessSimulation:
+    """Runs a DeskManager against a virtual clock, as fast as the CPU allows.
+
+    Each step stands for TICK_INTERVAL_S of server time: the desks tick once, and the
+    user simulation and power changes run every USER_SIMULATION_INTERVAL_S and
+    POWER_SIMULATION_INTERVAL_S of it, as in the server, but nothing sleeps. Collisions
+    and power-offs are counted from the desk events of every published snapshot, so
+    they are not limited by the size of lastErrors.
+    """
+    def __init__(self, desk_manager):
+        self.desk_manager = desk_manager
+        self.ticks = 0
+        self.collisions = Counter()  # Desk ID -> collisions
+        self.power_offs = 0
+        self.start_time_s = desk_manager.current_time_s
+        self.start_usage = {
+            desk_id: dict(entry["desk_data"]["usage"])
+            for desk_id, entry in self._desk_entries()
+        }
+        self.subscription = desk_manager.events.subscribe()
+
+    def _desk_entries(self):
+        """Get (desk_id, state file entry) of every desk, including powered-off ones."""
+        state = self.desk_manager._build_state()
+        return [(desk_id, entry) for desk_id, entry in state.items() if desk_id not in StateJournal.META_KEYS]
+
+    def run(self, duration_s):
+        """Advance the simulation by `duration_s` simulated seconds."""
+        manager = self.desk_manager
+        ticks = int(duration_s // manager.simulation_speed)
+        users_every = max(manager.USER_SIMULATION_INTERVAL_S // manager.TICK_INTERVAL_S, 1)
+        power_every = max(manager.POWER_SIMULATION_INTERVAL_S // manager.TICK_INTERVAL_S, 1)
+        ticks_per_day = max(manager.SECONDS_PER_DAY // manager.simulation_speed, 1)
+        started = time.perf_counter()
+        for _ in range(ticks):
+            manager.update_desks_once()
+            manager.increment_time()
+            self._collect_events()
+            self.ticks += 1
+            if self.ticks % users_every == 0:
+                manager.simulate_users_once()
+                self._collect_events()
+            if self.ticks % power_every == 0:
+                manager.restore_power_once()
+                self._collect_events()
+                manager.power_off_once()
+                self._collect_events()
+            if self.ticks % ticks_per_day == 0:
+                logger.info("Simulated day %s done after %.1f s.", self.ticks // ticks_per_day, time.perf_counter() - started)
+        elapsed = time.perf_counter() - started
+        logger.info("Simulated %s ticks (%.1f days) of %s desks in %.1f s (%.0f ticks/s).",
+                    ticks, duration_s / manager.SECONDS_PER_DAY, len(manager.desks), elapsed, ticks / max(elapsed, 1e-9))
+
+    def _collect_events(self):
+        """Count the collisions and power-offs of the snapshots published since the last call."""
+        while True:
+            batch = self.subscription.get(0)
+            if batch is None:
+                return
+            _, events = batch
+            for event in events:
+                if event.event == DeskEvent.STATE and event.data["state"].get("isAntiCollision"):
+                    self.collisions[event.desk_id] += 1
+                elif event.event == DeskEvent.OFFLINE and event.data["reason"] == "powered_off":
+                    self.power_offs += 1
+
+    def report(self):
+        """Get the usage and error aggregates of the run so far."""
+        manager = self.desk_manager
+        by_user_type = {}
+        activations = []
+        sit_stand = []
+        powered_off = 0
+        for desk_id, entry in self._desk_entries():
+            usage = entry["desk_data"]["usage"]
+            start_usage = self.start_usage.get(desk_id, {"activationsCounter": 0, "sitStandCounter": 0})
+            desk_activations = usage["activationsCounter"] - start_usage["activationsCounter"]
+            desk_sit_stand = usage["sitStandCounter"] - start_usage["sitStandCounter"]
+            activations.append(desk_activations)
+            sit_stand.append(desk_sit_stand)
+            powered_off += bool(entry.get("powered_off"))
+
+            totals = by_user_type.setdefault(entry["user"], {
+                "desks": 0, "activations": 0, "sit_stand_transitions": 0, "collisions": 0,
+            })
+            totals["desks"] += 1
+            totals["activations"] += desk_activations
+            totals["sit_stand_transitions"] += desk_sit_stand
+            totals["collisions"] += self.collisions[desk_id]
+
+        days = (manager.current_time_s - self.start_time_s) / manager.SECONDS_PER_DAY
+        collisions = sum(self.collisions.values())
+        return {
+            "engine": manager.engine,
+            "desks": len(activations),
+            "simulation_speed": manager.simulation_speed,
+            "ticks": self.ticks,
+            "simulated_days": round(days, 3),
+            "start_time_s": self.start_time_s,
+            "end_time_s": manager.current_time_s,
+            "usage": {
+                "activations": sum(activations),
+                "sit_stand_transitions": sum(sit_stand),
+                "activations_per_desk": self._distribution(activations),
+                "sit_stand_transitions_per_desk": self._distribution(sit_stand),
+                "by_user_type": dict(sorted(by_user_type.items())),
+            },
+            "errors": {
+                "collisions": collisions,
+                "collisions_per_day": round(collisions / days, 3) if days else 0,
+                "desks_with_collisions": len(+self.collisions),
+                "max_collisions_per_desk": max(self.collisions.values(), default=0),
+            },
+            "power": {
+                "power_offs": self.power_offs,
+                "powered_off_at_end": powered_off,
+            },
+        }
+
+    @staticmethod
+    def _distribution(values):
+        if not values:
+            return {"min": 0, "mean": 0, "max": 0}
+        return {"min": min(values), "mean": round(sum(values) / len(values), 3), "max": max(values)}
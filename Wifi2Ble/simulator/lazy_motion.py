@@ -0,0 +1,198 @@
+import math
+import random
+import logging
+from desk import Desk, collision_logger
+
+logger = logging.getLogger(__name__)
+
+class TickClock:
+    """Count of one-second simulation ticks, shared by all lazily evaluated desks."""
+    def __init__(self, ticks=0):
+        self.ticks = ticks
+
+    def advance(self, ticks=1):
+        self.ticks += ticks
+
+class LazyDesk(Desk):
+    """Desk whose motion is evaluated analytically instead of being ticked every second.
+
+    A retarget records a motion segment: start tick, start position, target, and the
+    tick of the first E93 collision, decided up front with the same per-tick chance
+    Desk.update uses. Reading the desk (state, usage, lastErrors, target) settles the
+    segment at the current tick in O(1), producing the position, speed, sit/stand
+    crossings and collision that the tick-by-tick model would have produced. Idle
+    desks cost nothing between reads.
+    """
+    __slots__ = ("tick_clock", "suspended_tick", "clock_offset", "segment_tick", "segment_position", "segment_distance",
+                 "segment_direction", "segment_moves", "segment_speed", "segment_skip", "collision_tick", "_state", "_usage")
+    def __init__(self, desk_id, name, manufacturer, tick_clock, initial_position=680, min_position=680, max_position=1320):
+        self.tick_clock = tick_clock
+        self.suspended_tick = None
+        self.clock_offset = 0
+        self.segment_tick = None
+        self.collision_tick = None
+        super().__init__(desk_id, name, manufacturer, initial_position, min_position, max_position)
+        self._start_segment()
+
+    @property
+    def state(self):
+        self._settle()
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        self._state = state
+
+    @property
+    def usage(self):
+        self._settle()
+        return self._usage
+
+    @usage.setter
+    def usage(self, usage):
+        self._usage = usage
+
+    @property
+    def lastErrors(self):
+        self._settle()
+        return self._last_errors
+
+    @lastErrors.setter
+    def lastErrors(self, errors):
+        Desk.lastErrors.fset(self, errors)
+
+    @property
+    def clock_s(self):
+        return self.clock_offset + self._now()
+
+    @clock_s.setter
+    def clock_s(self, clock_s):
+        self.clock_offset = clock_s - self._now()
+
+    def _now(self):
+        """Current tick as seen by this desk; time stands still while it is powered off."""
+        return self.suspended_tick if self.suspended_tick is not None else self.tick_clock.ticks
+
+    def _start_segment(self, plan_collision=False):
+        """Start a new motion segment at the current tick from the settled position."""
+        with self.lock:
+            position = self._state["position_mm"]
+            self.segment_tick = self._now()
+            self.segment_position = position
+            self.segment_distance = abs(self.target_position_mm - position)
+            self.segment_direction = (self.target_position_mm > position) - (self.target_position_mm < position)
+            self.segment_moves = math.ceil(self.segment_distance / self.DEFAULT_SPEED_MMS)
+            self.segment_speed = self._state["speed_mms"]
+            # A collision on the tick that ended the previous segment makes the desk skip the next tick
+            self.segment_skip = self.collision_occurred
+            if plan_collision:
+                self.collision_tick = self._plan_collision()
+
+    def _plan_collision(self):
+        """Roll the per-tick collision chance for every move of the segment, as Desk.update would."""
+        skip = 1 if self.segment_skip else 0
+        # The first move after a collision only clears it, without rolling for a new one
+        first_move = 2 if self._state["isAntiCollision"] else 1
+        for move in range(first_move, self.segment_moves + 1):
+            if random.random() < self.COLLISION_CHANCE:
+                return self.segment_tick + skip + move
+        return None
+
+    def _settle(self):
+        """Bring state, usage and errors up to the current tick in O(1)."""
+        if self.segment_tick is None:
+            return
+        with self.lock:
+            now = self._now()
+            elapsed = now - self.segment_tick
+            if elapsed <= 0:
+                return
+
+            state = self._state
+            previous_speed = state["speed_mms"]
+            skip = 1 if self.segment_skip else 0
+            collided = self.collision_tick is not None and self.collision_tick <= now
+            if collided:
+                moves = self.collision_tick - self.segment_tick - skip
+            else:
+                moves = min(max(elapsed - skip, 0), self.segment_moves)
+
+            start_position = self.segment_position
+            position = start_position + self.segment_direction * min(moves * self.DEFAULT_SPEED_MMS, self.segment_distance)
+            if (start_position < self.sit_stand_position <= position) or \
+               (start_position > self.sit_stand_position >= position):
+                self._usage["sitStandCounter"] += 1
+
+            if moves > 0 and state["isAntiCollision"]:
+                state["isAntiCollision"] = False
+                state["status"] = "Normal"
+
+            if collided:
+                collision_clock_s = self.clock_offset + self.collision_tick
+                self._last_errors.appendleft({"time_s": collision_clock_s, "errorCode": self.ERROR_CODE_E93})
+                if self.segment_direction > 0:
+                    position = max(position - 10, self.min_position)
+                else:
+                    position = min(position + 10, self.max_position)
+                state["isAntiCollision"] = True
+                state["status"] = "Collision"
+                state["speed_mms"] = 0
+                self.target_position_mm = position
+                self.collision_occurred = self.collision_tick == now
+                self.collision_tick = None
+                collision_logger.error("Desk collision detected: ID=%s, Time=%s, Position=%s",
+                                       self.desk_id, collision_clock_s, position)
+            else:
+                if elapsed > skip:
+                    state["speed_mms"] = self.segment_direction * self.DEFAULT_SPEED_MMS if elapsed - skip <= self.segment_moves else 0
+                self.collision_occurred = False
+
+            changed = collided or moves > 0 or state["speed_mms"] != previous_speed
+            state["position_mm"] = position
+            self._start_segment()
+            if changed:
+                self._changed()
+
+    def get_target_position(self):
+        """Get the target position, which a collision may have changed since the last read."""
+        with self.lock:
+            self._settle()
+            return self.target_position_mm
+
+    def set_target_position(self, position_mm):
+        """Set the target position and plan the resulting motion segment."""
+        with self.lock:
+            self._settle()
+            super().set_target_position(position_mm)
+            self._start_segment(plan_collision=True)
+
+    def has_pending_motion(self):
+        """True while the desk is moving, about to stop or about to collide."""
+        with self.lock:
+            self._settle()
+            if self.suspended_tick is not None:
+                return False
+            return self.target_position_mm != self._state["position_mm"] or self._state["speed_mms"] != 0 \
+                or self.collision_tick is not None
+
+    def update(self):
+        """Nothing to advance: time comes from the shared tick clock. Settles the desk."""
+        self._settle()
+
+    def suspend(self):
+        """Freeze motion and the desk clock while the desk is powered off."""
+        with self.lock:
+            if self.suspended_tick is None:
+                self._settle()
+                self.suspended_tick = self.tick_clock.ticks
+
+    def resume(self):
+        """Resume motion after a power-off, shifting the segment by the time spent off."""
+        with self.lock:
+            if self.suspended_tick is not None:
+                paused_ticks = self.tick_clock.ticks - self.suspended_tick
+                self.suspended_tick = None
+                self.clock_offset -= paused_ticks
+                self.segment_tick += paused_ticks
+                if self.collision_tick is not None:
+                    self.collision_tick += paused_ticks
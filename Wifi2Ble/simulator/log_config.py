@@ -0,0 +1,107 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Loggers that log per desk or per request, so their volume grows with the fleet and the traffic
+RATE_LIMITED = ("desk", "desk.motion", "desk.collisions", "users", "simple_rest_server.access", "sharding.access")
+DEFAULT_LEVELS = {"desk.motion": "WARNING"}  # Every moving desk on every tick
+DEFAULT_RATE = 50  # Records per second let through by each rate-limited logger
+QUEUE_SIZE = 10000
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most `rate` records per second through a logger and drops the others.
+
+    The first record let through after some were dropped says how many.
+    """
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.window_start = 0.0
+        self.passed = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.window_start >= 1:
+                self.window_start = now
+                self.passed = 0
+            if self.passed >= self.rate:
+                self.dropped += 1
+                return False
+            self.passed += 1
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            record.msg = f"{record.msg} [{dropped} similar records dropped]"
+        return True
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Queues records for a QueueListener thread, which formats and writes them.
+
+    Unlike QueueHandler, the message is not formatted in the logging thread, so log
+    arguments must not be modified after the call. When the queue is full, records
+    are dropped instead of blocking the simulation or a request.
+    """
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_levels(text):
+    """Parse per-logger levels given as "name=LEVEL,name=LEVEL", e.g. "desk.motion=INFO,users=WARNING"."""
+    levels = {}
+    for item in filter(None, (text or "").split(",")):
+        name, _, level = item.partition("=")
+        if not name or not isinstance(getattr(logging, level.upper(), None), int):
+            raise ValueError(f"Invalid log level setting: {item}")
+        levels[name.strip()] = level.upper()
+    return levels
+
+
+def setup_logging(log_level, levels=None, rate=DEFAULT_RATE):
+    """Log to stderr from a background thread, with per-logger levels and rate limits.
+
+    `levels` overrides DEFAULT_LEVELS per logger name; `rate` limits each logger in
+    RATE_LIMITED to that many records per second (0 for no limit).
+    """
+    numeric_level = getattr(logging, log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError(f"Invalid log level: {log_level}")
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(FORMAT))
+    record_queue = queue.Queue(QUEUE_SIZE)
+    listener = QueueListener(record_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # Writes the records still queued
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(BackgroundQueueHandler(record_queue))
+    root.setLevel(numeric_level)
+
+    for name, level in {**DEFAULT_LEVELS, **(levels or {})}.items():
+        # A category default never lowers the level below the global one
+        if name in DEFAULT_LEVELS and name not in (levels or {}):
+            level = max(getattr(logging, level), numeric_level)
+        logging.getLogger(name).setLevel(level)
+    if rate > 0:
+        for name in RATE_LIMITED:
+            logging.getLogger(name).addFilter(RateLimitFilter(rate))
+    return listener
@@ -1,25 +1,37 @@
 import argparse
+import json
+import os
+import sys
 import ssl
+import time
+import socket
 import random
+import signal
 import logging
+import threading
+import multiprocessing
+from functools import partial
 from http.server import HTTPServer
+import log_config
 from users import UserType
 from desk_manager import DeskManager
-from simple_rest_server import SimpleRESTServer
+from simple_rest_server import SimpleRESTServer, KeepAliveRESTServer, AsyncRESTServer, InProcessRESTServer, ReaderRESTServer
+from pooled_http_server import PooledHTTPServer
+from async_runtime import AsyncRuntime, PeriodicTask
+from headless import HeadlessSimulation
+from sharding import ProcessGroup, ShardPool, ShardRouter, shard_of, shard_state_file, wait_for_stop
+from shared_state import SharedStateReader, SharedStateWriter
 
 logger = logging.getLogger("main")
 
-def setup_logging(log_level):
-    """Configure logging based on the log level."""
-    numeric_level = getattr(logging, log_level.upper(), None)
-    if not isinstance(numeric_level, int):
-        raise ValueError(f"Invalid log level: {log_level}")
+def setup_logging(log_level, log_levels=None, log_rate=log_config.DEFAULT_RATE):
+    """Configure logging based on the log level, per-logger levels ("name=LEVEL,...") and the rate limit.
 
-    logging.basicConfig(
-        level=numeric_level,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    )
-    logger.info(f"Logging initialized at {log_level} level.")
+    Returns the QueueListener that writes the records; it is stopped at exit.
+    """
+    log_listener = log_config.setup_logging(log_level, log_config.parse_levels(log_levels), log_rate)
+    logger.info("Logging initialized at %s level.", log_level)
+    return log_listener
 
 def generate_desk_id():
     return ":".join(f"{random.randint(0, 255):02x}" for _ in range(6))
@@ -27,23 +39,80 @@ def generate_desk_id():
 def generate_desk_name():
     return f"DESK {random.randint(1000, 9999)}"
 
-def run(server_class=HTTPServer, handler_class=SimpleRESTServer, port=8000, use_https=False, cert_file=None, key_file=None, desks=2, speed=60):
-    logger.info(f"Initializing DeskManager with simulation speed: {speed}")
-    desk_manager = DeskManager(speed)
+def add_desks(desk_manager, desks, owns=None):
+    """Add the default desks, then generated ones until there are at least `desks`.
 
+    With `owns`, only desks whose ID it accepts are added, as in a shard.
+    """
+    owns = owns or (lambda desk_id: True)
     logger.info("Adding default desks...")
-    desk_manager.add_desk("cd:fb:1a:53:fb:e6", "DESK 4486", "Desk-O-Matic Co.", UserType.ACTIVE)
-    desk_manager.add_desk("ee:62:5b:b8:73:1d", "DESK 6743", "Desk-O-Matic Co.", UserType.STANDING)
+    if owns("cd:fb:1a:53:fb:e6"):
+        desk_manager.add_desk("cd:fb:1a:53:fb:e6", "DESK 4486", "Desk-O-Matic Co.", UserType.ACTIVE)
+    if owns("ee:62:5b:b8:73:1d"):
+        desk_manager.add_desk("ee:62:5b:b8:73:1d", "DESK 6743", "Desk-O-Matic Co.", UserType.STANDING)
 
-    if len(desk_manager.get_desk_ids()) < desks:
-        logger.info(f"Adding {desks - len(desk_manager.get_desk_ids())} additional desks.")
-        for i in range(desks - len(desk_manager.get_desk_ids())):
-            desk_manager.add_desk(generate_desk_id(), generate_desk_name(), "Desk-O-Matic Co.", UserType.ACTIVE)
+    if len(desk_manager.desks) < desks:
+        logger.info("Adding %s additional desks.", desks - len(desk_manager.desks))
+        for i in range(desks - len(desk_manager.desks)):
+            desk_id = generate_desk_id()
+            while not owns(desk_id):
+                desk_id = generate_desk_id()
+            desk_manager.add_desk(desk_id, generate_desk_name(), "Desk-O-Matic Co.", UserType.ACTIVE)
 
-    desk_manager.start_updates()
+def run_headless(desks=2, speed=60, engine="object", days=7, seed=None, state_file=None, report_file=None):
+    """Simulate `days` of office usage against a virtual clock, without a server, and report aggregates.
+
+    The fleet starts from `state_file` if given, and nothing is saved, so runs with the
+    same seed and inputs give identical reports.
+    """
+    if seed is None:
+        seed = random.randrange(2**32)  # Reported, so the run can be repeated
+    random.seed(seed)
+    logger.info("Initializing DeskManager with simulation speed: %s, engine: %s, seed: %s", speed, engine, seed)
+    desk_manager = DeskManager(speed, engine, state_file, seed=seed, restore=state_file is not None, history_samples=0)
+    add_desks(desk_manager, desks)
+
+    simulation = HeadlessSimulation(desk_manager)
+    simulation.run(days * DeskManager.SECONDS_PER_DAY)
+    report = json.dumps({"seed": seed, **simulation.report()}, indent=2)
+    if report_file:
+        with open(report_file, "w") as f:
+            f.write(report + "\n")
+        logger.info("Report written to %s.", report_file)
+    else:
+        print(report)
+
+def run(server_class=None, handler_class=None, port=8000, use_https=False, cert_file=None, key_file=None, desks=2, speed=60,
+        server_mode="pooled", workers=8, engine="object", state_file=DeskManager.STATE_FILE, overrun_policy="catch-up",
+        seed=None, history_samples=DeskManager.HISTORY_SAMPLES):
+    if seed is not None:
+        random.seed(seed)
+    logger.info("Initializing DeskManager with simulation speed: %s, engine: %s", speed, engine)
+    desk_manager = DeskManager(speed, engine, state_file, seed=seed, history_samples=history_samples)
+    add_desks(desk_manager, desks)
+
+    if server_mode == "async":
+        desk_manager.start_journal()  # The runtime runs the simulation on its event loop
+    else:
+        desk_manager.start_updates()
+
+    if server_mode == "pooled":
+        # Bounded worker pool with HTTP/1.1 keep-alive connections
+        server_class = server_class or partial(PooledHTTPServer, workers=workers)
+        handler_class = handler_class or KeepAliveRESTServer
+    elif server_mode == "single":
+        # Original behavior: one request at a time, one HTTP/1.0 connection per request
+        server_class = server_class or HTTPServer
+        handler_class = handler_class or SimpleRESTServer
+    elif server_mode == "async":
+        # Simulation and HTTP/1.1 on one asyncio event loop, with ticks on a fixed schedule
+        server_class = server_class or partial(AsyncRuntime, desk_manager, overrun_policy=overrun_policy)
+        handler_class = handler_class or AsyncRESTServer
+    else:
+        raise ValueError(f"Invalid server mode: {server_mode}")
 
     def handler(*args, **kwargs):
-        handler_class(desk_manager, *args, **kwargs)
+        return handler_class(desk_manager, *args, **kwargs)
 
     server_address = ("localhost", port)
     SimpleRESTServer.initialize_api_keys()
@@ -56,19 +125,206 @@ def run(server_class=HTTPServer, handler_class=SimpleRESTServer, port=8000, use_
         context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         context.load_cert_chain(certfile=cert_file, keyfile=key_file)
 
-        httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+        if server_mode == "async":
+            httpd.ssl_context = context  # The event loop runs the TLS handshakes
+        else:
+            # Defer the TLS handshake to the first read so it runs on the worker thread, not the accept loop
+            httpd.socket = context.wrap_socket(httpd.socket, server_side=True, do_handshake_on_connect=False)
         protocol = "HTTPS"
     else:
         protocol = "HTTP"
 
-    logger.info(f"Starting {protocol} server on port {port}...")
+    logger.info("Starting %s server on port %s (%s mode)...", protocol, port, server_mode)
 
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         logger.info("Shutting down server...")
     finally:
+        httpd.server_close()
+        desk_manager.stop_updates()  # Stop the desk updates
+        logger.info("Server stopped.")
+
+def serve_listener(listener, handler, workers, cert_file=None, key_file=None, name="server"):
+    """Serve connections from a listening socket shared with other processes, on a thread; returns the server."""
+    httpd = PooledHTTPServer(listener.getsockname(), handler, workers=workers, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = listener  # Every process accepts connections from the same socket
+    if cert_file:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile=cert_file, keyfile=key_file)
+        httpd.socket = context.wrap_socket(listener, server_side=True, do_handshake_on_connect=False)
+    threading.Thread(target=httpd.serve_forever, name=name).start()
+    return httpd
+
+def stop_server(httpd):
+    httpd.shutdown()
+    httpd.server_close()
+
+def run_shard(index, shards, ready, stop, listener=None, ports=None, desks=2, speed=60, workers=8, engine="object",
+              state_file=DeskManager.STATE_FILE, seed=None, history_samples=DeskManager.HISTORY_SAMPLES,
+              cert_file=None, key_file=None, log_level="INFO", log_levels=None, log_rate=log_config.DEFAULT_RATE):
+    """Run one shard process: simulate the desks whose IDs hash to `index`, and serve every URL on `listener`.
+
+    The other shards reach this one on a local port picked by the OS, which it writes to
+    ports[index]; it accepts connections once every shard has written its port.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches every process; the parent stops the shards
+    log_listener = setup_logging(log_level, log_levels, log_rate)
+    if seed is not None:
+        seed += index  # Otherwise every shard would generate the same desk IDs and users
+        random.seed(seed)
+    state_file = shard_state_file(state_file, index, shards)
+    logger.info("Initializing shard %s of %s with simulation speed: %s, engine: %s, state file: %s",
+                index, shards, speed, engine, state_file)
+    desk_manager = DeskManager(speed, engine, state_file, seed=seed, history_samples=history_samples)
+    add_desks(desk_manager, desks, owns=lambda desk_id: shard_of(desk_id, shards) == index)
+    desk_manager.start_updates()
+
+    def handler(*args, **kwargs):
+        return KeepAliveRESTServer(desk_manager, *args, **kwargs)
+
+    SimpleRESTServer.initialize_api_keys()
+    shard = PooledHTTPServer(("127.0.0.1", 0), handler, workers=workers)
+    threading.Thread(target=shard.serve_forever, name=f"shard-{index}-server").start()
+    ports[index] = shard.server_port
+    pool = router = None
+    try:
+        while not all(ports):
+            if stop.wait(0.05):
+                return
+        pool = ShardPool(list(ports), index, partial(InProcessRESTServer.send, desk_manager), connections=workers)
+
+        def route(*args, **kwargs):
+            return ShardRouter(pool, *args, **kwargs)
+
+        router = serve_listener(listener, route, workers, cert_file, key_file, name=f"shard-{index}-router")
+        ready.put((index, shard.server_port))
+        wait_for_stop(stop)
+    finally:
+        if router is not None:
+            stop_server(router)
+        if pool is not None:
+            pool.close()
+        stop_server(shard)
+        desk_manager.stop_updates()
+        logger.info("Shard %s stopped.", index)
+        log_listener.stop()  # Child processes exit without running atexit handlers
+
+def run_sharded(port=8000, use_https=False, cert_file=None, key_file=None, desks=2, speed=60, workers=8,
+                engine="object", state_file=DeskManager.STATE_FILE, shards=2, seed=None,
+                history_samples=DeskManager.HISTORY_SAMPLES, log_level="INFO", log_levels=None,
+                log_rate=log_config.DEFAULT_RATE):
+    """Split the desks across `shards` processes by desk ID, which all serve the usual URLs on one port.
+
+    Every shard accepts connections on the same listening socket, so parsing, routing
+    and merging responses is spread over the shards instead of passing through one process.
+    """
+    if use_https and (not cert_file or not key_file):
+        logger.error("Both certificate and key files must be provided for HTTPS.")
+        raise ValueError("Both certificate and key files must be provided for HTTPS.")
+
+    server_address = ("localhost", port)
+    listener = socket.create_server(server_address, backlog=PooledHTTPServer.request_queue_size)
+    ports = multiprocessing.Array("i", shards, lock=False)  # Local port of each shard, for the others
+    group = ProcessGroup(shards, partial(
+        run_shard, listener=listener, ports=ports, desks=-(-desks // shards), speed=speed, workers=workers,
+        engine=engine, state_file=state_file, seed=seed, history_samples=history_samples,
+        cert_file=cert_file if use_https else None, key_file=key_file, log_level=log_level,
+        log_levels=log_levels, log_rate=log_rate,
+    ))
+    protocol = "HTTPS" if use_https else "HTTP"
+
+    try:
+        group.start("shard")
+        logger.info("Starting %s server on port %s (%s shards on local ports %s)...", protocol, port, shards, group.values)
+        while all(process.is_alive() for process in group.processes):
+            time.sleep(1)
+        logger.error("A shard process exited unexpectedly.")
+    except KeyboardInterrupt:
+        logger.info("Shutting down server...")
+    finally:
+        listener.close()
+        group.close()  # The shards save their state
+        logger.info("Server stopped.")
+
+def run_reader(index, readers, ready, stop, listener=None, owner_port=None, shared_state=None, workers=8,
+               cert_file=None, key_file=None, log_level="INFO", log_levels=None, log_rate=log_config.DEFAULT_RATE):
+    """Run one reader process: serve GETs on the shared listening socket from the shared desk state."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches every process; the owner stops the readers
+    log_listener = setup_logging(log_level, log_levels, log_rate)
+    desk_state = SharedStateReader(shared_state)
+
+    def handler(*args, **kwargs):
+        return ReaderRESTServer(desk_state, owner_port, *args, **kwargs)
+
+    SimpleRESTServer.initialize_api_keys()
+    httpd = serve_listener(listener, handler, workers, cert_file, key_file, name=f"reader-{index}-server")
+    ready.put((index, os.getpid()))
+
+    try:
+        wait_for_stop(stop)
+    finally:
+        stop_server(httpd)
+        desk_state.close()
+        log_listener.stop()  # Child processes exit without running atexit handlers
+
+def run_with_readers(port=8000, use_https=False, cert_file=None, key_file=None, desks=2, speed=60, workers=8,
+                     engine="object", state_file=DeskManager.STATE_FILE, readers=2, seed=None,
+                     history_samples=DeskManager.HISTORY_SAMPLES, log_level="INFO", log_levels=None,
+                     log_rate=log_config.DEFAULT_RATE):
+    """Run the simulation in this process, and serve requests from `readers` processes.
+
+    The readers answer GETs from the desk state this process publishes to shared memory,
+    and forward other requests to it over a local port.
+    """
+    if use_https and (not cert_file or not key_file):
+        logger.error("Both certificate and key files must be provided for HTTPS.")
+        raise ValueError("Both certificate and key files must be provided for HTTPS.")
+    if seed is not None:
+        random.seed(seed)
+    logger.info("Initializing DeskManager with simulation speed: %s, engine: %s", speed, engine)
+    desk_manager = DeskManager(speed, engine, state_file, seed=seed, history_samples=history_samples)
+    add_desks(desk_manager, desks)
+    shared_state = SharedStateWriter(max(len(desk_manager.desks), 1))
+    desk_manager.share_state(shared_state)
+    desk_manager.start_updates()
+
+    def handler(*args, **kwargs):
+        return KeepAliveRESTServer(desk_manager, *args, **kwargs)
+
+    SimpleRESTServer.initialize_api_keys()
+    # Each reader worker forwards at most one request at a time
+    owner = PooledHTTPServer(("127.0.0.1", 0), handler, workers=readers * workers + 1)
+    owner_thread = threading.Thread(target=owner.serve_forever, name="owner-server")
+    owner_thread.start()
+    logger.info("Forwarded requests are served on port %s.", owner.server_port)
+
+    server_address = ("localhost", port)
+    listener = socket.create_server(server_address, backlog=PooledHTTPServer.request_queue_size)
+    group = ProcessGroup(readers, partial(
+        run_reader, listener=listener, owner_port=owner.server_port, shared_state=shared_state.name,
+        workers=workers, cert_file=cert_file if use_https else None, key_file=key_file, log_level=log_level,
+        log_levels=log_levels, log_rate=log_rate,
+    ))
+    protocol = "HTTPS" if use_https else "HTTP"
+
+    try:
+        group.start("reader")
+        logger.info("Starting %s server on port %s (%s readers)...", protocol, port, readers)
+        while all(process.is_alive() for process in group.processes):
+            time.sleep(1)
+        logger.error("A reader process exited unexpectedly.")
+    except KeyboardInterrupt:
+        logger.info("Shutting down server...")
+    finally:
+        listener.close()
+        group.close()
+        owner.shutdown()
+        owner_thread.join()
+        owner.server_close()
         desk_manager.stop_updates()  # Stop the desk updates
+        shared_state.close()
         logger.info("Server stopped.")
 
 """
@@ -87,21 +343,133 @@ if __name__ == "__main__":
     parser.add_argument("--keyfile", type=str, help="Path to the SSL key file")
     parser.add_argument("--desks", type=int, default=2, help="Minimum number of desks to simulate (default: 2)")
     parser.add_argument("--speed", type=int, default=60, help="Simulation speed (default: 60)")
-    parser.add_argument("--log-level", type=str, default="INFO", help="Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)")
+    parser.add_argument("--engine", type=str, choices=DeskManager.ENGINES, default="object",
+                        help="object: one Desk object per desk; vectorized: NumPy column store stepped in one pass; "
+                             "lazy: analytic motion evaluated on read, no per-desk ticking (default: object)")
+    parser.add_argument("--server-mode", type=str, choices=["pooled", "single", "async"], default="pooled",
+                        help="pooled: worker pool with HTTP/1.1 keep-alive; single: original single-threaded HTTP/1.0 server; "
+                             "async: simulation and HTTP/1.1 on one asyncio event loop with drift-free ticks (default: pooled)")
+    parser.add_argument("--workers", type=int, default=8, help="Number of HTTP worker threads in pooled mode (default: 8)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split the desks across this many simulator processes by desk ID, which all serve the same "
+                             "URLs on one port; each shard keeps its own state file (default: 1, no sharding)")
+    parser.add_argument("--readers", type=int, default=0,
+                        help="Serve requests from this many processes that read the desks from shared memory, "
+                             "forwarding updates to the simulation process (default: 0, no reader processes)")
+    parser.add_argument("--overrun-policy", type=str, choices=PeriodicTask.POLICIES, default="catch-up",
+                        help="async mode: after a tick overruns, run the missed ticks right away (catch-up, at most "
+                             f"{PeriodicTask.MAX_CATCH_UP_RUNS}) or only the latest one (skip) (default: catch-up)")
+    parser.add_argument("--state-file", type=str,
+                        help=f"State file; a .bin extension selects the compact binary format (default: {DeskManager.STATE_FILE}; "
+                             "with --headless, the fleet to start from, which is never written)")
+    parser.add_argument("--history-samples", type=int, default=DeskManager.HISTORY_SAMPLES,
+                        help="Changes of position kept per desk for GET /desks/<id>/history, 16 bytes each, e.g. up to "
+                             "46 KB per desk for 2880; 0 disables the history (default: 0)")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run the simulation against a virtual clock as fast as possible, without a server, "
+                             "and print usage and error aggregates")
+    parser.add_argument("--days", type=float, default=7, help="Simulated days to run with --headless (default: 7)")
+    parser.add_argument("--seed", type=int, help="Seed of the random number generators; headless runs with the same seed are identical")
+    parser.add_argument("--report", type=str, help="With --headless, write the aggregates to this JSON file instead of printing them")
+    parser.add_argument("--log-level", type=str,
+                        help="Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL) (default: INFO; CRITICAL with --headless)")
+    parser.add_argument("--log-levels", type=str,
+                        help="Levels of single loggers, e.g. desk.motion=INFO,simple_rest_server.access=WARNING "
+                             "(default: desk.motion=WARNING)")
+    parser.add_argument("--log-rate", type=int, default=log_config.DEFAULT_RATE,
+                        help="Records per second logged by each per-desk or per-request logger "
+                             f"({', '.join(log_config.RATE_LIMITED)}); 0 for no limit (default: {log_config.DEFAULT_RATE})")
 
     args = parser.parse_args()
+    # Headless runs report collisions in their aggregates instead of logging each one
+    args.log_level = args.log_level or ("CRITICAL" if args.headless else "INFO")
+
+    try:
+        setup_logging(args.log_level, args.log_levels, args.log_rate)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.shards > 1 and (args.headless or args.server_mode != "pooled"):
+        parser.error("--shards requires the pooled server mode and cannot be used with --headless")
+    if args.readers > 0 and (args.headless or args.server_mode != "pooled" or args.shards > 1):
+        parser.error("--readers requires the pooled server mode and cannot be used with --headless or --shards")
 
-    setup_logging(args.log_level)
+    if args.headless:
+        run_headless(
+            desks=args.desks,
+            speed=args.speed,
+            engine=args.engine,
+            days=args.days,
+            seed=args.seed,
+            state_file=args.state_file,
+            report_file=args.report
+        )
+        sys.exit()
 
     logger.info("Starting server with the following configuration:")
-    logger.info(f"Port: {args.port}")
-    logger.info(f"HTTPS: {'Enabled' if args.https else 'Disabled'}")
+    logger.info("Port: %s", args.port)
+    logger.info("HTTPS: %s", 'Enabled' if args.https else 'Disabled')
     if args.https:
-        logger.info(f"Certificate file: {args.certfile}")
-        logger.info(f"Key file: {args.keyfile}")
-    logger.info(f"Number of desks: {args.desks}")
-    logger.info(f"Simulation speed: {args.speed}")
-    logger.info(f"Logging level: {args.log_level}")
+        logger.info("Certificate file: %s", args.certfile)
+        logger.info("Key file: %s", args.keyfile)
+    logger.info("Server mode: %s", args.server_mode)
+    if args.shards > 1:
+        logger.info("Shards: %s", args.shards)
+    if args.readers > 0:
+        logger.info("Readers: %s", args.readers)
+    if args.server_mode == "pooled":
+        logger.info("Workers: %s", args.workers)
+    elif args.server_mode == "async":
+        logger.info("Overrun policy: %s", args.overrun_policy)
+    logger.info("Number of desks: %s", args.desks)
+    logger.info("Simulation speed: %s", args.speed)
+    logger.info("Engine: %s", args.engine)
+    logger.info("State file: %s", args.state_file or DeskManager.STATE_FILE)
+    logger.info("History samples per desk: %s", args.history_samples)
+    logger.info("Logging level: %s", args.log_level)
+    if args.log_levels:
+        logger.info("Logger levels: %s", args.log_levels)
+    logger.info("Log rate limit: %s", args.log_rate or 'none')
+
+    if args.shards > 1:
+        run_sharded(
+            port=args.port,
+            use_https=args.https,
+            cert_file=args.certfile,
+            key_file=args.keyfile,
+            desks=args.desks,
+            speed=args.speed,
+            workers=args.workers,
+            engine=args.engine,
+            state_file=args.state_file or DeskManager.STATE_FILE,
+            shards=args.shards,
+            seed=args.seed,
+            history_samples=args.history_samples,
+            log_level=args.log_level,
+            log_levels=args.log_levels,
+            log_rate=args.log_rate
+        )
+        sys.exit()
+
+    if args.readers > 0:
+        run_with_readers(
+            port=args.port,
+            use_https=args.https,
+            cert_file=args.certfile,
+            key_file=args.keyfile,
+            desks=args.desks,
+            speed=args.speed,
+            workers=args.workers,
+            engine=args.engine,
+            state_file=args.state_file or DeskManager.STATE_FILE,
+            readers=args.readers,
+            seed=args.seed,
+            history_samples=args.history_samples,
+            log_level=args.log_level,
+            log_levels=args.log_levels,
+            log_rate=args.log_rate
+        )
+        sys.exit()
 
     run(
         port=args.port,
@@ -109,5 +477,12 @@ if __name__ == "__main__":
         cert_file=args.certfile,
         key_file=args.keyfile,
         desks=args.desks,
-        speed=args.speed
+        speed=args.speed,
+        server_mode=args.server_mode,
+        workers=args.workers,
+        engine=args.engine,
+        state_file=args.state_file or DeskManager.STATE_FILE,
+        overrun_policy=args.overrun_policy,
+        seed=args.seed,
+        history_samples=args.history_samples
     )
@@ -0,0 +1,172 @@
+import bisect
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LOCK_BUCKETS_S = (0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1)
+LOCK_MIN_WAIT_S = LOCK_BUCKETS_S[0]  # TimedLock does not observe shorter waits
+
+class Metric:
+    """One metric family in the Prometheus text format, with a series per combination of label values."""
+    TYPE = None
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.series = {}  # Label values -> value
+        self.lock = threading.Lock()
+
+    def _labels(self, values, extra=""):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        """Get the lines of the metric family."""
+        with self.lock:
+            series = sorted(self.series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(f"{self.name}{self._labels(values)} {_number(value)}" for values, value in series)
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount=1, labels=()):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.series[labels] = value
+
+
+class Histogram(Metric):
+    """Histogram of durations in seconds. Each series keeps a count per bucket, its sum and its count."""
+    TYPE = "histogram"
+
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS_S):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets)
+        if not label_names:
+            self.series[()] = [[0] * (len(self.buckets) + 1), 0.0]  # Rendered, with zero counts, before any observation
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        with self.lock:
+            series = sorted((values, (counts[:], total)) for values, (counts, total) in self.series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        for values, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self._labels(values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(values)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._labels(values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics of one component, rendered together."""
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Get the metrics in the Prometheus text format."""
+        return "".join(line + "\n" for metric in self.metrics for line in metric.render())
+
+
+class TimedLock:
+    """A threading.Lock that observes how long acquisitions waited for it and held it.
+
+    Every hold is observed, but only waits of at least LOCK_MIN_WAIT_S: an acquisition
+    that does not have to wait costs one extra non-blocking attempt and no clock reads
+    before it, and adds nothing to the wait histogram. The count of that histogram is
+    thus the number of contended acquisitions, and the count of the hold histogram the
+    number of all of them.
+    """
+    def __init__(self, wait: Histogram, hold: Histogram):
+        self._lock = threading.Lock()
+        self.wait = wait
+        self.hold = hold
+        self.acquired_at = 0.0
+
+    def acquire(self):
+        if self._lock.acquire(False):
+            self.acquired_at = time.perf_counter()
+        else:
+            started = time.perf_counter()
+            self._lock.acquire()
+            self.acquired_at = time.perf_counter()
+            if self.acquired_at - started >= LOCK_MIN_WAIT_S:
+                self.wait.observe(self.acquired_at - started)
+        return True
+
+    def release(self):
+        held_s = time.perf_counter() - self.acquired_at
+        self._lock.release()
+        self.hold.observe(held_s)
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def merge_exports(exports, label_name):
+    """Merge the Prometheus texts of several processes, e.g. one per shard, into one.
+
+    The samples of the i-th text get the label label_name="i", and the samples of each
+    metric family are kept together, as the format requires.
+    """
+    families = {}  # Family name -> [HELP and TYPE lines, samples], in order of appearance
+    for index, text in enumerate(exports):
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                name = line.split(" ", 3)[2]
+                family = families.setdefault(name, [[], []])
+                if len(family[0]) < 2:
+                    family[0].append(line)
+            elif line and family is not None:
+                name, separator, rest = line.partition("{")
+                if separator:
+                    label = f'{label_name}="{index}",' if not rest.startswith("}") else f'{label_name}="{index}"'
+                    family[1].append(f"{name}{{{label}{rest}")
+                else:
+                    name, _, value = line.partition(" ")
+                    family[1].append(f'{name}{{{label_name}="{index}"}} {value}')
+    return "".join(line + "\n" for header, samples in families.values() for line in header + samples)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,225 @@
+import time
+import queue
+import select
+import socket
+import itertools
+import selectors
+import threading
+import logging
+from collections import OrderedDict
+from http.server import HTTPServer
+
+logger = logging.getLogger(__name__)
+
+class PooledRequestHandler:
+    """Mixin for the request handlers of a PooledHTTPServer.
+
+    A worker serves the requests a keep-alive connection has ready, then leaves the
+    connection idle: the server watches it and hands it to a worker again when the
+    next request arrives, so idle clients do not hold workers. While no other connection
+    waits for a worker, the worker first waits a little for the next request itself,
+    which saves the hand-off when a client sends its requests back to back.
+    """
+    idle = False
+
+    def handle(self):
+        self.idle = False
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self._request_ready(self.server.linger_s()):
+                self.idle = True
+                return
+            self.handle_one_request()
+
+    def resume(self):
+        """Serve the next requests of an idle connection."""
+        try:
+            self.handle()
+        finally:
+            self.finish()
+
+    def finish(self):
+        if not self.idle:
+            super().finish()
+
+    def close(self):
+        """Flush and close the files of an idle connection; the server closes its socket."""
+        self.idle = False
+        self.finish()
+
+    def leave_pool(self):
+        """Serve the rest of this connection, e.g. an event stream, on a thread outside the pool."""
+        self.server.detach_worker()
+
+    def _request_ready(self, wait_s=0):
+        """Whether the next request can be read within wait_s seconds, or is already buffered."""
+        # select, because a timeout would make the buffered reader of the socket unusable
+        if select.select([self.connection], [], [], wait_s)[0]:
+            return True
+        # A pipelined request may already be in the buffers of the reader, or of TLS
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:  # ssl.SSLWantReadError on a TLS connection with nothing to read yet
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTP server that serves requests on a fixed pool of worker threads.
+
+    The workers serve requests, not connections: a new connection, or a keep-alive one
+    between requests, waits in a selector on the http-idle thread, which hands it to a
+    worker once it has a request to read. The pool bounds concurrency: when every worker
+    is busy, ready connections wait for one in a queue. At most `max_idle_connections`
+    wait idle; beyond that, and after `idle_timeout_s`, the longest idle ones are closed.
+    Requests that last, like event streams, leave the pool (see detach_worker).
+    """
+    request_queue_size = 128
+    max_idle_connections = 512
+    idle_timeout_s = 15
+    keep_alive_wait_s = 0.002  # How long a worker waits for the next request of its connection, when no other waits
+
+    def __init__(self, server_address, handler_class, workers=8, bind_and_activate=True):
+        if workers < 1:
+            raise ValueError(f"Invalid number of workers: {workers}")
+        self.workers = workers
+        self.ready_connections = queue.SimpleQueue()  # (socket, address) of new connections, or idle handlers
+        self.parked_connections = queue.SimpleQueue()  # (connection, idle since) for the http-idle thread to watch
+        self.worker_names = itertools.count()
+        self.local = threading.local()
+        self.closing = False
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        self.idle_thread = None  # server_close runs before it starts when binding fails
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+        for _ in range(workers):
+            self._start_worker()
+        self.idle_thread = threading.Thread(target=self._watch_idle_connections, name="http-idle", daemon=True)
+        self.idle_thread.start()
+        logger.info("HTTP worker pool started with %s workers.", workers)
+
+    def _start_worker(self):
+        threading.Thread(target=self._serve_requests, name=f"http-worker-{next(self.worker_names)}", daemon=True).start()
+
+    def _serve_requests(self):
+        """Worker loop: serve ready connections until a None sentinel is received or the worker is detached."""
+        while True:
+            item = self.ready_connections.get()
+            if item is None:
+                return
+            handler = None
+            if isinstance(item, PooledRequestHandler):
+                request, client_address = item.request, item.client_address
+                try:
+                    item.resume()
+                    handler = item
+                except Exception:
+                    self.handle_error(request, client_address)
+            else:
+                request, client_address = item
+                try:
+                    handler = self.RequestHandlerClass(request, client_address, self)
+                except Exception:
+                    self.handle_error(request, client_address)
+
+            if getattr(handler, "idle", False) and not self.closing:
+                self._park(handler)
+            else:
+                self.shutdown_request(request)
+            if getattr(self.local, "detached", False):
+                return
+
+    def process_request(self, request, client_address):
+        """Wait for the first request of a new connection without holding a worker."""
+        self._park((request, client_address))
+
+    def linger_s(self):
+        """How long the calling worker may wait for the next request of its connection."""
+        return self.keep_alive_wait_s if self.ready_connections.empty() else 0
+
+    def detach_worker(self):
+        """Take the calling worker out of the pool, for a request that lasts, like an event stream.
+
+        A new worker takes its place, and the calling thread exits once it has closed its connection.
+        """
+        if not getattr(self.local, "detached", False):
+            self.local.detached = True
+            self._start_worker()
+
+    def _park(self, item):
+        self.parked_connections.put((item, time.monotonic()))
+        try:
+            self.wakeup_writer.send(b"\0")
+        except OSError:
+            pass  # A wake-up is already pending, or the server is closed
+
+    def _watch_idle_connections(self):
+        """http-idle loop: hand connections that became readable to the workers, and close stale ones."""
+        idle = OrderedDict()  # Socket -> (connection, idle since), longest idle first
+        while not self.closing:
+            for key, _ in self.selector.select(1):
+                if key.fileobj is self.wakeup_reader:
+                    self.wakeup_reader.recv(4096)
+                    continue
+                self.selector.unregister(key.fileobj)
+                del idle[key.fileobj]
+                self.ready_connections.put(key.data)
+
+            while True:
+                try:
+                    item, since = self.parked_connections.get_nowait()
+                except queue.Empty:
+                    break
+                request = item.request if isinstance(item, PooledRequestHandler) else item[0]
+                try:
+                    self.selector.register(request, selectors.EVENT_READ, item)
+                except (OSError, ValueError):  # Already closed
+                    self._close_idle(item)
+                    continue
+                idle[request] = (item, since)
+
+            expired = time.monotonic() - self.idle_timeout_s
+            while idle and (len(idle) > self.max_idle_connections or next(iter(idle.values()))[1] < expired):
+                request, (item, _) = idle.popitem(last=False)
+                self.selector.unregister(request)
+                self._close_idle(item)
+
+        for item, _ in idle.values():
+            self._close_idle(item)
+        self.selector.close()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
+
+    def _close_idle(self, item):
+        if isinstance(item, PooledRequestHandler):
+            request = item.request
+            try:
+                item.close()
+            except OSError:
+                pass  # The client left
+        else:
+            request = item[0]
+        self.shutdown_request(request)
+
+    def server_close(self):
+        """Close the listening socket and the idle connections, and ask the workers to exit."""
+        super().server_close()
+        self.closing = True
+        if self.idle_thread is None:  # Binding failed, so neither the idle thread nor the workers started
+            self.selector.close()
+            self.wakeup_reader.close()
+            self.wakeup_writer.close()
+            return
+        try:
+            self.wakeup_writer.send(b"\0")
+        except OSError:
+            pass
+        self.idle_thread.join()
+        for _ in range(self.workers):
+            self.ready_connections.put(None)
@@ -0,0 +1,144 @@
+import bisect
+import threading
+from array import array
+
+class PositionRing:
+    """Ring buffer of one desk's (clock_s, position_mm) samples, oldest first.
+
+    Samples are kept in two typed arrays, 16 bytes each, that grow up to `capacity`;
+    once full, a new sample overwrites the oldest one. A sample holds until the next
+    one, so only changes of position are stored.
+    """
+    __slots__ = ("capacity", "clocks", "positions", "oldest")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.clocks = array("q")
+        self.positions = array("d")
+        self.oldest = 0
+
+    def __len__(self):
+        return len(self.clocks)
+
+    def sample(self, position):
+        """Get the sample at a position, 0 being the oldest."""
+        index = (self.oldest + position) % len(self.clocks)
+        return self.clocks[index], self.positions[index]
+
+    def append(self, clock_s, position_mm):
+        """Record the position of the desk from clock_s on."""
+        if self.clocks:
+            last_clock, last_position = self.sample(len(self.clocks) - 1)
+            if last_position == position_mm:
+                return
+            if clock_s <= last_clock:
+                # Changed again within the same second: keep the latest position
+                self.positions[(self.oldest - 1) % len(self.clocks)] = position_mm
+                return
+        if len(self.clocks) < self.capacity:
+            self.clocks.append(clock_s)
+            self.positions.append(position_mm)
+        else:
+            self.clocks[self.oldest] = clock_s
+            self.positions[self.oldest] = position_mm
+            self.oldest = (self.oldest + 1) % self.capacity
+
+    def count_until(self, clock_s):
+        """Get the number of samples at or before clock_s."""
+        if self.oldest == 0:
+            return bisect.bisect_right(self.clocks, clock_s)
+        # Samples from `oldest` to the end of the arrays come first, then those before it
+        if clock_s < self.clocks[0]:
+            return bisect.bisect_right(self.clocks, clock_s, self.oldest) - self.oldest
+        return len(self.clocks) - self.oldest + bisect.bisect_right(self.clocks, clock_s, 0, self.oldest)
+
+
+class HistoryDisabledError(Exception):
+    """Raised for a position history query when no history is kept (history_samples=0)."""
+
+
+class PositionHistory:
+    """Position history of every desk, queried by time range with optional downsampling.
+
+    DeskManager records the position of each desk it publishes, at the desk's clock,
+    so the history has the resolution of the published snapshots. Each desk keeps at
+    most `capacity` changes of position.
+    """
+    MAX_BUCKETS = 10000
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rings = {}  # Desk ID -> PositionRing
+        self.lock = threading.Lock()
+
+    def record(self, samples):
+        """Record a list of (desk_id, clock_s, position_mm) samples."""
+        with self.lock:
+            for desk_id, clock_s, position_mm in samples:
+                ring = self.rings.get(desk_id)
+                if ring is None:
+                    ring = self.rings[desk_id] = PositionRing(self.capacity)
+                ring.append(clock_s, position_mm)
+
+    def remove(self, desk_id):
+        with self.lock:
+            self.rings.pop(desk_id, None)
+
+    def first_clock(self, desk_id):
+        """Get the clock of the oldest sample of a desk, or None if it has none."""
+        with self.lock:
+            ring = self.rings.get(desk_id)
+            return ring.sample(0)[0] if ring else None
+
+    def samples(self, desk_id, start, end):
+        """Get the [clock_s, position_mm] samples of a desk from start to end, in seconds of its clock.
+
+        The first sample is the one in effect at `start`, which may be older.
+        """
+        with self.lock:
+            ring = self.rings.get(desk_id)
+            if not ring:
+                return []
+            first = max(ring.count_until(start) - 1, 0)
+            return [[clock_s, _number(position_mm)]
+                    for clock_s, position_mm in map(ring.sample, range(first, ring.count_until(end)))]
+
+    @classmethod
+    def check_resolution(cls, start, end, resolution):
+        """Raise ValueError unless `resolution` splits start to end into at most MAX_BUCKETS buckets."""
+        if resolution < 1 or (end - start) // resolution >= cls.MAX_BUCKETS:
+            raise ValueError(f"Invalid resolution: {resolution}")
+
+    def downsample(self, desk_id, start, end, resolution):
+        """Get the [clock_s, min, max, avg] position of a desk over each `resolution` seconds from start to end.
+
+        Each position holds until the next sample, so averages are weighted by time.
+        Buckets before the oldest sample are left out.
+        """
+        self.check_resolution(start, end, resolution)
+        samples = self.samples(desk_id, start, end)
+        buckets = []
+        for i, (clock_s, position_mm) in enumerate(samples):
+            # The position holds from clock_s until the next sample, or the end of the last second
+            segment_start = max(clock_s, start)
+            segment_end = samples[i + 1][0] if i + 1 < len(samples) else end + 1
+            while segment_start < segment_end:
+                bucket_start = start + (segment_start - start) // resolution * resolution
+                until = min(segment_end, bucket_start + resolution)
+                if not buckets or buckets[-1][0] != bucket_start:
+                    buckets.append([bucket_start, position_mm, position_mm, 0])
+                bucket = buckets[-1]
+                bucket[1] = min(bucket[1], position_mm)
+                bucket[2] = max(bucket[2], position_mm)
+                bucket[3] += position_mm * (until - segment_start)
+                segment_start = until
+
+        for bucket in buckets:
+            duration = min(bucket[0] + resolution, end + 1) - max(bucket[0], samples[0][0])
+            bucket[3] = round(bucket[3] / duration, 1)
+        return buckets
+
+
+def _number(value):
+    """Send whole positions as integers, as in desk states."""
+    return int(value) if value.is_integer() else value
@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import marshal
+import threading
+import traceback
+import tracemalloc
+from collections import Counter
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler for the other threads of this process.
+
+    Every `interval_s` the stack of each thread is read from sys._current_frames() and
+    counted, so threads run at full speed between samples and a profile can be taken of
+    a running simulator. Waiting threads are sampled too: their stacks show where they wait.
+    """
+    INTERVAL_S = 0.005
+
+    def __init__(self, interval_s=INTERVAL_S):
+        self.interval_s = interval_s
+        self.stacks = Counter()  # (thread name, ((filename, first line, function), ...) from the root) -> samples
+        self.samples = 0
+
+    def run(self, duration_s):
+        """Sample the other threads for duration_s seconds, from the calling thread."""
+        own_ident = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + duration_s
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                if ident not in names:
+                    names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                self.stacks[names.get(ident, str(ident)), tuple(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval_s)
+
+    def collapsed(self):
+        """Get the samples as collapsed stacks, one "thread;function (file:line);... count" line per stack.
+
+        This is the input format of flamegraph.pl, speedscope and similar tools.
+        """
+        lines = []
+        for (thread_name, stack), count in self.stacks.most_common():
+            frames = ";".join(f"{function} ({os.path.basename(filename)}:{line})" for filename, line, function in stack)
+            lines.append(f"{thread_name};{frames} {count}\n")
+        return "".join(lines)
+
+    def pstats(self):
+        """Get the samples in the format of cProfile's dump_stats, to load with pstats.Stats.
+
+        Times are the sampled wall time of each function, and call counts are sample counts.
+        """
+        stats = {}  # Function -> [primitive calls, calls, own time, cumulative time, {caller: (same four)}]
+        for (_, stack), count in self.stacks.items():
+            seconds = count * self.interval_s
+            seen = set()
+            for depth, function in enumerate(stack):
+                entry = stats.setdefault(function, [0, 0, 0.0, 0.0, {}])
+                own_s = seconds if depth == len(stack) - 1 else 0.0
+                entry[2] += own_s
+                if function not in seen:  # A recursive function counts once per sample
+                    seen.add(function)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += seconds
+                if depth:
+                    caller = entry[4].get(stack[depth - 1], (0, 0, 0.0, 0.0))
+                    entry[4][stack[depth - 1]] = (caller[0] + count, caller[1] + count,
+                                                  caller[2] + own_s, caller[3] + seconds)
+        return marshal.dumps({function: tuple(entry) for function, entry in stats.items()})
+
+
+def thread_stacks():
+    """Get the name, ID and current stack, innermost last, of every thread of this process."""
+    frames = sys._current_frames()
+    return [
+        {
+            "name": thread.name,
+            "ident": thread.ident,
+            "daemon": thread.daemon,
+            "stack": [f"{frame.filename}:{frame.lineno} in {frame.name}: {frame.line}"
+                      for frame in traceback.extract_stack(frames[thread.ident])],
+        }
+        for thread in threading.enumerate()
+        if thread.ident in frames
+    ]
+
+
+def top_allocations(limit=20, group_by="lineno", stop=False):
+    """Get the lines (or files) that hold the most memory allocated since tracemalloc started.
+
+    Starts tracemalloc if it is not tracing, so the first call mostly starts it; tracing
+    slows allocations down until `stop` is given.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    if stop:
+        tracemalloc.stop()
+    return {
+        "started": started,
+        "tracing": not stop,
+        "traced_bytes": traced_bytes,
+        "peak_bytes": peak_bytes,
+        "top": [
+            {
+                "file": stat.traceback[0].filename,
+                "line": stat.traceback[0].lineno if group_by == "lineno" else None,
+                "size_bytes": stat.size,
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics(group_by)[:limit]
+        ],
+    }
@@ -0,0 +1,447 @@
+import os
+import json
+import time
+import zlib
+import queue
+import threading
+import http.client
+import multiprocessing
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, urlencode
+from http.server import BaseHTTPRequestHandler
+from fleet_stats import merge_stats
+from metrics import CONTENT_TYPE, merge_exports
+from pooled_http_server import PooledRequestHandler
+
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger(f"{__name__}.access")
+
+def shard_of(desk_id, shards):
+    """Index of the shard that owns a desk, from a hash of its ID that is stable across processes."""
+    return zlib.crc32(desk_id.encode("utf-8")) % shards
+
+def shard_state_file(state_file, index, shards):
+    """State file of one shard, e.g. data/desks_state.shard0of4.json. The journal is named after it."""
+    root, extension = os.path.splitext(state_file)
+    return f"{root}.shard{index}of{shards}{extension}"
+
+def wait_for_stop(stop):
+    """Block a worker process until its parent asks it to stop, or exits without asking."""
+    parent = os.getppid()
+    while not stop.wait(1) and os.getppid() == parent:
+        pass
+
+class LocalClient:
+    """Keep-alive HTTP connections to servers on 127.0.0.1, one per thread and port."""
+    def __init__(self):
+        self.local = threading.local()
+
+    def send(self, port, method, path, body=None, headers=None):
+        """Send a request; returns (status, headers, body).
+
+        A stale keep-alive connection is replaced and the request sent once more.
+        """
+        connections = self.local.__dict__.setdefault("connections", {})
+        for attempt in range(2):
+            connection = connections.get(port)
+            if connection is None:
+                connection = connections[port] = http.client.HTTPConnection("127.0.0.1", port)
+            try:
+                connection.request(method, path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                return response.status, response.getheaders(), response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                del connections[port]
+                if attempt:
+                    raise
+
+    @staticmethod
+    def open_stream(port, path):
+        """Open a dedicated connection for a streaming request; returns the connection and its response."""
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        connection.request("GET", path)
+        return connection, connection.getresponse()
+
+def relay_response(handler, status, headers, body):
+    """Send a response received from another process to the client of `handler`."""
+    handler.send_response(status)
+    headers = dict(headers)
+    for name in ("Content-Type", "ETag"):
+        if name in headers:
+            handler.send_header(name, headers[name])
+    if status != 304:
+        handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    if status != 304:
+        handler.wfile.write(body)
+
+class ProcessGroup:
+    """Worker processes started together, each reporting when it is ready.
+
+    `target(index, count, ready, stop)` runs one process: it puts (index, value) on
+    `ready` once serving, e.g. the port it listens on, and shuts down when `stop` is set.
+    """
+    START_TIMEOUT_S = 300  # Loading a large state file can take a while
+    STOP_TIMEOUT_S = 120
+
+    def __init__(self, count, target):
+        self.count = count
+        self.target = target
+        self.ready = multiprocessing.Queue()
+        self.stop = multiprocessing.Event()
+        self.processes = []
+        self.values = [None] * count
+
+    def start(self, name):
+        """Start the processes and wait until all of them are ready."""
+        for index in range(self.count):
+            process = multiprocessing.Process(target=self.target, args=(index, self.count, self.ready, self.stop),
+                                              name=f"{name}-{index}")
+            process.start()
+            self.processes.append(process)
+
+        waiting = self.count
+        waited_s = 0
+        while waiting:
+            try:
+                index, value = self.ready.get(timeout=1)
+            except queue.Empty:
+                waited_s += 1
+                failed = [process.name for process in self.processes if not process.is_alive()]
+                if failed or waited_s >= self.START_TIMEOUT_S:
+                    self.close()
+                    raise RuntimeError(f"Processes failed to start: {', '.join(failed) or 'timed out'}")
+                continue
+            self.values[index] = value
+            waiting -= 1
+
+    def close(self):
+        """Ask the processes to finish and exit, and wait for them."""
+        self.stop.set()
+        for process in self.processes:
+            process.join(self.STOP_TIMEOUT_S)
+            if process.is_alive():
+                logger.error("Process %s did not stop; terminating it.", process.name)
+                process.terminate()
+
+class ShardPool:
+    """Client of the shards, in each shard process.
+
+    `ports` are the local ports on which the shards serve their own desks, and
+    `local(method, path, body, headers)` serves a request for shard `index`, this one,
+    without a connection. A request is sent on the calling thread, over its keep-alive
+    connection to the shard; requests to every shard are sent in parallel by
+    `connections` client threads.
+    """
+    def __init__(self, ports, index, local, connections=8):
+        if len(ports) < 2:
+            raise ValueError(f"Invalid number of shards: {len(ports)}")
+        self.shards = len(ports)
+        self.ports = ports
+        self.index = index
+        self.local = local
+        self.client = LocalClient()
+        self.clients = ThreadPoolExecutor(max_workers=connections, thread_name_prefix="shard-client")
+        self.streams = 0
+        self.streams_lock = threading.Lock()
+
+    def close(self):
+        self.clients.shutdown(wait=False)
+
+    def request(self, index, method, path, body=None, headers=None):
+        """Send a request to a shard; returns (status, headers, body)."""
+        if index == self.index:
+            return self.local(method, path, body, headers)
+        return self.client.send(self.ports[index], method, path, body, headers)
+
+    def request_all(self, requests):
+        """Send (index, method, path, body, headers) requests in parallel; returns the responses in order."""
+        return list(self.clients.map(lambda request: self.request(*request), requests))
+
+    def open_stream(self, index, path):
+        """Open a dedicated connection for a streaming request; returns the connection and its response."""
+        return self.client.open_stream(self.ports[index], path)
+
+class ShardRouter(PooledRequestHandler, BaseHTTPRequestHandler):
+    """Serves the SimpleRESTServer URLs of a sharded simulator, in every shard process.
+
+    The shards accept connections on the listening socket they share, so any of them
+    may get any request. Requests for one desk go to the shard that owns it, served in
+    this process if that is this shard. Listing desks, batch updates, the change feed,
+    event streams and stats are sent to every shard and their responses merged.
+    Change cursors combine the cursors of all shards. Shards check API keys and paths,
+    so errors are theirs.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = 15
+    disable_nagle_algorithm = True
+    FORWARDED_HEADERS = ("If-None-Match",)
+    HEARTBEAT_INTERVAL_S = 10
+    MAX_EVENT_STREAMS = 100  # Each stream holds a thread, plus a reader thread per shard
+    CURSOR_SEPARATOR = "."
+    STATS_PATH = "stats"
+    METRICS_PATH = "metrics"
+    DEBUG_PATH = "debug"
+
+    def __init__(self, pool: ShardPool, *args, **kwargs):
+        self.pool = pool
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        access_logger.info("%s - " + format, self.address_string(), *args)
+
+    def _route(self):
+        """Get the path parts after /api/<version>/<api_key>/desks, or None for other paths."""
+        url = urlsplit(self.path)
+        self.query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if len(parts) < 4 or parts[0] != "api" or parts[3] != "desks":
+            return None
+        self.prefix = "/" + "/".join(parts[:4])
+        return parts[4:]
+
+    def _endpoint(self):
+        """Get the path parts after /api/<version>/<api_key>."""
+        return urlsplit(self.path).path.strip("/").split("/")[3:]
+
+    def _read_body(self):
+        content_length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(content_length) if content_length > 0 else None
+
+    def _forwarded_headers(self, body=None):
+        headers = {name: self.headers[name] for name in self.FORWARDED_HEADERS if name in self.headers}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        return headers
+
+    def _relay(self, status, headers, body):
+        relay_response(self, status, headers, body)
+
+    def _send_json(self, data, status=200):
+        self._relay(status, [("Content-Type", "application/json")], json.dumps(data).encode("utf-8"))
+
+    def _forward(self, index, body=None):
+        self._relay(*self.pool.request(index, self.command, self.path, body, self._forwarded_headers(body)))
+
+    def _forward_all(self, paths, body=None):
+        """Send a request to every shard in parallel, with one path each; returns their responses in shard order."""
+        headers = self._forwarded_headers(body)
+        return self.pool.request_all(
+            [(index, self.command, paths[index], body, headers) for index in range(self.pool.shards)]
+        )
+
+    def _first_error(self, responses):
+        """Relay the first response that is not 200, if any. Returns True if one was relayed."""
+        for response in responses:
+            if response[0] != 200:
+                self._relay(*response)
+                return True
+        return False
+
+    def do_GET(self):
+        rest = self._route()
+        if rest is None and self._endpoint() == [self.STATS_PATH]:
+            self._send_stats()
+        elif rest is None and self._endpoint() == [self.METRICS_PATH]:
+            self._send_metrics()
+        elif rest is None and self._endpoint()[:1] == [self.DEBUG_PATH]:
+            self._forward_debug()
+        elif rest == []:
+            self._list_desks()
+        elif rest == ["events"]:
+            self._stream_events()
+        elif rest == ["changes"]:
+            self._send_changes()
+        else:
+            self._forward_to_owner(rest)
+
+    def do_PUT(self):
+        rest = self._route()
+        body = self._read_body()
+        if rest == []:
+            self._update_desks_batch(body)
+        else:
+            self._forward_to_owner(rest, body)
+
+    def do_POST(self):
+        self._forward_to_owner(self._route(), self._read_body())
+
+    do_DELETE = do_PATCH = do_POST
+
+    def _forward_to_owner(self, rest, body=None):
+        """Forward a request for one desk to its shard; other requests go to the first shard."""
+        self._forward(shard_of(rest[0], self.pool.shards) if rest else 0, body)
+
+    def _list_desks(self):
+        """GET /desks and GET /desks?expand=...: join the lists or objects of all shards, each filtered by its own index."""
+        responses = self._forward_all([self.path] * self.pool.shards)
+        if self._first_error(responses):
+            return
+        bodies = [body.strip() for _, _, body in responses]
+        opening, closing = bodies[0][:1], bodies[0][-1:]  # [ ] for IDs, { } for expanded desks
+        items = [body[1:-1] for body in bodies if body[1:-1].strip()]
+        self._relay(200, responses[0][1], opening + b", ".join(items) + closing)
+
+    def _update_desks_batch(self, body):
+        """PUT /desks: send each shard the updates of its desks, and answer in the order of the request."""
+        try:
+            updates = json.loads(body) if body else None
+        except ValueError:
+            updates = None
+        valid_items = isinstance(updates, list) and updates and all(
+            isinstance(item, dict)
+            and isinstance(item.get("desk_id"), str)
+            and isinstance(item.get("position_mm"), (int, float))
+            and not isinstance(item.get("position_mm"), bool)
+            for item in updates
+        )
+        if not valid_items:
+            self._forward(0, body)  # The shard rejects it, or answers an empty batch
+            return
+
+        shard_items = [[] for _ in range(self.pool.shards)]
+        for position, item in enumerate(updates):
+            shard_items[shard_of(item["desk_id"], self.pool.shards)].append((position, item))
+        shards = [index for index, items in enumerate(shard_items) if items]
+        headers = self._forwarded_headers(body)
+        responses = self.pool.request_all([
+            (index, "PUT", self.path, json.dumps([item for _, item in shard_items[index]]), headers)
+            for index in shards
+        ])
+        if self._first_error(responses):
+            return
+
+        results = [None] * len(updates)
+        for index, (_, _, response_body) in zip(shards, responses):
+            for (position, _), result in zip(shard_items[index], json.loads(response_body)):
+                results[position] = result
+        self._send_json(results)
+
+    def _send_stats(self):
+        """GET /stats: add up the aggregates of all shards; a desk's stats come from its shard."""
+        desk_id = self.query.get("desk_id", [None])[-1]
+        if desk_id is not None:
+            self._forward(shard_of(desk_id, self.pool.shards))
+            return
+        responses = self._forward_all([self.path] * self.pool.shards)
+        if self._first_error(responses):
+            return
+        self._send_json(merge_stats([json.loads(body) for _, _, body in responses]))
+
+    def _send_metrics(self):
+        """GET /metrics: list the metrics of every shard, each with a shard="<index>" label."""
+        responses = self._forward_all([self.path] * self.pool.shards)
+        if self._first_error(responses):
+            return
+        metrics = merge_exports([body.decode("utf-8") for _, _, body in responses], "shard")
+        self._relay(200, [("Content-Type", CONTENT_TYPE)], metrics.encode("utf-8"))
+
+    def _forward_debug(self):
+        """GET /debug/...: forward to the shard given by ?shard=<index>, 0 by default."""
+        try:
+            index = int(self.query.get("shard", ["0"])[-1])
+        except ValueError:
+            index = -1
+        if not 0 <= index < self.pool.shards:
+            self._send_json({"error": "Invalid shard"}, 400)
+            return
+        self._forward(index)
+
+    def _send_changes(self):
+        """GET /desks/changes: follow each shard's change feed with a combined cursor."""
+        since = self.query.get("since", [None])[-1]
+        cursors = since.split(self.CURSOR_SEPARATOR) if since else []
+        if len(cursors) != self.pool.shards:
+            cursors = [None] * self.pool.shards
+
+        def changes_path(cursor):
+            return f"{self.prefix}/changes" + (f"?{urlencode({'since': cursor})}" if cursor else "")
+
+        responses = self._forward_all([changes_path(cursor) for cursor in cursors])
+        if self._first_error(responses):
+            return
+        feeds = [json.loads(body) for _, _, body in responses]
+        if any(feed["full"] for feed in feeds) and not all(feed["full"] for feed in feeds):
+            # A full resync must list every desk, so resync the other shards too
+            responses = self._forward_all([changes_path(None)] * self.pool.shards)
+            if self._first_error(responses):
+                return
+            feeds = [json.loads(body) for _, _, body in responses]
+
+        desks = {}
+        removed = []
+        for feed in feeds:
+            desks.update(feed["desks"])
+            removed.extend(feed["removed"])
+        self._send_json({
+            "cursor": self.CURSOR_SEPARATOR.join(feed["cursor"] for feed in feeds),
+            "full": feeds[0]["full"],
+            "desks": desks,
+            "removed": removed,
+        })
+
+    def _stream_events(self):
+        """GET /desks/events: merge the event streams of all shards into one, outside the worker pool."""
+        with self.pool.streams_lock:
+            refused = self.pool.streams >= self.MAX_EVENT_STREAMS
+            if not refused:
+                self.pool.streams += 1
+        if refused:
+            logger.warning("Event stream refused: %s streams are open.", self.MAX_EVENT_STREAMS)
+            self._send_json({"error": "Too many event streams"}, 503)
+            return
+        self.leave_pool()
+
+        streams = []
+        try:
+            for index in range(self.pool.shards):
+                streams.append(self.pool.open_stream(index, self.path))
+            for _, response in streams:
+                if response.status != 200:
+                    self._relay(response.status, response.getheaders(), response.read())
+                    return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            # One reader thread per shard hands over whole events; None marks a closed stream
+            events = queue.Queue()
+            for _, response in streams:
+                threading.Thread(target=self._read_events, args=(response, events), daemon=True).start()
+            last_write = time.monotonic()
+            while True:
+                event = events.get()
+                if event is None:
+                    return  # A shard dropped the stream; the client reconnects
+                if event.startswith(b":") and time.monotonic() - last_write < self.HEARTBEAT_INTERVAL_S / 2:
+                    continue  # Every shard sends heartbeats; the client needs only some of them
+                self.wfile.write(event)
+                self.wfile.flush()
+                last_write = time.monotonic()
+        except OSError as e:
+            logger.info("Event stream client disconnected: %s", e)
+        finally:
+            for connection, _ in streams:
+                connection.close()
+            with self.pool.streams_lock:
+                self.pool.streams -= 1
+
+    @staticmethod
+    def _read_events(response, events):
+        """Reader thread: put each event (lines up to a blank line) of a shard's stream on the queue."""
+        lines = []
+        try:
+            for line in iter(response.readline, b""):
+                lines.append(line)
+                if line == b"\n":
+                    events.put(b"".join(lines))
+                    lines = []
+        except (OSError, ValueError, http.client.HTTPException):
+            pass  # Closed by the router
+        events.put(None)
@@ -0,0 +1,314 @@
+import time
+import struct
+import threading
+import logging
+from multiprocessing import shared_memory
+from binary_state import BinaryStateFormat
+from fleet_snapshot import DeskSnapshot
+from desk import Desk
+
+logger = logging.getLogger(__name__)
+
+class SharedStateFormat:
+    """Layout of the shared memory region the owner of the DeskManager publishes desks to.
+
+    A header, then one fixed-size slot per desk, assigned in the order desks were added.
+    Each slot starts with a sequence word (a seqlock): the owner makes it odd before
+    rewriting the slot and even again afterwards, and a reader keeps a copy only if the
+    word was even and unchanged around it. A desk whose data does not fit its slot
+    (long strings, extra fields, more errors) is marked oversized, and readers ask the
+    owner for it instead.
+    """
+    MAGIC = b"DSKS"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHxxIIQQII")  # magic, version, capacity, slots in use, layout version,
+                                            # membership version, overflow, oversized desks
+    SEQUENCE = struct.Struct("<Q")
+    SLOT = struct.Struct("<QBBBxid32sqq32s64s64s16s" + "qi" * Desk.MAX_ERROR_COUNT)
+    # Sequence, presence, flags, error count, speed_mms, position_mm, ETag, activationsCounter,
+    # sitStandCounter, desk ID, name, manufacturer, status, then (time_s, errorCode) per error
+    RECORD = struct.Struct(SLOT.format.replace("<Q", "<", 1))  # A slot without its sequence word
+    LAYOUT_VERSION_OFFSET = 16  # Changes when slots are assigned
+    MEMBERSHIP_VERSION_OFFSET = 24  # Changes when desks are powered on or off
+    COUNTERS = struct.Struct("<II")  # overflow, oversized desks
+    COUNTERS_OFFSET = 32
+    SLOTS_IN_USE = struct.Struct("<I")
+    SLOTS_IN_USE_OFFSET = 12
+
+    # Presence bits
+    PRESENT = 1  # Powered on
+    OVERSIZED = 2
+    FLOAT_POSITION = 4
+
+    MAX_READ_ATTEMPTS = 1000  # Then the slot is read from the owner
+
+    @classmethod
+    def size(cls, capacity):
+        return cls.HEADER.size + capacity * cls.SLOT.size
+
+class SharedStateWriter:
+    """Owner side of the shared region: DeskManager calls publish() with every new snapshot.
+
+    Only one thread writes at a time, under the DeskManager lock. Desks added once the
+    region is full get no slot; the region is then marked as overflowing, and readers
+    ask the owner for desks and lists they cannot complete.
+    """
+    def __init__(self, capacity):
+        fmt = SharedStateFormat
+        self.capacity = capacity
+        self.memory = shared_memory.SharedMemory(create=True, size=fmt.size(capacity))
+        self.name = self.memory.name
+        self.buffer = self.memory.buf
+        self.slots = {}  # Desk ID -> slot index
+        self.oversized = set()
+        self.overflow = False
+        self.layout_version = 0
+        self.membership_version = 0
+        fmt.HEADER.pack_into(self.buffer, 0, fmt.MAGIC, fmt.VERSION, capacity, 0, 0, 0, 0, 0)
+        logger.info("Shared desk state created: %s, %s slots, %.1f MiB.", self.name, capacity, fmt.size(capacity) / 2**20)
+
+    def assign(self, desk_ids):
+        """Give slots to desks that have none, in order."""
+        fmt = SharedStateFormat
+        assigned = False
+        for desk_id in desk_ids:
+            if desk_id in self.slots:
+                continue
+            encoded_id = desk_id.encode("utf-8")
+            if len(self.slots) >= self.capacity or len(encoded_id) > 32:
+                if not self.overflow:
+                    logger.warning("Shared desk state cannot hold desk %s; readers will ask the owner for it.", desk_id)
+                self.overflow = True
+                continue
+            slot = self.slots[desk_id] = len(self.slots)
+            self._write(slot, self._empty_record(desk_id, 0))
+            assigned = True
+        if assigned:
+            fmt.SLOTS_IN_USE.pack_into(self.buffer, fmt.SLOTS_IN_USE_OFFSET, len(self.slots))
+            self._write_counters()
+            self.layout_version += 1
+            fmt.SEQUENCE.pack_into(self.buffer, fmt.LAYOUT_VERSION_OFFSET, self.layout_version)
+
+    def publish(self, snapshot, desk_ids):
+        """Write the given desks as they are in `snapshot`; desks missing from it are powered off or removed."""
+        fmt = SharedStateFormat
+        if any(desk_id not in self.slots for desk_id in desk_ids):
+            self.assign(snapshot.desk_ids)  # Keep the order of the desk list
+            self.assign(desk_ids)
+        membership_changed = False
+        for desk_id in desk_ids:
+            slot = self.slots.get(desk_id)
+            if slot is None:
+                continue
+            entry = snapshot.get(desk_id)
+            if entry is None:
+                record = self._empty_record(desk_id, 0)
+            else:
+                record = self._encode(desk_id, entry) or self._empty_record(desk_id, fmt.PRESENT | fmt.OVERSIZED)
+            if record[0] & fmt.OVERSIZED:
+                self.oversized.add(desk_id)
+            else:
+                self.oversized.discard(desk_id)
+            membership_changed |= bool(self._presence(slot) & fmt.PRESENT) != bool(record[0] & fmt.PRESENT)
+            self._write(slot, record)
+        self._write_counters()
+        if membership_changed:
+            self.membership_version += 1
+            fmt.SEQUENCE.pack_into(self.buffer, fmt.MEMBERSHIP_VERSION_OFFSET, self.membership_version)
+
+    @staticmethod
+    def _empty_record(desk_id, presence):
+        """Get the record of a desk whose data readers cannot serve."""
+        return (presence, 0, 0, 0, 0.0, b"", 0, 0, desk_id.encode("utf-8"), b"", b"", b"") + (0, 0) * Desk.MAX_ERROR_COUNT
+
+    def _presence(self, slot):
+        return self.buffer[SharedStateFormat.HEADER.size + slot * SharedStateFormat.SLOT.size + 8]
+
+    def _encode(self, desk_id, entry):
+        """Get the record of a powered-on desk, or None if its data does not fit a slot."""
+        fmt = SharedStateFormat
+        data = entry.data
+        config, state, usage, errors = data["config"], data["state"], data["usage"], data["lastErrors"]
+        position = state.get("position_mm")
+        integers = [state.get("speed_mms"), *usage.values(),
+                    *(value for error in errors for value in (error.get("time_s"), error.get("errorCode")))]
+        if (config.keys() != set(BinaryStateFormat.CONFIG_FIELDS) or state.keys() != BinaryStateFormat.STATE_FIELDS
+                or usage.keys() != BinaryStateFormat.USAGE_FIELDS or len(errors) > Desk.MAX_ERROR_COUNT
+                or any(error.keys() != {"time_s", "errorCode"} for error in errors)
+                or any(type(value) is not int for value in integers)
+                or type(position) not in (int, float)
+                or not all(isinstance(value, str) for value in (*config.values(), state["status"]))):
+            return None
+        strings = [value.encode("utf-8") for value in (desk_id, entry.etag, config["name"],
+                                                      config["manufacturer"], state["status"])]
+        if any(len(value) > limit for value, limit in zip(strings, (32, 32, 64, 64, 16))):
+            return None
+        flags = sum(1 << bit for bit, flag in enumerate(BinaryStateFormat.FLAGS) if state[flag])
+        presence = fmt.PRESENT | (fmt.FLOAT_POSITION if isinstance(position, float) else 0)
+        error_fields = [value for error in errors for value in (error["time_s"], error["errorCode"])]
+        error_fields += [0, 0] * (Desk.MAX_ERROR_COUNT - len(errors))
+        return (presence, flags, len(errors), state["speed_mms"], position, strings[1], usage["activationsCounter"],
+                usage["sitStandCounter"], strings[0], strings[2], strings[3], strings[4], *error_fields)
+
+    def _write(self, slot, record):
+        """Rewrite a slot under its seqlock."""
+        fmt = SharedStateFormat
+        offset = fmt.HEADER.size + slot * fmt.SLOT.size
+        sequence = fmt.SEQUENCE.unpack_from(self.buffer, offset)[0]
+        fmt.SEQUENCE.pack_into(self.buffer, offset, sequence + 1)  # Odd: being written
+        fmt.RECORD.pack_into(self.buffer, offset + fmt.SEQUENCE.size, *record)
+        fmt.SEQUENCE.pack_into(self.buffer, offset, sequence + 2)
+
+    def _write_counters(self):
+        fmt = SharedStateFormat
+        fmt.COUNTERS.pack_into(self.buffer, fmt.COUNTERS_OFFSET, int(self.overflow), len(self.oversized))
+
+    def close(self):
+        """Release and remove the region; readers still attached keep their mapping until they exit."""
+        self.buffer.release()
+        self.memory.close()
+        self.memory.unlink()
+
+class SharedStateReader:
+    """Reader side of the shared region, with the read methods of DeskManager that GET requests use.
+
+    Slots are copied under their seqlock and decoded into DeskSnapshots, which are
+    kept per slot until the desk's ETag changes, so polling an unchanged desk reuses its
+    encoding. Each desk is consistent on its own; a list of desks may combine desks
+    from consecutive snapshots.
+    """
+    def __init__(self, name):
+        fmt = SharedStateFormat
+        self.memory = shared_memory.SharedMemory(name=name)
+        self.buffer = self.memory.buf
+        magic, version, self.capacity, _, _, _, _, _ = fmt.HEADER.unpack_from(self.buffer)
+        if magic != fmt.MAGIC or version != fmt.VERSION:
+            raise ValueError(f"{name} is not a shared desk state region of version {fmt.VERSION}")
+        self.slots = {}  # Desk ID -> slot index
+        self.slots_lock = threading.Lock()
+        self.layout_version = None
+        self.desk_ids = None
+        self.membership_version = None
+        self.snapshots = {}  # Slot index -> last decoded DeskSnapshot
+
+    def _header(self, offset, layout=SharedStateFormat.SEQUENCE):
+        return layout.unpack_from(self.buffer, offset)
+
+    def _refresh_slots(self):
+        """Index the slots by desk ID after the owner assigned new ones."""
+        fmt = SharedStateFormat
+        layout_version = self._header(fmt.LAYOUT_VERSION_OFFSET)[0]
+        if layout_version == self.layout_version:
+            return
+        with self.slots_lock:
+            used = self._header(fmt.SLOTS_IN_USE_OFFSET, fmt.SLOTS_IN_USE)[0]
+            for slot in range(len(self.slots), used):
+                record = self._read(slot)
+                if record is None:
+                    return  # Retried on the next call
+                self.slots[record[8].rstrip(b"\0").decode("utf-8")] = slot
+            self.layout_version = layout_version
+
+    @property
+    def complete(self):
+        """True if every desk has a slot, so desk lists can be served from the region."""
+        fmt = SharedStateFormat
+        return not self._header(fmt.COUNTERS_OFFSET, fmt.COUNTERS)[0]
+
+    def can_serve(self, desk_id=None):
+        """True if the desk, or with no ID every desk's data, can be served from the region.
+
+        A desk without a slot is reported missing only while the region is complete.
+        """
+        fmt = SharedStateFormat
+        overflow, oversized = self._header(fmt.COUNTERS_OFFSET, fmt.COUNTERS)
+        if desk_id is None:
+            return not overflow and not oversized
+        self._refresh_slots()
+        slot = self.slots.get(desk_id)
+        if slot is None:
+            return not overflow
+        return not self.buffer[fmt.HEADER.size + slot * fmt.SLOT.size + 8] & fmt.OVERSIZED
+
+    def _read(self, slot):
+        """Copy a slot's record under its seqlock; None if the owner kept it busy for too long."""
+        fmt = SharedStateFormat
+        offset = fmt.HEADER.size + slot * fmt.SLOT.size
+        for attempt in range(fmt.MAX_READ_ATTEMPTS):
+            sequence = fmt.SEQUENCE.unpack_from(self.buffer, offset)[0]
+            if not sequence & 1:
+                record = fmt.RECORD.unpack_from(self.buffer, offset + fmt.SEQUENCE.size)
+                if fmt.SEQUENCE.unpack_from(self.buffer, offset)[0] == sequence:
+                    return record
+            time.sleep(0.0001 if attempt > 10 else 0)  # The owner may be between bytecodes of the write
+        logger.warning("Shared desk slot %s stayed busy; giving up.", slot)
+        return None
+
+    def _snapshot(self, slot):
+        """Get the DeskSnapshot of the desk in a slot, or None if it is powered off or unreadable."""
+        fmt = SharedStateFormat
+        record = self._read(slot)
+        if record is None or not record[0] & fmt.PRESENT or record[0] & fmt.OVERSIZED:
+            return None
+        etag = record[5].rstrip(b"\0").decode("utf-8")
+        snapshot = self.snapshots.get(slot)
+        if snapshot is not None and snapshot.etag == etag:
+            return snapshot
+
+        (presence, flags, error_count, speed, position, _, activations, sit_stand,
+         desk_id, name, manufacturer, status) = record[:12]
+        state = {
+            "position_mm": position if presence & fmt.FLOAT_POSITION else int(position),
+            "speed_mms": speed,
+            "status": status.rstrip(b"\0").decode("utf-8"),
+        }
+        for bit, flag in enumerate(BinaryStateFormat.FLAGS):
+            state[flag] = bool(flags & (1 << bit))
+        errors = record[12:12 + 2 * error_count]
+        data = {
+            "config": {
+                "name": name.rstrip(b"\0").decode("utf-8"),
+                "manufacturer": manufacturer.rstrip(b"\0").decode("utf-8"),
+            },
+            "state": state,
+            "usage": {"activationsCounter": activations, "sitStandCounter": sit_stand},
+            "lastErrors": [{"time_s": errors[i], "errorCode": errors[i + 1]} for i in range(0, len(errors), 2)],
+        }
+        snapshot = self.snapshots[slot] = DeskSnapshot(desk_id.rstrip(b"\0").decode("utf-8"), 0, data, etag)
+        return snapshot
+
+    def get_desk_snapshot(self, desk_id):
+        """Get the DeskSnapshot of a powered-on desk, or None."""
+        self._refresh_slots()
+        slot = self.slots.get(desk_id)
+        return self._snapshot(slot) if slot is not None else None
+
+    def get_desk_ids(self):
+        """Return the IDs of the powered-on desks, in the order of the DeskManager's list."""
+        fmt = SharedStateFormat
+        membership_version = self._header(fmt.MEMBERSHIP_VERSION_OFFSET)[0]
+        if membership_version != self.membership_version or self.desk_ids is None:
+            self._refresh_slots()
+            presence_offset = fmt.HEADER.size + 8
+            self.desk_ids = [
+                desk_id for desk_id, slot in self.slots.items()
+                if self.buffer[presence_offset + slot * fmt.SLOT.size] & fmt.PRESENT
+            ]
+            self.membership_version = membership_version
+        return list(self.desk_ids)
+
+    def get_all_desk_data(self, categories=Desk.CATEGORIES):
+        """Get the selected categories of every powered-on desk."""
+        self._refresh_slots()
+        all_data = {}
+        for desk_id, slot in self.slots.items():
+            snapshot = self._snapshot(slot)
+            if snapshot is not None:
+                data = snapshot.data
+                all_data[desk_id] = {category: data[category] for category in categories}
+        return all_data
+
+    def close(self):
+        self.snapshots.clear()
+        self.buffer.release()
+        self.memory.close()
@@ -1,18 +1,60 @@
+import io
+import os
 import json
+import math
+import http.client
 import logging
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from desk_manager import DeskManager
+from desk import Desk
+from desk_events import DeskEvent
+from position_history import HistoryDisabledError
+from pooled_http_server import PooledRequestHandler
+from metrics import CONTENT_TYPE, Histogram, Registry
+from profiling import SamplingProfiler, thread_stacks, top_allocations
+from sharding import LocalClient, relay_response
+from shared_state import SharedStateReader
 
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger(f"{__name__}.access")  # One record per request; bodies at DEBUG
 
 class SimpleRESTServer(BaseHTTPRequestHandler):
     VERSION = "v2"
     API_KEYS_FILE = "config/api_keys.json"
     API_KEYS = []
+    ADMIN_API_KEYS_FILE = "config/admin_api_keys.json"  # Keys that may also use the debug endpoints
+    ADMIN_API_KEYS = []
+    EVENTS_PATH = "events"
+    CHANGES_PATH = "changes"
+    HISTORY_PATH = "history"
+    STATS_PATH = "stats"
+    METRICS_PATH = "metrics"
+    DEBUG_PATH = "debug"
+    STREAMING = False  # A stream would block the single-threaded server
+    MAX_EVENT_STREAMS = 100  # Each stream holds a thread for its lifetime
+    PROFILING = True
+    PROFILE_FORMATS = ("collapsed", "pstats")
+    MAX_PROFILE_S = 60
+    profile_lock = threading.Lock()  # One profile at a time
+    HEARTBEAT_INTERVAL_S = 10
+    FILTERS = ("status", "manufacturer", "user_type")
+    RANGE_FILTERS = ("position_mm_gte", "position_mm_lte")
+    POWER_STATES = ("on", "off", "all")
+    REQUEST_METRICS = Registry()  # Requests served by this process
+    REQUEST_DURATION = REQUEST_METRICS.add(Histogram(
+        "simulator_http_request_duration_seconds", "Time to serve an HTTP request, by method, route and status.",
+        ("method", "route", "status")))
 
     def __init__(self, desk_manager: DeskManager, *args, **kwargs):
         self.desk_manager = desk_manager
         self.path_parts = []
+        self.query = {}
+        self.request_body = None
+        self.request_started = None
+        self.response_status = None
         super().__init__(*args, **kwargs)
 
     @staticmethod
@@ -21,35 +63,127 @@ class SimpleRESTServer(BaseHTTPRequestHandler):
         try:
             with open(api_keys_file, "r") as f:
                 keys = json.load(f)
-                logger.info(f"API keys successfully loaded from {api_keys_file}.")
+                logger.info("API keys successfully loaded from %s.", api_keys_file)
                 return keys
         except FileNotFoundError:
-            logger.error(f"API keys file not found at {api_keys_file}.")
+            logger.error("API keys file not found at %s.", api_keys_file)
             return []
         except json.JSONDecodeError as e:
-            logger.error(f"Error decoding API keys file {api_keys_file}: {e}")
+            logger.error("Error decoding API keys file %s: %s", api_keys_file, e)
             return []
 
     @classmethod
     def initialize_api_keys(cls):
-        """Class method to initialize the API_KEYS static attribute."""
+        """Class method to initialize the API_KEYS and ADMIN_API_KEYS static attributes."""
         cls.API_KEYS = cls.load_api_keys(cls.API_KEYS_FILE)
+        if os.path.exists(cls.ADMIN_API_KEYS_FILE):
+            cls.ADMIN_API_KEYS = cls.load_api_keys(cls.ADMIN_API_KEYS_FILE)
+        else:
+            logger.info("No admin API keys file at %s; debug endpoints are disabled.", cls.ADMIN_API_KEYS_FILE)
+
+    def log_message(self, format, *args):
+        """Write the request lines of http.server to the access log instead of stderr."""
+        access_logger.info("%s - " + format, self.address_string(), *args)
+
+    def parse_request(self):
+        """Reset per-request state; a keep-alive connection reuses this handler."""
+        self.request_body = None
+        self.request_started = time.perf_counter()
+        self.response_status = None
+        return super().parse_request()
+
+    def handle_one_request(self):
+        """Serve one request and observe its duration, from its request line to the end of its response."""
+        self.request_started = None
+        super().handle_one_request()
+        if self.request_started is not None and self.response_status is not None:
+            self.REQUEST_DURATION.observe(time.perf_counter() - self.request_started,
+                                          (self.command or "-", self._route_label(), str(self.response_status)))
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    def _route_label(self):
+        """Get the route of the request for metrics, e.g. /desks/{desk_id}, so that labels stay few."""
+        parts = urlsplit(getattr(self, "path", "")).path.strip("/").split("/")[3:]
+        if parts in ([self.STATS_PATH], [self.METRICS_PATH]):
+            return "/" + parts[0]
+        if parts[:1] == [self.DEBUG_PATH]:
+            return "/debug"
+        if not parts or parts[0] != "desks" or len(parts) > 3:
+            return "other"
+        if len(parts) == 1:
+            return "/desks"
+        if len(parts) == 2:
+            return "/desks/" + parts[1] if parts[1] in (self.EVENTS_PATH, self.CHANGES_PATH) else "/desks/{desk_id}"
+        return "/desks/{desk_id}/history" if parts[2] == self.HISTORY_PATH else "/desks/{desk_id}/{category}"
+
+    def _read_body(self):
+        """Read the request body once, as announced by Content-Length."""
+        if self.request_body is None:
+            content_length = int(self.headers["Content-Length"])
+            if content_length < 0:
+                raise ValueError(f"Invalid Content-Length: {content_length}")
+            self.request_body = self.rfile.read(content_length)
+        return self.request_body
+
+    def _discard_body(self):
+        """Consume an unread request body so the next request on the connection parses cleanly."""
+        if self.request_body is not None or "Content-Length" not in self.headers:
+            return
+        try:
+            self._read_body()
+        except ValueError:
+            self.close_connection = True
 
     def _send_response(self, status_code, data):
         response_body = json.dumps(data).encode("utf-8")
+        self._send_body(status_code, response_body)
+        access_logger.debug("Response sent: %s - %s", status_code, data)
+
+    def _send_body(self, status_code, response_body, etag=None, content_type="application/json"):
+        """Send an already encoded body, JSON unless another content type is given, with an ETag header if given."""
+        self._discard_body()
         self.send_response(status_code)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", content_type)
         self.send_header("Content-Length", str(len(response_body)))
+        if etag:
+            self.send_header("ETag", etag)
         self.end_headers()
         self.wfile.write(response_body)
-        logger.info(f"Response sent: {status_code} - {data}")
+
+    def _send_desk_snapshot(self, desk_snapshot, category=None):
+        """Send the cached encoding of a desk or one of its categories, or 304 if the client has it."""
+        if self._etag_matches(desk_snapshot.etag):
+            self._discard_body()
+            self.send_response(304)
+            self.send_header("ETag", desk_snapshot.etag)
+            self.end_headers()
+            access_logger.debug("Response sent: 304 - %s", self.path)
+            return
+        self._send_body(200, desk_snapshot.encode(category), desk_snapshot.etag)
+        access_logger.debug("Response sent: 200 - %s (ETag %s)", self.path, desk_snapshot.etag)
+
+    def _etag_matches(self, etag):
+        """Check the If-None-Match header against an ETag."""
+        if_none_match = self.headers.get("If-None-Match")
+        if not if_none_match or not etag:
+            return False
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate == "*" or candidate.removeprefix("W/") == etag:
+                return True
+        return False
 
     def _is_valid_path(self):
-        # Path format: /api/<version>/<api_key>/desks[/<desk_id>]
-        self.path_parts = self.path.strip("/").split("/")
+        # Path format: /api/<version>/<api_key>/desks[/<desk_id>][?<query>]
+        url = urlsplit(self.path)
+        self.path_parts = url.path.strip("/").split("/")
+        self.query = parse_qs(url.query)
 
         if len(self.path_parts) < 4 or self.path_parts[0] != "api":
-            logger.warning(f"Invalid endpoint: {self.path}")
+            logger.warning("Invalid endpoint: %s", self.path)
             self._send_response(400, {"error": "Invalid endpoint"})
             return False
 
@@ -57,99 +191,538 @@ class SimpleRESTServer(BaseHTTPRequestHandler):
         api_key = self.path_parts[2]
 
         if api_key not in self.API_KEYS:
-            logger.warning(f"Unauthorized API key: {api_key}")
+            logger.warning("Unauthorized API key: %s", api_key)
             self._send_response(401, {"error": "Unauthorized"})
             return False
 
         if version != self.VERSION:
-            logger.warning(f"Invalid API version: {version}")
+            logger.warning("Invalid API version: %s", version)
             self._send_response(400, {"error": "Invalid API version"})
             return False
 
-        logger.info(f"Valid API request: {self.path}")
+        access_logger.debug("Valid API request: %s", self.path)
         return True
 
     def do_GET(self):
         if not self._is_valid_path():
             return
 
-        logger.info(f"Handling GET request for {self.path}")
+        access_logger.debug("Handling GET request for %s", self.path)
         if self.path_parts[3] == "desks":
             if len(self.path_parts) == 4:
-                desk_ids = self.desk_manager.get_desk_ids()
-                self._send_response(200, desk_ids)
+                filters = self._desk_filters()
+                if filters is None:
+                    return
+                if "expand" in self.query:
+                    self._send_expanded_desks(filters)
+                else:
+                    desk_ids = self.desk_manager.get_desk_ids(**filters)
+                    self._send_response(200, desk_ids)
+            elif len(self.path_parts) == 5 and self.path_parts[4] == self.EVENTS_PATH:
+                self._stream_events()
+            elif len(self.path_parts) == 5 and self.path_parts[4] == self.CHANGES_PATH:
+                self._send_changes()
             elif len(self.path_parts) == 5:
                 desk_id = self.path_parts[4]
-                desk = self.desk_manager.get_desk_data(desk_id)
-                if desk:
-                    self._send_response(200, desk)
+                desk_snapshot = self.desk_manager.get_desk_snapshot(desk_id)
+                if desk_snapshot:
+                    self._send_desk_snapshot(desk_snapshot)
                 else:
-                    logger.warning(f"Desk not found: {desk_id}")
+                    logger.warning("Desk not found: %s", desk_id)
                     self._send_response(404, {"error": "Desk not found"})
+            elif len(self.path_parts) == 6 and self.path_parts[5] == self.HISTORY_PATH:
+                self._send_history(self.path_parts[4])
             elif len(self.path_parts) == 6:
                 desk_id = self.path_parts[4]
                 category = self.path_parts[5]
-                data = self.desk_manager.get_desk_category(desk_id, category)
-                if data:
-                    self._send_response(200, data)
+                desk_snapshot = self.desk_manager.get_desk_snapshot(desk_id)
+                if desk_snapshot and desk_snapshot.data.get(category):
+                    self._send_desk_snapshot(desk_snapshot, category)
                 else:
-                    logger.warning(f"Category not found: {category} for desk {desk_id}")
+                    logger.warning("Category not found: %s for desk %s", category, desk_id)
                     self._send_response(404, {"error": "Category not found"})
             else:
-                logger.warning(f"Invalid path structure for GET: {self.path}")
+                logger.warning("Invalid path structure for GET: %s", self.path)
                 self._send_response(400, {"error": "Invalid path"})
+        elif self.path_parts[3:] == [self.STATS_PATH]:
+            self._send_stats()
+        elif self.path_parts[3:] == [self.METRICS_PATH]:
+            self._send_metrics()
+        elif self.path_parts[3] == self.DEBUG_PATH:
+            self._send_debug()
         else:
-            logger.warning(f"Invalid endpoint for GET: {self.path}")
+            logger.warning("Invalid endpoint for GET: %s", self.path)
             self._send_response(400, {"error": "Invalid endpoint"})
 
+    def _desk_filters(self):
+        """Get the desk list filters of the query, e.g. GET /desks?status=Collision&position_mm_gte=1000.
+
+        Returns None after sending 400 if a filter is invalid.
+        """
+        filters = {}
+        for name in self.FILTERS:
+            if name in self.query:
+                filters[name] = [value for values in self.query[name] for value in values.split(",") if value]
+        try:
+            for name in self.RANGE_FILTERS:
+                if name in self.query:
+                    filters[name] = float(self.query[name][-1])
+                    if not math.isfinite(filters[name]):
+                        raise ValueError(f"Not a finite position: {filters[name]}")
+        except ValueError:
+            logger.warning("Invalid position filter for GET: %s", self.path)
+            self._send_response(400, {"error": "Invalid filter"})
+            return None
+        if "power" in self.query:
+            power = self.query["power"][-1]
+            if power not in self.POWER_STATES:
+                logger.warning("Invalid power filter for GET: %s", self.path)
+                self._send_response(400, {"error": "Invalid filter"})
+                return None
+            filters["power"] = power
+        return filters
+
+    def _send_expanded_desks(self, filters):
+        """Send the selected categories of all desks, e.g. GET /desks?expand=state,usage."""
+        categories = [
+            category
+            for value in self.query["expand"]
+            for category in value.split(",")
+            if category
+        ]
+        invalid_categories = [category for category in categories if category not in Desk.CATEGORIES]
+        if not categories or invalid_categories:
+            logger.warning("Invalid expand categories for GET: %s", self.path)
+            self._send_response(400, {"error": "Invalid category"})
+            return
+
+        desks = self.desk_manager.get_all_desk_data(tuple(dict.fromkeys(categories)), **filters)
+        self._send_response(200, desks)
+
+    def _send_changes(self):
+        """Send the desks that changed since a cursor, e.g. GET /desks/changes?since=<cursor>."""
+        since = self.query.get("since", [None])[-1]
+        cursor, full, desks, removed = self.desk_manager.get_changes(since)
+        if since and full:
+            logger.info("Change cursor %s is unknown or expired; sending a full resync.", since)
+        self._send_response(200, {"cursor": cursor, "full": full, "desks": desks, "removed": removed})
+
+    def _send_history(self, desk_id):
+        """Send the position history of a desk, e.g. GET /desks/<id>/history?from=0&to=86400&resolution=60."""
+        try:
+            start, end, resolution = (
+                int(self.query[name][-1]) if name in self.query else None
+                for name in ("from", "to", "resolution")
+            )
+            history = self.desk_manager.get_position_history(desk_id, start, end, resolution)
+        except ValueError:
+            logger.warning("Invalid history range for GET: %s", self.path)
+            self._send_response(400, {"error": "Invalid history range"})
+            return
+        except HistoryDisabledError:
+            self._send_response(501, {"error": "Position history is disabled; start with --history-samples N"})
+            return
+        if history is None:
+            logger.warning("Desk not found: %s", desk_id)
+            self._send_response(404, {"error": "Desk not found"})
+            return
+        self._send_response(200, history)
+
+    def _send_stats(self):
+        """Send the fleet usage aggregates, e.g. GET /stats, or one desk's with GET /stats?desk_id=<id>."""
+        desk_id = self.query.get("desk_id", [None])[-1]
+        stats = self.desk_manager.get_stats(desk_id)
+        if stats is None:
+            logger.warning("Desk not found: %s", desk_id)
+            self._send_response(404, {"error": "Desk not found"})
+            return
+        self._send_response(200, stats)
+
+    def _send_metrics(self):
+        """Send the simulation and request metrics in the Prometheus text format, e.g. GET /metrics."""
+        metrics = self.desk_manager.get_metrics() + self.REQUEST_METRICS.render()
+        self._send_body(200, metrics.encode("utf-8"), content_type=CONTENT_TYPE)
+
+    def _send_debug(self):
+        """Send diagnostics of this process to admin API keys: GET /debug/profile, /debug/allocations or /debug/threads."""
+        if self.path_parts[2] not in self.ADMIN_API_KEYS:
+            logger.warning("Debug endpoint refused for API key: %s", self.path_parts[2])
+            self._send_response(403, {"error": "Forbidden"})
+            return
+        endpoint = self.path_parts[4:]
+        if endpoint == ["profile"]:
+            self._send_profile()
+        elif endpoint == ["allocations"]:
+            try:
+                limit = int(self.query.get("limit", ["20"])[-1])
+            except ValueError:
+                limit = 0
+            group_by = self.query.get("group_by", ["lineno"])[-1]
+            if limit < 1 or group_by not in ("lineno", "filename"):
+                logger.warning("Invalid allocation parameters for GET: %s", self.path)
+                self._send_response(400, {"error": "Invalid allocation parameters"})
+                return
+            self._send_response(200, top_allocations(limit, group_by, stop="stop" in self.query))
+        elif endpoint == ["threads"]:
+            self._send_response(200, {"threads": thread_stacks()})
+        else:
+            logger.warning("Invalid debug endpoint for GET: %s", self.path)
+            self._send_response(400, {"error": "Invalid endpoint"})
+
+    def _send_profile(self):
+        """Sample the threads of this process for some seconds, e.g. GET /debug/profile?seconds=10&format=pstats."""
+        if not self.PROFILING:
+            self._send_response(501, {"error": "Profiling requires the pooled or single server mode"})
+            return
+        try:
+            seconds = float(self.query.get("seconds", ["10"])[-1])
+        except ValueError:
+            seconds = 0
+        output = self.query.get("format", ["collapsed"])[-1]
+        if not 0 < seconds <= self.MAX_PROFILE_S or output not in self.PROFILE_FORMATS:
+            logger.warning("Invalid profile parameters for GET: %s", self.path)
+            self._send_response(400, {"error": "Invalid profile parameters"})
+            return
+        if not self.profile_lock.acquire(blocking=False):
+            self._send_response(409, {"error": "A profile is already running"})
+            return
+        try:
+            logger.info("Profiling for %s s.", seconds)
+            profiler = SamplingProfiler()
+            profiler.run(seconds)
+        finally:
+            self.profile_lock.release()
+        if output == "pstats":
+            self._send_body(200, profiler.pstats(), content_type="application/octet-stream")
+        else:
+            self._send_body(200, profiler.collapsed().encode("utf-8"), content_type="text/plain; charset=utf-8")
+
+    def _stream_events(self):
+        """Stream desk changes as Server-Sent Events, e.g. GET /desks/events?desk_id=<id>,<id>."""
+        subscription = self._open_event_stream()
+        if subscription is None:
+            return
+        try:
+            while not subscription.overflowed:
+                batch = subscription.get(self.HEARTBEAT_INTERVAL_S)
+                if batch is None:
+                    self.wfile.write(b": keep-alive\n\n")
+                else:
+                    self._write_events(*batch)
+        except OSError as e:
+            logger.info("Event stream client disconnected: %s", e)
+        finally:
+            self.desk_manager.events.unsubscribe(subscription)
+
+    def _open_event_stream(self):
+        """Subscribe to desk changes and send the stream headers and the current state.
+
+        Returns the subscription, or None if the stream was refused or the client left.
+        """
+        if not self.STREAMING:
+            self._send_response(501, {"error": "Event streams require the pooled or async server mode"})
+            return None
+        if len(self.desk_manager.events.subscriptions) >= self.MAX_EVENT_STREAMS:
+            logger.warning("Event stream refused: %s streams are open.", self.MAX_EVENT_STREAMS)
+            self._send_response(503, {"error": "Too many event streams"})
+            return None
+
+        desk_ids = [desk_id for value in self.query.get("desk_id", []) for desk_id in value.split(",") if desk_id]
+        subscription = self.desk_manager.events.subscribe(desk_ids)
+        try:
+            self._discard_body()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+
+            # Start with the full state of every matching desk, then send deltas
+            snapshot = self.desk_manager.snapshot
+            self._write_events(snapshot.version, [
+                DeskEvent(DeskEvent.ONLINE, desk_id, {"state": snapshot.desks[desk_id].data["state"]})
+                for desk_id in snapshot.desk_ids
+                if subscription.wants(desk_id)
+            ])
+        except OSError as e:
+            logger.info("Event stream client disconnected: %s", e)
+            self.desk_manager.events.unsubscribe(subscription)
+            return None
+        return subscription
+
+    def _write_events(self, version, events):
+        """Write a batch of desk events in Server-Sent Events format."""
+        chunks = [
+            f"id: {version}\nevent: {event.event}\ndata: {event.to_json()}\n\n".encode("utf-8")
+            for event in events
+        ]
+        self.wfile.write(b"".join(chunks))
+        self.wfile.flush()
+
     def do_PUT(self):
         if not self._is_valid_path():
             return
 
-        logger.info(f"Handling PUT request for {self.path}")
+        access_logger.debug("Handling PUT request for %s", self.path)
         if self.path_parts[3] == "desks":
-            if len(self.path_parts) == 6:
+            if len(self.path_parts) == 4:
+                self._update_desks_batch()
+            elif len(self.path_parts) == 6:
                 # Update a specific category of a specific desk
                 try:
-                    content_length = int(self.headers["Content-Length"])
-                    post_data = self.rfile.read(content_length)
-                    update_data = json.loads(post_data)
+                    update_data = json.loads(self._read_body())
                     desk_id = self.path_parts[4]
                     category = self.path_parts[5]
-                    success = self.desk_manager.update_desk_category(desk_id, category, update_data)
-                    if success:
-                        current_target_position = self.desk_manager.get_desk(desk_id).get_target_position()
+                    # Read under the same lock, so a concurrent power-off or removal cannot lose the desk
+                    current_target_position = self.desk_manager.update_desk_category(desk_id, category, update_data)
+                    if current_target_position is not None:
                         response_data = {
                             "position_mm": current_target_position
                         }
                         self._send_response(200, response_data)
                     else:
-                        logger.warning(f"Update failed: Category {category} or desk {desk_id} not found.")
+                        logger.warning("Update failed: Category %s or desk %s not found.", category, desk_id)
                         self._send_response(404, {"error": "Category not found or desk not found"})
                 except ValueError:
-                    logger.error(f"Invalid data format for PUT: {self.path}")
+                    logger.error("Invalid data format for PUT: %s", self.path)
                     self._send_response(400, {"error": "Invalid data"})
                 except TypeError:
-                    logger.error(f"Invalid data type for PUT: {self.path}")
+                    logger.error("Invalid data type for PUT: %s", self.path)
                     self._send_response(400, {"error": "Invalid type"})
             else:
-                logger.warning(f"Invalid path structure for PUT: {self.path}")
+                logger.warning("Invalid path structure for PUT: %s", self.path)
                 self._send_response(400, {"error": "Invalid path"})
         else:
-            logger.warning(f"Invalid endpoint for PUT: {self.path}")
+            logger.warning("Invalid endpoint for PUT: %s", self.path)
             self._send_response(400, {"error": "Invalid endpoint"})
 
+    def _update_desks_batch(self):
+        """Move many desks in one request: body is a list of {"desk_id", "position_mm"} objects."""
+        try:
+            update_data = json.loads(self._read_body())
+        except ValueError:
+            logger.error("Invalid data format for PUT: %s", self.path)
+            self._send_response(400, {"error": "Invalid data"})
+            return
+        except TypeError:
+            logger.error("Invalid data type for PUT: %s", self.path)
+            self._send_response(400, {"error": "Invalid type"})
+            return
+
+        valid_items = isinstance(update_data, list) and all(
+            isinstance(item, dict)
+            and isinstance(item.get("desk_id"), str)
+            and isinstance(item.get("position_mm"), (int, float))
+            and not isinstance(item.get("position_mm"), bool)
+            for item in update_data
+        )
+        if not valid_items:
+            logger.error("Invalid data type for batch PUT: %s", self.path)
+            self._send_response(400, {"error": "Invalid type"})
+            return
+
+        updates = [(item["desk_id"], {"position_mm": item["position_mm"]}) for item in update_data]
+        target_positions = self.desk_manager.update_desks_category("state", updates)
+
+        response_data = []
+        for (desk_id, _), target_position in zip(updates, target_positions):
+            if target_position is None:
+                logger.warning("Batch update failed: desk %s not found.", desk_id)
+                response_data.append({"desk_id": desk_id, "error": "Desk not found"})
+            else:
+                response_data.append({"desk_id": desk_id, "position_mm": target_position})
+        self._send_response(200, response_data)
+
     def do_POST(self):
         """Handle unsupported POST method."""
-        logger.warning(f"POST method not allowed: {self.path}")
+        logger.warning("POST method not allowed: %s", self.path)
         self._send_response(405, {"error": "Method Not Allowed"})
 
     def do_DELETE(self):
         """Handle unsupported DELETE method."""
-        logger.warning(f"DELETE method not allowed: {self.path}")
+        logger.warning("DELETE method not allowed: %s", self.path)
         self._send_response(405, {"error": "Method Not Allowed"})
 
     def do_PATCH(self):
         """Handle unsupported PATCH method."""
-        logger.warning(f"PATCH method not allowed: {self.path}")
+        logger.warning("PATCH method not allowed: %s", self.path)
         self._send_response(405, {"error": "Method Not Allowed"})
+
+
+class KeepAliveRESTServer(PooledRequestHandler, SimpleRESTServer):
+    """HTTP/1.1 variant of SimpleRESTServer that keeps connections open between requests.
+
+    Served by a PooledHTTPServer, whose workers serve requests rather than connections;
+    an event stream leaves the pool for its lifetime.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = 15  # Longest wait for the rest of a request once it has started
+    disable_nagle_algorithm = True  # Headers and body are written separately; don't let Nagle delay the body
+    STREAMING = True
+
+    def _open_event_stream(self):
+        subscription = super()._open_event_stream()
+        if subscription is not None:
+            self.leave_pool()
+        return subscription
+
+
+class AsyncRESTServer(KeepAliveRESTServer):
+    """Variant of KeepAliveRESTServer for the asyncio runtime (see async_runtime.py).
+
+    The runtime reads one whole request from the connection and passes its bytes as
+    the request; the handler serves it from memory and leaves the response in `wfile`
+    for the runtime to write. An event stream is only opened here: the runtime then
+    sends its batches from the event loop.
+    """
+    MAX_EVENT_STREAMS = 1000
+    PROFILING = False  # The profile would block the event loop it should sample
+
+    def __init__(self, desk_manager: DeskManager, *args, **kwargs):
+        self.event_subscription = None
+        super().__init__(desk_manager, *args, **kwargs)
+
+    def setup(self):
+        self.rfile = io.BytesIO(self.request)
+        self.wfile = io.BytesIO()
+
+    def handle(self):
+        self.handle_one_request()
+
+    def finish(self):
+        pass
+
+    def leave_pool(self):
+        pass  # The runtime sends the stream from the event loop
+
+    def _stream_events(self):
+        self.event_subscription = self._open_event_stream()
+
+
+class InProcessRESTServer(AsyncRESTServer):
+    """Variant of AsyncRESTServer that serves requests made by other code of its process.
+
+    A ShardRouter sends the requests for its own shard this way, without a round trip
+    through a local port. Event streams are not served: they need a connection.
+    """
+    PROFILING = True  # A profile blocks only the worker that asked for it
+
+    @classmethod
+    def send(cls, desk_manager: DeskManager, method, path, body=None, headers=None):
+        """Serve a request; returns (status, headers, body), like LocalClient.send."""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        lines = [f"{method} {path} HTTP/1.1", "Host: 127.0.0.1"]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        if body is not None:
+            lines.append(f"Content-Length: {len(body)}")
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+        handler = cls(desk_manager, request, ("127.0.0.1", 0), None)
+        response = http.client.HTTPResponse(_Response(handler.wfile.getvalue()))
+        response.begin()
+        return response.status, response.getheaders(), response.read()
+
+
+class _Response:
+    """The socket http.client.HTTPResponse reads an in-process response from."""
+    def __init__(self, data):
+        self.data = data
+
+    def makefile(self, mode):
+        return io.BytesIO(self.data)
+
+
+class ReaderRESTServer(KeepAliveRESTServer):
+    """Variant of KeepAliveRESTServer for reader processes (see shared_state.py).
+
+    GET requests for the desk list and for single desks are served from the shared
+    desk state, without a round trip to the process that runs the simulation. Updates,
+    filtered desk lists, the change feed, event streams, position histories, stats,
+    metrics, debug requests and desks the shared state cannot hold are forwarded to that
+    process, which answers on `owner_port`.
+    """
+    OWNER = LocalClient()
+    FORWARDED_HEADERS = ("Content-Type", "If-None-Match")
+    STREAM_CHUNK_BYTES = 65536
+    event_streams = 0
+    event_streams_lock = threading.Lock()
+
+    def __init__(self, desk_state: SharedStateReader, owner_port, *args, **kwargs):
+        self.owner_port = owner_port
+        super().__init__(desk_state, *args, **kwargs)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts[3:] in ([self.STATS_PATH], [self.METRICS_PATH]) or parts[3:4] == [self.DEBUG_PATH]:
+            local = False
+        elif len(parts) < 4 or parts[3] != "desks" or len(parts) > 6:
+            local = True  # Errors
+        elif len(parts) == 4:
+            query = parse_qs(url.query)
+            if any(name in query for name in self.FILTERS + self.RANGE_FILTERS + ("power",)):
+                local = False  # The desk index lives in the owner process
+            else:
+                local = self.desk_manager.can_serve() if "expand" in query else self.desk_manager.complete
+        else:
+            local = parts[4] not in (self.EVENTS_PATH, self.CHANGES_PATH) and parts[5:] != [self.HISTORY_PATH] and \
+                self.desk_manager.can_serve(parts[4])
+
+        if local:
+            super().do_GET()
+        elif parts[4:] == [self.EVENTS_PATH]:
+            self._forward_stream()
+        else:
+            self._forward()
+
+    def do_PUT(self):
+        self._forward()
+
+    do_POST = do_DELETE = do_PATCH = do_PUT
+
+    def _forward(self):
+        """Send the request to the owner process and relay its response."""
+        try:
+            body = self._read_body() if "Content-Length" in self.headers else None
+        except ValueError:
+            logger.error("Invalid Content-Length for %s: %s", self.command, self.path)
+            self._send_response(400, {"error": "Invalid data"})
+            return
+        headers = {name: self.headers[name] for name in self.FORWARDED_HEADERS if name in self.headers}
+        relay_response(self, *self.OWNER.send(self.owner_port, self.command, self.path, body, headers))
+
+    def _forward_stream(self):
+        """Relay an event stream from the owner process until either side closes it."""
+        with self.event_streams_lock:
+            refused = ReaderRESTServer.event_streams >= self.MAX_EVENT_STREAMS
+            if not refused:
+                ReaderRESTServer.event_streams += 1
+        if refused:
+            logger.warning("Event stream refused: %s streams are open.", self.MAX_EVENT_STREAMS)
+            self._send_response(503, {"error": "Too many event streams"})
+            return
+        self.leave_pool()
+
+        connection = None
+        try:
+            connection, response = self.OWNER.open_stream(self.owner_port, self.path)
+            if response.status != 200:
+                relay_response(self, response.status, response.getheaders(), response.read())
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            while chunk := response.read1(self.STREAM_CHUNK_BYTES):
+                self.wfile.write(chunk)
+                self.wfile.flush()
+        except OSError as e:
+            logger.info("Event stream client disconnected: %s", e)
+        finally:
+            if connection is not None:
+                connection.close()
+            with self.event_streams_lock:
+                ReaderRESTServer.event_streams -= 1
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import queue
+import threading
+import logging
+from binary_state import BinaryStateReader, is_binary_state_file, write_binary_state
+
+logger = logging.getLogger(__name__)
+
+def write_file_atomically(path, write, mode="w"):
+    """Write a file through a temporary file and a rename, so readers never see a partial file."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, mode) as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def finalize_clock(entry, entry_time_s, current_time_s, simulation_speed):
+    """Get the desk entry with its clock advanced by the ticks since it was recorded."""
+    # The desk clock stands still while the desk is powered off
+    if entry.get("powered_off") or current_time_s <= entry_time_s:
+        return entry
+    ticks = (current_time_s - entry_time_s) // simulation_speed
+    return {**entry, "desk_data": {**entry["desk_data"], "clock_s": entry["desk_data"]["clock_s"] + ticks}}
+
+def write_state(path, state):
+    """Write a state in the state file format, as JSON or as binary for a .bin path."""
+    if is_binary_state_file(path):
+        write_file_atomically(path, lambda f: write_binary_state(f, state), "wb")
+    else:
+        write_file_atomically(path, lambda f: json.dump(state, f))
+
+class SavedState:
+    """A state file and the journal written after it, as read by read_state.
+
+    `meta` holds current_time_s, simulation_speed and journal_version. For a binary
+    state file, `reader` is its BinaryStateReader, so a loader can decode the records
+    in bulk; `replaced` maps the IDs of the desks the journal changed to
+    (entry or None if removed, time recorded), and takes precedence over the state file.
+    """
+    def __init__(self, meta, base_time_s, desks, reader, replaced):
+        self.meta = meta
+        self.base_time_s = base_time_s
+        self.desks = desks
+        self.reader = reader
+        self.replaced = replaced
+
+    def ticks_since_saved(self):
+        """Desk clock ticks between the state file's time and current_time_s."""
+        return max(self.meta["current_time_s"] - self.base_time_s, 0) // self.meta["simulation_speed"]
+
+    def entries(self):
+        """Yield (desk_id, entry) in the state file format, with desk clocks advanced to current_time_s.
+
+        Binary state files are decoded one desk at a time.
+        """
+        current_time_s = self.meta["current_time_s"]
+        simulation_speed = self.meta["simulation_speed"]
+        replaced = dict(self.replaced)
+        for desk_id, entry in self.reader if self.reader is not None else self.desks.items():
+            entry_time_s = self.base_time_s
+            if desk_id in replaced:
+                entry, entry_time_s = replaced.pop(desk_id)
+                if entry is None:
+                    continue
+            yield desk_id, finalize_clock(entry, entry_time_s, current_time_s, simulation_speed)
+        for desk_id, (entry, entry_time_s) in replaced.items():
+            if entry is not None:
+                yield desk_id, finalize_clock(entry, entry_time_s, current_time_s, simulation_speed)
+
+    def journal_entries(self):
+        """Yield (desk_id, entry) of the desks the journal added or changed, with desk clocks advanced."""
+        for desk_id, (entry, entry_time_s) in self.replaced.items():
+            if entry is not None:
+                yield desk_id, finalize_clock(entry, entry_time_s, self.meta["current_time_s"], self.meta["simulation_speed"])
+
+    def removed_ids(self):
+        """Get the IDs of the desks the journal removed."""
+        return {desk_id for desk_id, (entry, _) in self.replaced.items() if entry is None}
+
+    def to_state(self):
+        """Get the whole state in the state file format."""
+        state = dict(self.entries())
+        state.update(self.meta)
+        return state
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+
+def read_state(state_file, journal_file):
+    """Read the state file and replay the journal written after it.
+
+    Returns a SavedState, or None if neither file exists. A torn last journal line,
+    left by a crash in the middle of a write, ends the replay.
+    """
+    if not os.path.exists(state_file) and not os.path.exists(journal_file):
+        return None
+
+    desks = {}
+    reader = None
+    meta = {}
+    if os.path.exists(state_file):
+        if is_binary_state_file(state_file):
+            reader = BinaryStateReader(state_file)
+            meta = dict(reader.meta)
+        else:
+            with open(state_file, "r") as f:
+                desks = json.load(f)
+            meta = {key: desks.pop(key) for key in StateJournal.META_KEYS if key in desks}
+    base_time_s = meta.get("current_time_s", 43200)
+    meta.setdefault("simulation_speed", 60)
+    meta.setdefault("current_time_s", base_time_s)
+    meta.setdefault("journal_version", 0)
+
+    # Journal entries replace the state file entries: desk ID -> (entry or None, time recorded)
+    replaced = {}
+    if os.path.exists(journal_file):
+        with open(journal_file, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Journal %s ends with a partial record; ignoring it.", journal_file)
+                    break
+                if record["v"] < meta["journal_version"]:
+                    continue
+                meta["current_time_s"] = record["t"]
+                meta["journal_version"] = record["v"]
+                for desk_id, entry in record.get("desks", {}).items():
+                    replaced[desk_id] = (entry, record["t"])
+    if replaced:
+        logger.info("Replayed %s desk changes from %s.", len(replaced), journal_file)
+
+    return SavedState(meta, base_time_s, desks, reader, replaced)
+
+class StateJournal:
+    """Background persistence of desk changes.
+
+    Each published snapshot hands its changed desks to `record`, which only queues
+    them. A writer thread appends them as JSON lines to the journal and fsyncs once
+    per flush interval, so durability costs follow the volume of changes. Compaction
+    periodically replays the journal over the state file, writes the result through
+    an atomic rename and truncates the journal, without touching the manager or its lock.
+    """
+    META_KEYS = ("current_time_s", "simulation_speed", "journal_version")
+    FLUSH_INTERVAL_S = 1
+    COMPACT_AFTER_CHANGES = 20000
+    COMPACT_INTERVAL_S = 600
+
+    def __init__(self, state_file, journal_file, version, current_time_s, time_source):
+        """`version` is the snapshot version the state file and journal are up to; `time_source` returns current_time_s."""
+        self.state_file = state_file
+        self.journal_file = journal_file
+        self.time_source = time_source
+        self.version = version
+        self.current_time_s = current_time_s
+        self.pending = queue.Queue()
+        self.changes_since_compaction = 0
+        self.last_compaction = time.monotonic()
+        self.journal = None
+        self.thread = None
+
+    def start(self):
+        """Start the writer thread."""
+        self.thread = threading.Thread(target=self._run, name="state-journal", daemon=True)
+        self.thread.start()
+        logger.info("State journal started at %s.", self.journal_file)
+
+    def record(self, version, current_time_s, entries):
+        """Queue the changed desks of a snapshot version; None as an entry removes the desk."""
+        self.pending.put((version, current_time_s, entries))
+
+    def close(self):
+        """Write the remaining changes and a final compacted state file."""
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+        self.compact()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        logger.info("State journal closed.")
+
+    def _run(self):
+        """Writer loop: append queued changes, fsync, and compact when the journal is large or old."""
+        while True:
+            try:
+                batches = [self.pending.get(timeout=self.FLUSH_INTERVAL_S)]
+            except queue.Empty:
+                batches = []
+            while True:
+                try:
+                    batches.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            closing = None in batches
+            batches = [batch for batch in batches if batch is not None]
+            current_time_s = self.time_source()
+            if not batches and current_time_s != self.current_time_s:
+                # Record the passing time, so desk clocks can be advanced after a crash
+                batches.append((self.version, current_time_s, {}))
+            try:
+                if batches:
+                    self._append(batches)
+                if self.changes_since_compaction >= self.COMPACT_AFTER_CHANGES or (
+                    self.changes_since_compaction
+                    and time.monotonic() - self.last_compaction >= self.COMPACT_INTERVAL_S
+                ):
+                    self.compact()
+            except (OSError, ValueError) as e:
+                logger.error("Failed to write the state journal: %s", e)
+            if closing:
+                return
+
+    def _append(self, batches):
+        """Append batches to the journal and fsync it."""
+        if self.journal is None:
+            self.journal = open(self.journal_file, "a")
+        lines = []
+        for version, current_time_s, entries in batches:
+            lines.append(json.dumps({"v": version, "t": current_time_s, "desks": entries}) + "\n")
+            self.version = version
+            self.current_time_s = current_time_s
+            self.changes_since_compaction += len(entries)
+        self.journal.write("".join(lines))
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def compact(self):
+        """Replace the state file with the journal replayed over it, and start a new, empty journal."""
+        saved = read_state(self.state_file, self.journal_file)
+        if saved is None:
+            return
+        try:
+            state = saved.to_state()
+        finally:
+            saved.close()
+        write_state(self.state_file, state)
+
+        # Journal records up to journal_version are now in the state file
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_file, "w")
+        self.changes_since_compaction = 0
+        self.last_compaction = time.monotonic()
+        logger.info("State compacted to %s (%s desks).", self.state_file, len(state) - len(self.META_KEYS))
@@ -1,4 +1,5 @@
 from enum import Enum
+import math
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,6 +12,8 @@ class UserType(Enum):
 
 class UserBehavior:
     """Base class for user behaviors."""
+    __slots__ = ("desk",)
+
     def __init__(self, desk):
         self.desk = desk
 
@@ -18,11 +21,28 @@ class UserBehavior:
         """Simulate user behavior. Override in subclasses."""
         pass
 
+    def first_action_s(self, now_s):
+        """Simulated time at which the user first acts."""
+        return now_s
+
+    def act(self, now_s, seconds_per_tick):
+        """Perform a scheduled action. Return the simulated time of the next one, or None to sleep until woken."""
+        return None
+
+    def _arrival_s(self, now_s, seconds_per_tick):
+        """Simulated time by which the desk should have reached its target."""
+        distance = abs(self.desk.get_target_position() - self.desk.state["position_mm"])
+        # One extra tick covers the tick a collision makes the desk skip
+        ticks = math.ceil(distance / self.desk.DEFAULT_SPEED_MMS) + 1
+        return now_s + ticks * seconds_per_tick
+
     def __repr__(self):
         return f"{self.__class__.__name__}(desk_id={self.desk.desk_id})"
 
 class SeatedUser(UserBehavior):
     """User who always keeps the desk in a seated position."""
+    __slots__ = ("preferred_position",)
+
     def __init__(self, desk, preferred_position=0):
         super().__init__(desk)
         if preferred_position < desk.min_position or preferred_position > desk.max_position:
@@ -32,11 +52,20 @@ class SeatedUser(UserBehavior):
 
     def simulate(self, time_delta_s):
         if self.desk.state["position_mm"] > self.preferred_position:
-            logger.info(f"SeatedUser adjusting desk {self.desk.desk_id} to seated position {self.preferred_position}.")
+            logger.info("SeatedUser adjusting desk %s to seated position %s.", self.desk.desk_id, self.preferred_position)
             self.desk.set_target_position(self.preferred_position)
 
+    def act(self, now_s, seconds_per_tick):
+        """Lower the desk if it drifted up, then check again once it should have arrived."""
+        if self.desk.state["position_mm"] <= self.preferred_position:
+            return None
+        self.simulate(0)
+        return self._arrival_s(now_s, seconds_per_tick)
+
 class StandingUser(UserBehavior):
     """User who always keeps the desk in a standing position."""
+    __slots__ = ("preferred_position",)
+
     def __init__(self, desk, preferred_position=0):
         super().__init__(desk)
         if preferred_position < desk.min_position or preferred_position > desk.max_position:
@@ -46,11 +75,20 @@ class StandingUser(UserBehavior):
 
     def simulate(self, time_delta_s):
         if self.desk.state["position_mm"] < self.preferred_position:
-            logger.info(f"StandingUser adjusting desk {self.desk.desk_id} to standing position {self.preferred_position}.")
+            logger.info("StandingUser adjusting desk %s to standing position %s.", self.desk.desk_id, self.preferred_position)
             self.desk.set_target_position(self.preferred_position)
 
+    def act(self, now_s, seconds_per_tick):
+        """Raise the desk if it drifted down, then check again once it should have arrived."""
+        if self.desk.state["position_mm"] >= self.preferred_position:
+            return None
+        self.simulate(0)
+        return self._arrival_s(now_s, seconds_per_tick)
+
 class ActiveUser(UserBehavior):
     """User who moves between seated and standing positions a few times a day."""
+    __slots__ = ("position_cycle_time_s", "seated_position", "standing_position", "next_position", "cycle_timer")
+
     def __init__(self, desk, position_cycle_time_s=3600, seated_position=0, standing_position=0):
         super().__init__(desk)
 
@@ -72,8 +110,20 @@ class ActiveUser(UserBehavior):
         self.cycle_timer = (self.cycle_timer + time_delta_s) % self.position_cycle_time_s
 
         if self.cycle_timer < time_delta_s:
-            self.next_position = (
-                self.standing_position if self.desk.state["position_mm"] <= self.seated_position else self.seated_position
-            )
-            logger.info(f"ActiveUser adjusting desk {self.desk.desk_id} to {'standing' if self.next_position == self.standing_position else 'seated'} position {self.next_position}.")
-            self.desk.set_target_position(self.next_position)
+            self._switch_position()
+
+    def _switch_position(self):
+        self.next_position = (
+            self.standing_position if self.desk.state["position_mm"] <= self.seated_position else self.seated_position
+        )
+        logger.info("ActiveUser adjusting desk %s to %s position %s.", self.desk.desk_id,
+                    "standing" if self.next_position == self.standing_position else "seated", self.next_position)
+        self.desk.set_target_position(self.next_position)
+
+    def first_action_s(self, now_s):
+        return now_s + self.position_cycle_time_s
+
+    def act(self, now_s, seconds_per_tick):
+        """Switch between seated and standing once per cycle."""
+        self._switch_position()
+        return now_s + self.position_cycle_time_s
@@ -0,0 +1,25 @@
+import os
+import sys
+import socket
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "simulator"))
+
+from pooled_http_server import PooledHTTPServer, PooledRequestHandler
+
+class Handler(PooledRequestHandler, BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+class PooledHTTPServerTest(unittest.TestCase):
+    def test_bind_failure_raises_the_bind_error(self):
+        with socket.create_server(("127.0.0.1", 0)) as occupied:
+            threads = threading.active_count()
+            with self.assertRaises(OSError):
+                PooledHTTPServer(occupied.getsockname(), Handler, workers=2)
+            self.assertEqual(threading.active_count(), threads)  # No worker or idle thread was left behind
+
+if __name__ == "__main__":
+    unittest.main()